@@ -3,7 +3,10 @@ import os
 import logging
 from dotenv import load_dotenv
 from app.handler import process_issue_event
-from src.gitlab_integration import BOT_SIGNATURE
+from src.google_ai_integration import warm_up_models
+from src.gitlab_integration import BOT_SIGNATURE, merge_webhook_notes
+from src.job_queue import JobQueue
+from src.delivery_dedup import DeliveryDeduplicator, delivery_keys
 
 load_dotenv()
 
@@ -17,6 +20,81 @@ APP_GITLAB_URL = os.getenv('APP_GITLAB_URL', 'https://gitlab.com')
 APP_TARGET_GITLAB_TOKEN = os.getenv('APP_TARGET_GITLAB_TOKEN')
 APP_GOOGLE_AI_API_KEY = os.getenv('APP_GOOGLE_AI_API_KEY')
 GITLAB_WEBHOOK_SECRET = os.getenv('GITLAB_WEBHOOK_SECRET')
+JOB_QUEUE_CONCURRENCY = int(os.getenv('JOB_QUEUE_CONCURRENCY', '4'))
+JOB_QUEUE_DB_PATH = os.getenv('JOB_QUEUE_DB_PATH')  # Set to persist accepted events across restarts
+# Issue/note events for the same issue arriving within this window are processed as one run
+WEBHOOK_DEBOUNCE_SECONDS = float(os.getenv('WEBHOOK_DEBOUNCE_SECONDS', '3'))
+# Upper bound on how long continuous activity on an issue can postpone its run
+WEBHOOK_DEBOUNCE_MAX_WAIT = float(os.getenv('WEBHOOK_DEBOUNCE_MAX_WAIT', '30'))
+
+def run_webhook_job(job_input):
+    """Worker entry point: add service credentials and run the event pipeline"""
+    handler_input = dict(job_input)
+    handler_input['gitlab_token'] = APP_TARGET_GITLAB_TOKEN
+    handler_input['google_api_key'] = APP_GOOGLE_AI_API_KEY
+    result = process_issue_event(handler_input)
+    logging.info(f"Finished {handler_input.get('event_type')} event for project {handler_input.get('project_id')}: {result}")
+    if isinstance(result, dict) and result.get('status') == 'error' and result.get('retryable', True):
+        # Raising hands the job back to the queue, which retries it with backoff
+        raise RuntimeError(result.get('message', 'Event processing failed'))
+    return result
+
+# Configure the Gemini SDK and build the models once, before workers pick up events
+if APP_GOOGLE_AI_API_KEY:
+    warm_up_models(APP_GOOGLE_AI_API_KEY)
+
+# Remembers recent deliveries so GitLab retries are not processed twice
+delivery_dedup = DeliveryDeduplicator()
+
+def coalesce_issue_events(pending_input, latest_input):
+    """
+    Merge two queued events of the same issue: the latest event wins, but the
+    notes carried by both are kept (an edited note keeps its latest body) and
+    issue fields missing from the latest payload are taken from the pending one.
+    """
+    merged = dict(latest_input)
+    merged['webhook_notes'] = merge_webhook_notes(
+        pending_input.get('webhook_notes') or [], latest_input.get('webhook_notes')
+    )
+    pending_issue = pending_input.get('webhook_issue') or {}
+    latest_issue = latest_input.get('webhook_issue') or {}
+    merged['webhook_issue'] = dict(pending_issue, **{k: v for k, v in latest_issue.items() if v is not None})
+    return merged
+
+# Credentials are injected by the worker so they are never written to the persisted queue.
+# Issue events are merged by key prefix, so jobs recovered after a restart are merged too.
+job_queue = JobQueue(run_webhook_job, concurrency=JOB_QUEUE_CONCURRENCY, db_path=JOB_QUEUE_DB_PATH,
+                     merges={'issue:': coalesce_issue_events})
+job_queue.start()
+
+def enqueue_event(handler_input, keys=None):
+    """
+    Queue an event for background processing and acknowledge the webhook.
+    Deliveries whose keys were already seen are acknowledged without queueing.
+    """
+    keys = keys or []
+    if delivery_dedup.check_and_mark(keys):
+        logging.info(f"Duplicate webhook delivery ({', '.join(keys)}). Skipping.")
+        return jsonify({"status": "skipped", "message": "Duplicate delivery"}), 200
+    try:
+        job_id = _enqueue(handler_input)
+    except Exception:
+        delivery_dedup.forget(keys)
+        raise
+    return jsonify({"status": "accepted", "job_id": job_id}), 202
+
+def _enqueue(handler_input):
+    if handler_input.get('issue_iid'):
+        # One pending and at most one running job per issue; bursts are debounced into one run
+        job_id = job_queue.enqueue(
+            handler_input,
+            key=f"issue:{handler_input['project_id']}:{handler_input['issue_iid']}",
+            delay=WEBHOOK_DEBOUNCE_SECONDS,
+            max_delay=WEBHOOK_DEBOUNCE_MAX_WAIT
+        )
+    else:
+        job_id = job_queue.enqueue(handler_input)
+    return job_id
 
 @app.route('/')
 def home():
@@ -51,6 +129,8 @@ def gitlab_webhook():
     action = None
     project_data = None
     issue_title = None
+    webhook_notes = []
+    webhook_issue = None
 
     # Handle merge request events for vector DB updates
     if object_kind == 'merge_request':
@@ -65,16 +145,13 @@ def gitlab_webhook():
             logging.info(f"Successful merge to main branch detected for project {project_id}")
             handler_input = {
                 "gitlab_url": APP_GITLAB_URL,
-                "gitlab_token": APP_TARGET_GITLAB_TOKEN,
                 "project_id": project_id,
-                "google_api_key": APP_GOOGLE_AI_API_KEY,
                 "event_type": "merge_to_main",
                 "action": "update_repo_content",
                 "project_data": project_data
             }
             
-            result = process_issue_event(handler_input)
-            return jsonify(result)
+            return enqueue_event(handler_input, delivery_keys(request.headers, payload))
         else:
             return jsonify({"status": "skipped", "message": "Not a merge to main branch"}), 200
 
@@ -86,6 +163,12 @@ def gitlab_webhook():
         issue_iid = issue_attributes.get('iid')
         issue_title = issue_attributes.get('title', '')
         action = issue_attributes.get('action')
+        webhook_issue = {
+            'title': issue_title,
+            'description': issue_attributes.get('description'),
+            'author': payload.get('user', {}).get('username', '') if action == 'open' else None,
+            'created_at': issue_attributes.get('created_at')
+        }
         
         logging.info(f"Issue event details: project_id={project_id}, issue_iid={issue_iid}, action={action}")
         
@@ -103,6 +186,12 @@ def gitlab_webhook():
         project_id = project_data.get('id')
         issue_iid = issue_data.get('iid')
         issue_title = issue_data.get('title', '')
+        webhook_issue = {
+            'title': issue_title,
+            'description': issue_data.get('description'),
+            'author': None,
+            'created_at': issue_data.get('created_at')
+        }
         action = note_attributes.get('noteable_type')
         
         logging.info(f"Note event details: project_id={project_id}, issue_iid={issue_iid}, noteable_type={action}")
@@ -118,9 +207,6 @@ def gitlab_webhook():
         
         # Prevent processing comments made by the bot itself
         note_body = note_attributes.get('note', '')
-        print("note_body --------- start ---------")
-        print(note_body)
-        print("note_body --------- end ---------")
         if (note_body.startswith(BOT_SIGNATURE) or 
             note_body.startswith("<!-- AI Rubber Duck -->") or 
             note_body.startswith("**Sended By AI Rubber Duck:**") or 
@@ -128,6 +214,16 @@ def gitlab_webhook():
             logging.info("Comment is from the bot itself (starts with BOT_SIGNATURE). Skipping.")
             return jsonify({"status": "skipped", "message": "Comment from bot"}), 200
 
+        # The note itself is forwarded so the handler can merge it without re-reading it from GitLab
+        if note_attributes.get('id'):
+            webhook_notes.append({
+                'id': note_attributes.get('id'),
+                'body': note_body,
+                'author': payload.get('user', {}).get('username', ''),
+                'created_at': note_attributes.get('created_at'),
+                'system': note_attributes.get('system', False)
+            })
+
     else:
         logging.warning(f"Webhook payload not for a supported event or malformed. Object kind: '{object_kind}'.")
         if object_kind == 'issue':
@@ -153,18 +249,17 @@ def gitlab_webhook():
 
     handler_input = {
         "gitlab_url": APP_GITLAB_URL,
-        "gitlab_token": APP_TARGET_GITLAB_TOKEN,
         "project_id": project_id,
         "issue_iid": issue_iid,
-        "google_api_key": APP_GOOGLE_AI_API_KEY,
         "event_type": object_kind,
         "action": action,
-        "project_data": project_data
+        "project_data": project_data,
+        "webhook_notes": webhook_notes,
+        "webhook_issue": webhook_issue
     }
     
-    logging.info(f"Calling process_issue_event for project {project_id}, issue {issue_iid}, event_type {object_kind}, action {action}")
-    result = process_issue_event(handler_input)
-    return jsonify(result)
+    logging.info(f"Queueing process_issue_event for project {project_id}, issue {issue_iid}, event_type {object_kind}, action {action}")
+    return enqueue_event(handler_input, delivery_keys(request.headers, payload))
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0',debug=False, port=os.getenv("PORT", 8080))
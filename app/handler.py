@@ -1,13 +1,22 @@
 # This file will contain the main application logic for handling webhook events.
 import os
 import logging
+import time
+from contextlib import contextmanager
 # Assuming src.gitlab_integration and src.google_ai_integration are accessible
 # This might require adjusting PYTHONPATH or the project structure if running app directly
 # For a package structure, it might be: from ..src.gitlab_integration import ...
-from src.gitlab_integration import get_gitlab_instance, get_issue_details, post_comment_to_issue, BOT_SIGNATURE
-from src.google_ai_integration import configure_google_ai, generate_socratic_questions, generate_contextual_response, detect_user_intent
+from src.gitlab_integration import get_gitlab_instance, invalidate_gitlab_instance, get_issue_details, post_comment_to_issue, merge_webhook_notes, normalize_note, ProgressiveComment, BOT_SIGNATURE
+from src.google_ai_integration import configure_google_ai, generate_socratic_questions, generate_contextual_response
+from src.intent_analyzer import classify_turn, decide_response_mode, INTENT_WINDOW_TURNS
+from src.conversation_summary import update_summary, format_summary
 from src.firestore_integration import FirestoreManager
+from src.conversation_store import ConversationStore
 from src.gitlab_repo_handler import GitLabRepoHandler
+from src.api_call_tracker import track_api_calls
+from src.singleflight import SingleFlight, KeyedLock, LeaseTimeout, held_lease
+from src.background import BackgroundExecutor
+from src.pipeline_stages import StageRunner
 
 # Logging configuration should ideally be done at the app level (e.g., in Flask app setup)
 # For now, keeping it here for direct translation, but it might be removed if app handles it.
@@ -16,9 +25,37 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Trigger phrase for the AI Rubber Duck - this could become a configurable setting
 RUBBER_DUCK_TRIGGER_PHRASE = "Rubber Duck Help Me"
 
+# Patch stored repository content from commit diffs on merge instead of re-crawling
+INCREMENTAL_REPO_REFRESH = os.getenv('INCREMENTAL_REPO_REFRESH', 'true').lower() == 'true'
+
+# Build the issue turn from the webhook payload plus the cached conversation (no GitLab reads)
+WEBHOOK_FAST_PATH = os.getenv('WEBHOOK_FAST_PATH', 'true').lower() == 'true'
+# A cached conversation not synced with GitLab for this long is refreshed through the API
+WEBHOOK_FAST_PATH_MAX_AGE = int(os.getenv('WEBHOOK_FAST_PATH_MAX_AGE', '3600'))
+
+# Post a placeholder reply right away and edit it while the response is streamed
+AI_STREAMING_RESPONSES = os.getenv('AI_STREAMING_RESPONSES', 'false').lower() == 'true'
+STREAMING_PLACEHOLDER = "*Thinking about your question...*"
+
+# Serialize repository crawls of a project across instances with a Firestore lease
+# (in-process serialization is always on)
+REPOSITORY_LEASE_ENABLED = os.getenv('REPOSITORY_LEASE_ENABLED', 'false').lower() == 'true'
+REPOSITORY_LEASE_TTL = int(os.getenv('REPOSITORY_LEASE_TTL', '900'))
+REPOSITORY_LEASE_WAIT = int(os.getenv('REPOSITORY_LEASE_WAIT', '600'))
+
+# Concurrent onboarding/refresh requests for a project share one crawl
+repository_flights = SingleFlight()
+repository_locks = KeyedLock()
+
+# Answer the first issue of a new project right away from a cheap README/tree
+# overview while the full repository crawl runs in the background
+BACKGROUND_ONBOARDING = os.getenv('BACKGROUND_ONBOARDING', 'true').lower() == 'true'
+onboarding_executor = BackgroundExecutor(max_workers=int(os.getenv('BACKGROUND_ONBOARDING_WORKERS', '2')))
+
 # Initialize managers
 service_account_path = os.getenv('GOOGLE_SERVICE_ACCOUNT_PATH', 'hackathon-service-account-key.json')
 firestore_manager = None
+conversation_store = None
 
 def get_managers():
     """Initialize and return managers"""
@@ -29,21 +66,145 @@ def get_managers():
     
     return firestore_manager
 
-def format_conversation_for_ai(issue_title, issue_description, comments):
+def get_conversation_store(firestore_mgr):
+    """Initialize and return the per-issue conversation cache"""
+    global conversation_store
+    
+    if conversation_store is None:
+        conversation_store = ConversationStore(firestore_mgr)
+    
+    return conversation_store
+
+def invalidate_client_on_auth_error(error, gitlab_url, gitlab_token):
+    """Drop the pooled GitLab client when GitLab rejected its token, so the next event re-authenticates."""
+    if getattr(error, 'response_code', None) == 401:
+        logging.warning("GitLab rejected the API token; the cached client will be re-authenticated on next use.")
+        invalidate_gitlab_instance(gitlab_url, gitlab_token)
+
+def build_issue_data_from_webhook(webhook_data, cached_conversation):
+    """
+    Builds issue details from the webhook payload and the cached conversation,
+    without any GitLab API call.
+    
+    Returns:
+        Issue data in the get_issue_details format, or None when the fast path
+        cannot be used (disabled, no payload data, or a cold/stale cache)
+    """
+    webhook_issue = webhook_data.get('webhook_issue')
+    if not WEBHOOK_FAST_PATH or not webhook_issue:
+        return None
+    
+    # A newly opened issue has no notes yet, so no cache is needed
+    is_new_issue = webhook_data.get('event_type') == 'issue' and webhook_data.get('action') == 'open'
+    if is_new_issue:
+        cached_conversation = {'comments': [], 'issue': {}, 'synced_at': time.time()}
+    elif not cached_conversation:
+        logging.info("Conversation cache is cold; fetching issue details from GitLab.")
+        return None
+    elif time.time() - cached_conversation.get('synced_at', 0) > WEBHOOK_FAST_PATH_MAX_AGE:
+        logging.info("Cached conversation is stale; fetching issue details from GitLab.")
+        return None
+    
+    cached_issue = cached_conversation.get('issue', {})
+    comments = merge_webhook_notes(cached_conversation.get('comments', []), webhook_data.get('webhook_notes'))
+    return {
+        'title': webhook_issue.get('title') or cached_issue.get('title', ''),
+        'description': webhook_issue.get('description'),
+        'author': webhook_issue.get('author') or cached_issue.get('author', ''),
+        'created_at': webhook_issue.get('created_at') or cached_issue.get('created_at'),
+        'comments': comments,
+        'last_note_id': max((comment['id'] for comment in comments), default=0),
+        # Only a GitLab read (or a brand-new issue) counts as a sync
+        'synced_at': cached_conversation.get('synced_at', 0)
+    }
+
+def fetch_issue_data(gl, webhook_data, cached_conversation):
+    """
+    Returns the issue details for an event: built from the webhook payload and
+    the cached conversation when possible, otherwise read from GitLab (only
+    notes newer than the cached conversation are fetched).
+    """
+    issue_iid = webhook_data.get('issue_iid')
+    issue_data = build_issue_data_from_webhook(webhook_data, cached_conversation)
+    if issue_data:
+        logging.info(f"Built issue {issue_iid} turn from webhook payload and cached conversation.")
+        return issue_data
+    return get_issue_details(
+        gl, webhook_data.get('project_id'), issue_iid,
+        cached_conversation=cached_conversation,
+        webhook_notes=webhook_data.get('webhook_notes')
+    )
+
+def record_bot_reply(conversation_cache, project_id, issue_iid, note):
+    """
+    Adds the bot's posted note to the cached conversation. Webhooks for the
+    bot's own notes are skipped, so this is how the fast path learns about them.
+    """
+    try:
+        state = conversation_cache.load(project_id, issue_iid)
+        if not state:
+            return
+        comments = merge_webhook_notes(state.get('comments', []), [normalize_note(note)])
+        conversation_cache.save(project_id, issue_iid, dict(
+            state, comments=comments, last_note_id=max(state.get('last_note_id', 0), note.id)
+        ), background=True)
+    except Exception as e:
+        logging.warning(f"Failed to add bot reply to cached conversation of issue {issue_iid}: {e}")
+
+def is_ai_comment(comment_body):
+    """Returns True for comments posted by the bot (current or older signatures)."""
+    return (comment_body.startswith(BOT_SIGNATURE) or comment_body.startswith("<!-- AI Rubber Duck -->") or
+            comment_body.startswith("**Sended By AI Rubber Duck:**") or comment_body.startswith("Sended By AI Rubber Duck:") or
+            comment_body.startswith("AI Rubber Duck:"))
+
+def label_user_turns(comments):
+    """
+    Classifies the intent of user comments that have no label yet (new or edited
+    ones) and stores it in the comment dict, so it is cached with the conversation.
+    
+    Returns:
+        Number of comments classified
+    """
+    classified = 0
+    for comment in comments:
+        if 'intent' in comment or comment.get('system') or is_ai_comment(comment['body']):
+            continue
+        comment['intent'] = classify_turn(comment['body'])
+        classified += 1
+    return classified
+
+def detect_turn_intent(comments, issue_title, issue_description):
+    """
+    Chooses the response mode from the labels of the latest user turns (comments
+    are newest first). The issue itself counts as the oldest turn while there
+    are fewer user comments than the window.
+    """
+    labels = [
+        comment['intent'] for comment in comments
+        if 'intent' in comment and not comment.get('system')
+    ][:INTENT_WINDOW_TURNS]
+    if len(labels) < INTENT_WINDOW_TURNS:
+        labels.append(classify_turn(f"{issue_title}\n{issue_description}"))
+    return decide_response_mode(labels)
+
+def format_conversation_for_ai(issue_title, issue_description, comments, summary=None):
     """Formats the issue title, description, and comments into a single string for the AI,
        separating AI responses from user responses for stateful conversation.
+       Comments already folded into the summary are replaced by the summary,
+       which is added as the oldest history turn.
     """
+    if summary:
+        comments = [comment for comment in comments if comment['id'] > summary['through_note_id']]
     ai_conversation_history = []
     current_problem_statement = f"Issue Title: {issue_title}\nIssue Description:\n{issue_description}"
     temp_user_responses = []
 
     for comment in comments: # comment is a dict here
         comment_body = comment['body'] # Access 'body' using dictionary key
-        is_ai_comment = comment_body.startswith(BOT_SIGNATURE) or comment_body.startswith("<!-- AI Rubber Duck -->") or comment_body.startswith("**Sended By AI Rubber Duck:**") or comment_body.startswith("Sended By AI Rubber Duck:") or comment_body.startswith("AI Rubber Duck:")
         # Ensure author is accessed correctly if it's a dict
         author_username = comment['author'] # Assuming author is already just the username string as per get_issue_details
 
-        if is_ai_comment:
+        if is_ai_comment(comment_body):
             if temp_user_responses:
                 ai_conversation_history.append(f"User responses since last AI question:\n" + "\n".join(temp_user_responses))
                 temp_user_responses = []
@@ -56,6 +217,10 @@ def format_conversation_for_ai(issue_title, issue_description, comments):
     if temp_user_responses:
         current_problem_statement += "\n\nFurther comments/details from user:\n" + "\n".join(temp_user_responses)
     
+    summary_text = format_summary(summary)
+    if summary_text:
+        ai_conversation_history.append(summary_text)
+    
     formatted_history = "\n---\n".join(ai_conversation_history) if ai_conversation_history else ""
 
     logging.info(f"Formatted current problem statement for AI: {current_problem_statement[:200]}...")
@@ -77,6 +242,27 @@ def process_issue_event(webhook_data):
     - gitlab_token (API token for accessing this project - this needs secure handling)
     - event_type (issue, note, merge_request, merge_to_main)
     - project_data (project information from webhook)
+    Errors that retrying cannot fix (missing configuration or data) are
+    returned with "retryable": False; other errors may be transient.
+    The number of GitLab API calls made for the event and the duration of each
+    pipeline stage are logged.
+    """
+    stages = StageRunner()
+    with track_api_calls() as api_calls:
+        result = _process_issue_event(webhook_data, stages)
+    event_label = (f"{webhook_data.get('event_type')} event "
+                   f"(project {webhook_data.get('project_id')}, issue {webhook_data.get('issue_iid')})")
+    logging.info(f"GitLab API calls for {event_label}: {api_calls.summary()}")
+    logging.info(f"Stage timings for {event_label}: {stages.summary()}")
+    return result
+
+def _process_issue_event(webhook_data, stages):
+    """
+    Runs the event pipeline for process_issue_event. Stages that do not depend
+    on each other are started on the stage executor so their I/O overlaps:
+    the issue fetch runs alongside the Firestore document read (when the
+    conversation is cached locally) or the retrieval index load, and the
+    repository context is built while the conversation is formatted.
     """
     logging.info("Processing issue event via webhook handler.")
 
@@ -92,7 +278,7 @@ def process_issue_event(webhook_data):
 
     if not all([gitlab_url, gitlab_token, project_id, google_api_key]):
         logging.error("Missing critical data in webhook_data for processing: gitlab_url, gitlab_token, project_id, google_api_key.")
-        return {"status": "error", "message": "Missing critical configuration."}
+        return {"status": "error", "message": "Missing critical configuration.", "retryable": False}
 
     logging.info(f"Processing project {project_id}, event_type {event_type} on {gitlab_url}")
 
@@ -101,34 +287,68 @@ def process_issue_event(webhook_data):
         firestore_mgr = get_managers()
     except ValueError as e:
         logging.error(f"Failed to initialize services due to configuration: {e}")
-        return {"status": "error", "message": f"Service configuration error: {e}"}
+        return {"status": "error", "message": f"Service configuration error: {e}", "retryable": False}
     except Exception as e:
         logging.error(f"Failed to initialize services: {e}")
         return {"status": "error", "message": f"Failed to initialize services: {e}"}
     
     # Handle merge to main branch - update repository content
     if event_type == "merge_to_main" or action == "update_repo_content":
-        return handle_merge_to_main(gl, project_id, project_data, firestore_mgr)
+        return stages.run('refresh', handle_merge_to_main, gl, project_id, project_data, firestore_mgr)
 
     # For issue/note events, ensure we have issue_iid
     if not issue_iid:
         logging.error(f"Missing issue_iid for {event_type} event")
-        return {"status": "error", "message": "Missing issue_iid for issue/note event"}
+        return {"status": "error", "message": "Missing issue_iid for issue/note event", "retryable": False}
+    
+    # Project metadata, repository manifest and cached conversation in one Firestore round-trip;
+    # documents already held in memory are not read again
+    conversation_cache = get_conversation_store(firestore_mgr)
+    conversation_cached = conversation_cache.is_cached(project_id, issue_iid)
+    stages.start('documents', firestore_mgr.get_event_documents, project_id, None if conversation_cached else issue_iid)
+    
+    # With the conversation in memory the issue fetch does not need the Firestore documents
+    if conversation_cached:
+        cached_conversation = conversation_cache.load(project_id, issue_iid)
+        stages.start('issue', fetch_issue_data, gl, webhook_data, cached_conversation)
+    
+    try:
+        event_documents = stages.result('documents')
+    except Exception as e:
+        logging.error(f"Failed to read event documents for project {project_id}: {e}")
+        event_documents = None
     
     # Check if this is a new project (first time seeing this project_id)
-    is_new_project = not firestore_mgr.is_project_registered(project_id)
+    if event_documents is not None:
+        is_new_project = event_documents['project'] is None
+    else:
+        is_new_project = not firestore_mgr.is_project_registered(project_id)
     
-    if is_new_project:
+    if is_new_project and BACKGROUND_ONBOARDING:
+        logging.info(f"New project detected: {project_id}. Storing repository content and metadata in the background.")
+        start_background_onboarding(gl, project_id, project_data, firestore_mgr)
+    elif is_new_project:
         logging.info(f"New project detected: {project_id}. Storing repository content and metadata.")
-        success = handle_new_project(gl, project_id, project_data, firestore_mgr)
+        success = stages.run('onboarding', onboard_project, gl, project_id, project_data, firestore_mgr)
         if not success:
             logging.error(f"Failed to process new project {project_id}")
             return {"status": "error", "message": "Failed to process new project"}
+    
+    use_bootstrap_context = (is_new_project and BACKGROUND_ONBOARDING) or repository_flights.in_flight(f"onboard:{project_id}")
+    manifest = (event_documents or {}).get('manifest')
+    if manifest and not use_bootstrap_context:
+        # Warm the retrieval index while the issue is fetched
+        stages.start('repository_index', firestore_mgr.get_retrieval_index, project_id, manifest)
 
-    # Fetch fresh issue details
+    # Fetch issue details, reading only notes newer than the cached conversation
     try:
-        issue_data = get_issue_details(gl, project_id, issue_iid)
+        if conversation_cached:
+            issue_data = stages.result('issue')
+        else:
+            cached_conversation = conversation_cache.load(project_id, issue_iid, prefetched=event_documents)
+            issue_data = stages.run('issue', fetch_issue_data, gl, webhook_data, cached_conversation)
     except Exception as e:
+        invalidate_client_on_auth_error(e, gitlab_url, gitlab_token)
         logging.error(f"Failed to fetch details for issue {issue_iid}: {e}")
         return {"status": "error", "message": f"Failed to fetch issue details: {e}"}
         
@@ -136,6 +356,11 @@ def process_issue_event(webhook_data):
         logging.error(f"Failed to fetch details for issue {issue_iid} (returned None).")
         return {"status": "error", "message": f"Failed to fetch details for issue {issue_iid}."}
 
+    # Only new or edited user comments are classified; labels are cached with the conversation
+    stages.run('label_turns', label_user_turns, issue_data['comments'])
+    # Comments leaving the verbatim window are folded into the stored rolling summary
+    summary = stages.run('summary', update_summary, issue_data['comments'], (cached_conversation or {}).get('summary'), is_ai_comment)
+
     issue_title = issue_data['title']
     issue_description = issue_data['description'] if issue_data['description'] else "No description provided."
     comments = issue_data['comments'] 
@@ -146,61 +371,101 @@ def process_issue_event(webhook_data):
     # If it's not initially a rubber duck session by title, check if any existing comment is from the bot
     if not is_rubber_duck_session:
         for comment in comments:
-            if comment['body'].startswith(BOT_SIGNATURE):
+            if is_ai_comment(comment['body']):
                 is_rubber_duck_session = True
                 logging.info(f"Found existing AI bot comment. Continuing session for issue {issue_iid} based on comment history.")
                 break
 
+    skip_result = None
     if not is_rubber_duck_session:
         logging.info(f"Issue title '{issue_title}' does not trigger rubber duck, and no prior bot interaction found. Skipping event type '{event_type}'.")
-        return {"status": "skipped", "message": "Not a rubber duck session."}
+        skip_result = {"status": "skipped", "message": "Not a rubber duck session."}
+    # Prevent bot from replying to its own comments
+    elif comments and is_ai_comment(comments[0]['body']):
+        logging.info(f"The last comment on issue {issue_iid} was already made by the AI Bot. Skipping to avoid loops.")
+        skip_result = {"status": "skipped", "message": "Last comment by bot."}
+
+    # Conversation cache and (for active sessions) issue metadata are written in
+    # one batch in the background, so the response does not wait for Firestore
+    conversation_cache.save(project_id, issue_iid, {
+        'comments': issue_data['comments'],
+        'last_note_id': issue_data['last_note_id'],
+        'issue': {
+            'title': issue_data['title'],
+            'description': issue_data['description'],
+            'author': issue_data['author'],
+            'created_at': issue_data['created_at']
+        },
+        'synced_at': issue_data.get('synced_at', time.time()),
+        'summary': summary
+    }, issue_data=None if skip_result else issue_data, background=True)
+
+    if skip_result:
+        return skip_result
 
     logging.info(f"Rubber duck session active for issue: {issue_title} (event type: {event_type})") 
-       # Prevent bot from replying to its own comments
-       
-    if comments and comments[0]['body'].startswith(BOT_SIGNATURE):
-        print(comments[0]['body'])
-        logging.info(f"The last comment on issue {issue_iid} was already made by the AI Bot. Skipping to avoid loops.")
-        return {"status": "skipped", "message": "Last comment by bot."}
-    
-    # Store issue metadata for tracking
-    firestore_mgr.store_issue_metadata(project_id, issue_iid, issue_data)
     
     # Get repository context for better AI responses
-    issue_content = f"{issue_title}\n{issue_description}"
-    repo_context = firestore_mgr.get_project_context(project_id, issue_content)
-    current_problem, conversation_history = format_conversation_for_ai(issue_title, issue_description, comments)    # Detect user intent to choose appropriate response mode
-    user_intent = detect_user_intent(current_problem, conversation_history)
+    # Title, description and user comments form the retrieval query for relevant files
+    user_comments = [comment['body'] for comment in comments if not is_ai_comment(comment['body'])]
+    issue_content = "\n".join([issue_title, issue_description] + user_comments)
+    if use_bootstrap_context:
+        # The crawl has not finished; later replies pick up the full context
+        stages.start('context', get_bootstrap_context, gl, project_id, project_data, firestore_mgr)
+    else:
+        if manifest:
+            stages.result('repository_index')
+        stages.start('context', firestore_mgr.get_project_context, project_id, issue_content,
+                     project_metadata=(event_documents or {}).get('project'), manifest=manifest)
+    current_problem, conversation_history = stages.run(
+        'format', format_conversation_for_ai, issue_title, issue_description, comments, summary
+    )
+    # Detect user intent from the latest user turns (passed on so it is not detected twice)
+    user_intent = stages.run('intent', detect_turn_intent, comments, issue_title, issue_description)
     logging.info(f"Detected user intent: {user_intent}")
+    repo_context = stages.result('context')
     
     # If user is indicating closure/resolution, handle appropriately
     if user_intent == 'closing':
         logging.info("User indicated problem resolution. Generating closing response.")
         # Generate a closing/congratulatory response
-        ai_response = generate_socratic_questions(
+        ai_response = stages.run(
+            'generate', generate_socratic_questions,
             problem_description=current_problem, 
             conversation_history=conversation_history,
             api_key=google_api_key,
-            repository_context=""  # No need for repo context in closing
+            repository_context="",  # No need for repo context in closing
+            prompt_tag={'project_id': project_id, 'issue_iid': issue_iid},
+            mode=user_intent
         )
         
         # Post closing response and return
         try:
-            post_comment_to_issue(gl, project_id, issue_iid, ai_response)
+            note = stages.run('post', post_comment_to_issue, gl, project_id, issue_iid, ai_response)
+            record_bot_reply(conversation_cache, project_id, issue_iid, note)
             logging.info(f"Successfully posted closing response to issue {issue_iid}.")
             return {"status": "success", "message": "Closing response posted."}
         except Exception as e:
+            invalidate_client_on_auth_error(e, gitlab_url, gitlab_token)
             logging.error(f"Failed to post closing comment to GitLab issue {issue_iid}: {e}")
-            return {"status": "error", "message": f"Failed to post closing comment to GitLab: {e}"}
+            # The note may have been created before the error (e.g. a timeout); a retry could post it twice
+            return {"status": "error", "message": f"Failed to post closing comment to GitLab: {e}", "retryable": False}
+
+    if AI_STREAMING_RESPONSES:
+        return stages.run('generate', stream_ai_response, gl, webhook_data, conversation_cache,
+                          current_problem, conversation_history, repo_context, user_intent)
 
     logging.info("Generating AI response with enhanced prompting.")
     try:
         # Use the enhanced contextual response generation
-        ai_response = generate_socratic_questions(
+        ai_response = stages.run(
+            'generate', generate_socratic_questions,
             problem_description=current_problem, 
             conversation_history=conversation_history,
             api_key=google_api_key,
-            repository_context=repo_context
+            repository_context=repo_context,
+            prompt_tag={'project_id': project_id, 'issue_iid': issue_iid},
+            mode=user_intent
         )
     except Exception as e:
         logging.error(f"Error generating AI response: {e}")
@@ -214,12 +479,176 @@ def process_issue_event(webhook_data):
 
     # Post the AI response back to the GitLab issue
     try:
-        post_comment_to_issue(gl, project_id, issue_iid, ai_response)
+        note = stages.run('post', post_comment_to_issue, gl, project_id, issue_iid, ai_response)
+        record_bot_reply(conversation_cache, project_id, issue_iid, note)
         logging.info(f"Successfully posted AI response to issue {issue_iid}.")
         return {"status": "success", "message": "AI response posted."}
     except Exception as e:
+        invalidate_client_on_auth_error(e, gitlab_url, gitlab_token)
         logging.error(f"Failed to post comment to GitLab issue {issue_iid}: {e}")
-        return {"status": "error", "message": f"Failed to post comment to GitLab: {e}"}
+        # The note may have been created before the error (e.g. a timeout); a retry could post it twice
+        return {"status": "error", "message": f"Failed to post comment to GitLab: {e}", "retryable": False}
+
+def discard_streaming_comment(comment, webhook_data):
+    """
+    Deletes a streaming placeholder (and any partial text in it); failures are logged.
+    
+    Returns:
+        True if the placeholder is gone, False if it may still be on the issue
+    """
+    try:
+        comment.discard()
+        return True
+    except Exception as e:
+        invalidate_client_on_auth_error(e, webhook_data.get('gitlab_url'), webhook_data.get('gitlab_token'))
+        logging.error(f"Failed to delete streaming comment on GitLab issue {webhook_data.get('issue_iid')}: {e}")
+        return False
+
+def stream_ai_response(gl, webhook_data, conversation_cache, current_problem, conversation_history, repo_context, mode=None):
+    """
+    Posts a placeholder comment, streams the AI response into it with throttled
+    edits, and writes the final formatted response into the same comment.
+    On failure the placeholder is deleted; errors after which a bot comment may
+    remain on the issue are not retryable, so a retry never posts a second one.
+    
+    Returns:
+        Response dictionary
+    """
+    gitlab_url = webhook_data.get('gitlab_url')
+    gitlab_token = webhook_data.get('gitlab_token')
+    project_id = webhook_data.get('project_id')
+    issue_iid = webhook_data.get('issue_iid')
+    
+    comment = ProgressiveComment(gl, project_id, issue_iid)
+    try:
+        comment.start(STREAMING_PLACEHOLDER)
+    except Exception as e:
+        invalidate_client_on_auth_error(e, gitlab_url, gitlab_token)
+        logging.error(f"Failed to post placeholder comment to GitLab issue {issue_iid}: {e}")
+        # The placeholder may have been created before the error (e.g. a timeout)
+        return {"status": "error", "message": f"Failed to post comment to GitLab: {e}", "retryable": False}
+    
+    logging.info("Streaming AI response with enhanced prompting.")
+    try:
+        ai_response = generate_socratic_questions(
+            problem_description=current_problem,
+            conversation_history=conversation_history,
+            api_key=webhook_data.get('google_api_key'),
+            repository_context=repo_context,
+            on_partial=comment.update,
+            prompt_tag={'project_id': project_id, 'issue_iid': issue_iid},
+            mode=mode
+        )
+    except Exception as e:
+        logging.error(f"Error generating AI response: {e}")
+        discarded = discard_streaming_comment(comment, webhook_data)
+        return {"status": "error", "message": f"Error generating AI response: {e}", "retryable": discarded}
+
+    if not ai_response:
+        logging.warning("Google AI did not return any response.")
+        discard_streaming_comment(comment, webhook_data)
+        return {"status": "no_action", "message": "AI did not generate a response."}
+
+    try:
+        note = comment.finish(ai_response)
+        record_bot_reply(conversation_cache, project_id, issue_iid, note)
+        logging.info(f"Successfully streamed AI response to issue {issue_iid} ({comment.updates} edit(s)).")
+        return {"status": "success", "message": "AI response posted."}
+    except Exception as e:
+        invalidate_client_on_auth_error(e, gitlab_url, gitlab_token)
+        logging.error(f"Failed to finalize streamed comment on GitLab issue {issue_iid}: {e}")
+        discarded = discard_streaming_comment(comment, webhook_data)
+        return {"status": "error", "message": f"Failed to post comment to GitLab: {e}", "retryable": discarded}
+
+@contextmanager
+def repository_guard(firestore_mgr, project_id):
+    """
+    Hold the per-project repository lock (and, when enabled, the Firestore
+    lease) so only one crawl of a project runs at a time.
+    
+    Raises:
+        LeaseTimeout: if another instance kept the lease past REPOSITORY_LEASE_WAIT
+    """
+    with repository_locks.hold(str(project_id)):
+        if not REPOSITORY_LEASE_ENABLED:
+            yield
+            return
+        with held_lease(
+            acquire=lambda owner, ttl: firestore_mgr.acquire_lease(project_id, 'repository', owner, ttl),
+            release=lambda owner: firestore_mgr.release_lease(project_id, 'repository', owner),
+            ttl=REPOSITORY_LEASE_TTL,
+            wait_timeout=REPOSITORY_LEASE_WAIT
+        ):
+            yield
+
+def onboard_project(gl, project_id, project_data, firestore_mgr):
+    """
+    Runs handle_new_project at most once at a time per project. Concurrent
+    callers wait for the running onboarding and share its result; a caller
+    that waited on another instance's lease finds the project registered and
+    does not crawl again.
+    
+    Returns:
+        Boolean indicating success
+    """
+    def onboard():
+        try:
+            with repository_guard(firestore_mgr, project_id):
+                if firestore_mgr.is_project_registered(project_id):
+                    logging.info(f"Project {project_id} was onboarded while waiting; skipping crawl")
+                    return True
+                return handle_new_project(gl, project_id, project_data, firestore_mgr)
+        except LeaseTimeout as e:
+            logging.error(f"Could not onboard project {project_id}: {e}")
+            return False
+    
+    success, shared = repository_flights.do(f"onboard:{project_id}", onboard)
+    if shared:
+        logging.info(f"Reused concurrent onboarding of project {project_id} (success: {success})")
+    return success
+
+def start_background_onboarding(gl, project_id, project_data, firestore_mgr):
+    """Queues onboard_project for a project unless its onboarding is already running."""
+    if repository_flights.in_flight(f"onboard:{project_id}"):
+        return
+    onboarding_executor.submit(onboard_project, gl, project_id, project_data, firestore_mgr,
+                               key=f"onboard:{project_id}")
+
+def get_bootstrap_context(gl, project_id, project_data, firestore_mgr):
+    """
+    Builds repository context for a project whose crawl has not finished, from
+    the webhook project data plus a README and top-level tree fetch. The result
+    is kept in the repository cache until the crawl stores the full content.
+    
+    Returns:
+        Formatted context string for the LLM
+    """
+    cache = firestore_mgr.repository_cache
+    context = cache.get(project_id, None, 'bootstrap_context', max_age=cache.document_ttl)
+    if context is not None:
+        return context
+    
+    overview = GitLabRepoHandler(gl).get_repository_overview(project_id, branch=project_data.get('default_branch'))
+    context_parts = ["=== PROJECT INFORMATION ==="]
+    context_parts.append(f"Project: {project_data.get('name', 'Unknown')}")
+    context_parts.append(f"Description: {project_data.get('description') or 'No description'}")
+    context_parts.append(f"Default Branch: {project_data.get('default_branch', 'main')}")
+    
+    readme_content = overview.get('readme_content', '')
+    if readme_content:
+        context_parts.append("\n=== README ===")
+        context_parts.append(readme_content[:1000] + ("..." if len(readme_content) > 1000 else ""))
+    
+    top_level = overview.get('top_level', [])
+    if top_level:
+        context_parts.append("\n=== PROJECT STRUCTURE (top level) ===")
+        context_parts.append(", ".join(item['path'] + ("/" if item['type'] == 'tree' else "") for item in top_level))
+    context_parts.append("\n(Repository files are still being indexed; file contents are not available yet.)")
+    
+    context = "\n".join(context_parts)
+    if overview:
+        cache.set(project_id, None, 'bootstrap_context', context)
+    return context
 
 def handle_new_project(gl, project_id, project_data, firestore_mgr):
     """
@@ -260,7 +689,10 @@ def handle_new_project(gl, project_id, project_data, firestore_mgr):
 
 def handle_merge_to_main(gl, project_id, project_data, firestore_mgr):
     """
-    Handle merge to main branch by updating repository content
+    Handle merge to main branch by updating repository content. Refreshes of a
+    project never overlap: a merge arriving during a refresh waits for it and
+    triggers one more (the running one may predate the merge), and merges
+    arriving meanwhile share that follow-up refresh.
     
     Args:
         gl: GitLab instance
@@ -271,6 +703,24 @@ def handle_merge_to_main(gl, project_id, project_data, firestore_mgr):
     Returns:
         Response dictionary
     """
+    result, shared = repository_flights.do_after(
+        f"refresh:{project_id}", _refresh_repository, gl, project_id, project_data, firestore_mgr
+    )
+    if shared:
+        logging.info(f"Reused concurrent repository refresh of project {project_id}: {result}")
+    return result
+
+def _refresh_repository(gl, project_id, project_data, firestore_mgr):
+    """Runs the repository refresh for handle_merge_to_main under the repository guard."""
+    try:
+        with repository_guard(firestore_mgr, project_id):
+            return _refresh_repository_content(gl, project_id, project_data, firestore_mgr)
+    except LeaseTimeout as e:
+        logging.error(f"Could not refresh repository content for project {project_id}: {e}")
+        return {"status": "error", "message": f"Repository refresh already in progress elsewhere: {e}"}
+
+def _refresh_repository_content(gl, project_id, project_data, firestore_mgr):
+    """Refreshes stored repository content, incrementally when possible."""
     try:
         logging.info(f"Handling merge to main for project {project_id}")
         
@@ -282,8 +732,21 @@ def handle_merge_to_main(gl, project_id, project_data, firestore_mgr):
                 return {"status": "error", "message": "Failed to process new project"}
             return {"status": "success", "message": "New project processed and repository content stored"}
         
-        # Get updated repository content
         repo_handler = GitLabRepoHandler(gl)
+        
+        # Prefer patching only the files changed since the stored commit
+        if INCREMENTAL_REPO_REFRESH:
+            previous_content = firestore_mgr.get_repository_content(project_id, include_file_contents=False)
+            update = repo_handler.get_incremental_update(project_id, previous_content) if previous_content else None
+            if update is not None:
+                if not update['important_files'] and not update['removed_files'] and not update['fields']:
+                    return {"status": "success", "message": "Repository content already up to date"}
+                if firestore_mgr.patch_repository_content(project_id, update):
+                    logging.info(f"Incrementally updated repository content for project {project_id}")
+                    return {"status": "success", "message": "Repository content updated incrementally"}
+                logging.warning(f"Incremental update failed for project {project_id}, falling back to full refresh")
+        
+        # Get updated repository content
         repo_content = repo_handler.get_repository_content(project_id)
         
         if not repo_content:
@@ -0,0 +1,104 @@
+"""
+Benchmark intent/sentiment detection on long conversation threads.
+
+Compares the previous approach (intent detected in the handler and again during
+generation, sentiment scanned separately) with analyze_conversation, which
+computes all signals once per event and memoizes them, and checks that both
+return the same signals. Threads with and without keyword hits are measured,
+since a thread without any keyword is the worst case for both.
+
+Usage:
+    python scripts/benchmark_intent_analyzer.py [--turns 200] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.intent_analyzer import (  # noqa: E402
+    FRUSTRATION_INDICATORS, INTENT_KEYWORDS, INTENT_PRIORITY, PROGRESS_INDICATORS, analyze_conversation
+)
+
+FILLER = ("the function returns none when the list is empty so i added a check but the "
+          "output still looks off after sorting the values in place").split()
+
+
+def build_thread(turns, with_keywords=True, seed=7):
+    """Create a (problem, history) pair with the given number of turns"""
+    rng = random.Random(seed)
+    vocabulary = FILLER * 20 + (FRUSTRATION_INDICATORS + PROGRESS_INDICATORS if with_keywords else [])
+    history = []
+    for turn in range(turns):
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(30, 80))]
+        speaker = "Previous AI Question" if turn % 2 else "User responses since last AI question"
+        history.append(f"{speaker}: {' '.join(words)}")
+    problem = "Issue Title: Sorting bug\nIssue Description:\n" + " ".join(rng.choice(FILLER) for _ in range(120))
+    return problem, "\n---\n".join(history)
+
+
+def legacy_intent(problem, history):
+    text = (problem + " " + history).lower()
+    for intent in INTENT_PRIORITY:
+        for keyword in INTENT_KEYWORDS[intent]:
+            if keyword in text:
+                return intent
+    if len(history) > 500:
+        return 'socratic'
+    if 'code' in text and any(word in text for word in ['review', 'analyze', 'improve']):
+        return 'analysis'
+    return 'socratic'
+
+
+def legacy_sentiment(history):
+    text = history.lower()
+    frustration = sum(1 for indicator in FRUSTRATION_INDICATORS if indicator in text)
+    progress = sum(1 for indicator in PROGRESS_INDICATORS if indicator in text)
+    return min(frustration, 5), min(progress, 5), frustration > progress
+
+
+def legacy_event(problem, history):
+    """What handling one event used to cost: intent in the handler, again in generation, plus sentiment"""
+    intent = legacy_intent(problem, history)
+    legacy_intent(problem, history)
+    return intent, legacy_sentiment(history)
+
+
+def analyzer_event(problem, history):
+    """The same event now: the second lookup is served from the memo"""
+    analyze_conversation.cache_clear()
+    signals = analyze_conversation(problem, history)
+    analyze_conversation(problem, history)
+    return signals
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    for with_keywords in (True, False):
+        for turns in sorted({10, args.turns // 4, args.turns}):
+            problem, history = build_thread(turns, with_keywords)
+            legacy, legacy_time = timed(lambda: legacy_event(problem, history), args.repeat)
+            signals, new_time = timed(lambda: analyzer_event(problem, history), args.repeat)
+            same = legacy == (signals.intent, (signals.frustration_level, signals.progress_level,
+                                              signals.needs_encouragement))
+            label = "keywords" if with_keywords else "no keywords"
+            print(f"{label:>11}, {turns:4d} turns ({len(problem) + len(history):7d} chars): "
+                  f"legacy {legacy_time * 1000:6.2f} ms/event, analyzer {new_time * 1000:6.2f} ms/event, "
+                  f"same result: {same}")
+
+
+if __name__ == "__main__":
+    main()
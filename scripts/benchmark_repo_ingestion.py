@@ -0,0 +1,148 @@
+"""
+Benchmark repository ingestion modes ("api" vs "archive") on a synthetic repository.
+
+The GitLab API is replaced by an in-memory fake that adds a fixed latency to
+every request, so the numbers reflect round-trips rather than network bandwidth.
+
+Usage:
+    python scripts/benchmark_repo_ingestion.py [--files 5000] [--latency-ms 30]
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import tarfile
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.gitlab_repo_handler import GitLabRepoHandler  # noqa: E402
+
+
+def build_synthetic_repo(file_count):
+    """Create a {path: content} mapping resembling a mid-size mixed-language repo"""
+    files = {
+        "README.md": "# Synthetic project\n" + "Some documentation.\n" * 50,
+        "requirements.txt": "flask\nrequests\n",
+        "package.json": '{"name": "synthetic"}\n',
+        "Dockerfile": "FROM python:3.11-slim\n",
+        ".gitlab-ci.yml": "stages: [test]\n",
+        "app.py": "print('hello')\n",
+    }
+    extensions = [".py", ".js", ".md", ".txt", ".json", ".go", ".css"]
+    index = 0
+    while len(files) < file_count:
+        depth = index % 5
+        directory = "/".join(f"pkg{(index // 7 + level) % 40}" for level in range(depth)) or "top"
+        path = f"{directory}/module_{index}{extensions[index % len(extensions)]}"
+        files[path] = f"# file {index}\n" + "value = 1\n" * (index % 30)
+        index += 1
+    return files
+
+
+def build_tree(files):
+    directories = set()
+    for path in files:
+        parts = path.split("/")[:-1]
+        for depth in range(1, len(parts) + 1):
+            directories.add("/".join(parts[:depth]))
+    tree = [{"path": d, "name": d.rsplit("/", 1)[-1], "type": "tree"} for d in sorted(directories)]
+    tree += [{"path": p, "name": p.rsplit("/", 1)[-1], "type": "blob"} for p in files]
+    return tree
+
+
+def build_archive(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for path, content in files.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(f"synthetic-main-abc123/{path}")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class FakeProject:
+    def __init__(self, files, latency):
+        self._files = files
+        self._latency = latency
+        self._tree = build_tree(files)
+        self._archive = build_archive(files)
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.id = 1
+        self.name = "synthetic"
+        self.description = ""
+        self.web_url = "https://gitlab.example.com/group/synthetic"
+        self.default_branch = "main"
+        self.created_at = self.last_activity_at = "2025-01-01T00:00:00Z"
+        self.path_with_namespace = "group/synthetic"
+        self.namespace = {"name": "group", "path": "group", "kind": "group"}
+        self.visibility = "private"
+        self.files = SimpleNamespace(get=self._get_file)
+        self.commits = SimpleNamespace(list=lambda **kwargs: self._request([]))
+
+    def _request(self, result):
+        with self._lock:
+            self.request_count += 1
+        time.sleep(self._latency)
+        return result
+
+    def _get_file(self, file_path, ref):
+        if file_path not in self._files:
+            self._request(None)
+            raise Exception("404 File Not Found")
+        content = base64.b64encode(self._files[file_path].encode("utf-8"))
+        return self._request(SimpleNamespace(content=content))
+
+    def repository_tree(self, **kwargs):
+        # Paginated at 100 entries per page, like the real API
+        pages = max(1, (len(self._tree) + 99) // 100)
+        for _ in range(pages):
+            self._request(None)
+        return self._tree
+
+    def repository_archive(self, chunk_size=1024, **kwargs):
+        self._request(None)
+        data = self._archive
+        return (data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size))
+
+
+def run_mode(files, latency, mode):
+    project = FakeProject(files, latency)
+    gl = SimpleNamespace(url="https://gitlab.example.com", projects=SimpleNamespace(get=lambda project_id: project))
+    started = time.perf_counter()
+    content = GitLabRepoHandler(gl).get_repository_content(project.id, mode=mode)
+    elapsed = time.perf_counter() - started
+    return content, project.request_count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    files = build_synthetic_repo(args.files)
+    results = {}
+    for mode in ("api", "archive"):
+        content, requests_made, elapsed = run_mode(files, args.latency_ms / 1000.0, mode)
+        results[mode] = content
+        print(f"{mode:>8}: {requests_made:5d} requests, {elapsed:7.2f}s, "
+              f"{len(content['important_files'])} important files")
+
+    same_files = {
+        path: info["content"] for path, info in results["api"]["important_files"].items()
+    } == {
+        path: info["content"] for path, info in results["archive"]["important_files"].items()
+    }
+    print(f"important_files identical: {same_files}")
+    print(f"readme/package files identical: "
+          f"{results['api']['readme_content'] == results['archive']['readme_content'] and results['api']['package_files'] == results['archive']['package_files']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Count Firestore reads per issue event with and without the repository cache.
+
+Firestore is replaced by an in-memory fake that counts document reads and
+round-trips. Each simulated event reads the event documents and builds the
+project context the way the handler does. Each event adds a comment to the
+query, as a new note on the issue would; the second and later events for the
+same project should still be served from memory. A content update in between
+shows the cache being invalidated.
+
+Usage:
+    python scripts/benchmark_repository_cache.py [--files 300] [--events 3]
+"""
+import argparse
+import copy
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.firestore_integration import FirestoreManager  # noqa: E402
+from src.repository_cache import RepositoryCache  # noqa: E402
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollection(self.db, f"{self.path}/{name}")
+
+    def get(self):
+        self.db.round_trips += 1
+        self.db.reads += 1
+        return FakeSnapshot(self, self.db.documents.get(self.path))
+
+    def set(self, data, merge=False):
+        if merge and self.path in self.db.documents:
+            self.db.documents[self.path].update(copy.deepcopy(data))
+        else:
+            self.db.documents[self.path] = copy.deepcopy(data)
+
+    def update(self, changes):
+        document = self.db.documents[self.path]
+        for field, value in changes.items():
+            document[field.split(".")[0]] = value  # enough for the top-level fields written here
+
+    def delete(self):
+        self.db.documents.pop(self.path, None)
+
+
+class FakeCollection:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    def document(self, document_id):
+        return FakeDocument(self.db, f"{self.path}/{document_id}")
+
+
+class FakeBatch:
+    def __init__(self):
+        self.operations = []
+
+    def set(self, reference, data, merge=False):
+        self.operations.append(lambda: reference.set(data, merge))
+
+    def delete(self, reference):
+        self.operations.append(reference.delete)
+
+    def commit(self):
+        for operation in self.operations:
+            operation()
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.documents = {}
+        self.reads = 0
+        self.round_trips = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch()
+
+    def get_all(self, references):
+        self.round_trips += 1
+        for reference in references:
+            self.reads += 1
+            yield FakeSnapshot(reference, self.documents.get(reference.path))
+
+
+def build_repo_content(file_count, commit_id):
+    files = {
+        f"pkg{index % 12}/module_{index}.py": {
+            "content": f"def handler_{index}(request):\n    return sort_values(request.items)\n" * 20,
+            "size": 900,
+            "type": ".py"
+        }
+        for index in range(file_count)
+    }
+    return {
+        "readme_content": "# Synthetic project\n",
+        "important_files": files,
+        "file_structure": {
+            "files": [{"path": path, "name": path.rsplit("/", 1)[-1], "size": 900} for path in files],
+            "directories": [f"pkg{index}" for index in range(12)],
+            "file_types": {".py": file_count}
+        },
+        "last_commit": {"id": commit_id}
+    }
+
+
+def run_event(manager, db, project_id, query):
+    """Read what an issue event reads (conversation cached locally) and build its context"""
+    reads, round_trips = db.reads, db.round_trips
+    documents = manager.get_event_documents(project_id)
+    manager.get_project_context(project_id, query,
+                                project_metadata=documents.get('project'), manifest=documents.get('manifest'))
+    return db.reads - reads, db.round_trips - round_trips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--events", type=int, default=3)
+    args = parser.parse_args()
+
+    query = "Sorting bug\nhandler returns the values unsorted"
+    for label, max_bytes in (("without cache", 0), ("with cache", 64 * 1024 * 1024)):
+        db = FakeFirestore()
+        manager = FirestoreManager(client=db, repository_cache=RepositoryCache(max_bytes=max_bytes))
+        manager.store_project_metadata(1, {"name": "synthetic"}, build_repo_content(args.files, "a" * 40))
+        for event in range(1, args.events + 1):
+            reads, round_trips = run_event(manager, db, 1, f"{query}\nComment {event}: still unsorted")
+            print(f"{label:>13}, event {event}: {reads:3d} document read(s) in {round_trips} round-trip(s)")
+
+        manager.update_repository_content(1, build_repo_content(args.files, "b" * 40))
+        reads, round_trips = run_event(manager, db, 1, query)
+        print(f"{label:>13}, after update: {reads:3d} document read(s) in {round_trips} round-trip(s)")
+        print(f"{label:>13}, cache stats: {manager.repository_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
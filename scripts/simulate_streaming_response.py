@@ -0,0 +1,154 @@
+"""
+Exercise streamed responses against a fake Gemini model and a fake GitLab.
+
+Runs four scenarios and checks what ends up in the issue:
+  1. ProgressiveComment + consume_response_stream with a simulated clock:
+     intermediate edits are throttled and the final body replaces the placeholder.
+  2. stream_ai_response with a model that streams normally: one comment with
+     the formatted response.
+  3. stream_ai_response with a model that fails mid-stream: the placeholder
+     (with its partial text) is deleted and no error text is posted.
+  4. stream_ai_response when GitLab rejects the final edit: the placeholder is
+     deleted, so retrying the job cannot leave a second bot comment.
+
+The repository has no test suite; this script stands in for one.
+
+Usage:
+    python scripts/simulate_streaming_response.py [--chunks 40] [--seconds-per-chunk 0.25]
+"""
+import argparse
+import itertools
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import src.google_ai_integration as google_ai  # noqa: E402
+from app.handler import stream_ai_response  # noqa: E402
+from src.conversation_store import ConversationStore  # noqa: E402
+from src.gitlab_integration import BOT_SIGNATURE, ProgressiveComment  # noqa: E402
+
+
+class FakeNotes:
+    def __init__(self, fail_updates=False):
+        self.fail_updates = fail_updates
+        self.bodies = {}
+        self.calls = []
+        self._ids = itertools.count(1)
+
+    def create(self, data):
+        note_id = next(self._ids)
+        self.bodies[note_id] = data['body']
+        self.calls.append('create')
+        return SimpleNamespace(id=note_id, body=data['body'], author={'username': 'bot'},
+                               created_at='', system=False)
+
+    def update(self, note_id, data):
+        if self.fail_updates:
+            raise RuntimeError("simulated GitLab 502")
+        self.bodies[note_id] = data['body']
+        self.calls.append('update')
+
+    def delete(self, note_id):
+        del self.bodies[note_id]
+        self.calls.append('delete')
+
+
+class FakeGitLab:
+    """Just enough of python-gitlab for creating, editing and deleting notes"""
+
+    def __init__(self, fail_updates=False):
+        self.notes = FakeNotes(fail_updates)
+        issue = SimpleNamespace(notes=self.notes)
+        project = SimpleNamespace(issues=SimpleNamespace(get=lambda iid, lazy=False: issue))
+        self.projects = SimpleNamespace(get=lambda project_id, lazy=False: project)
+
+
+class FakeModel:
+    """Streams the given text in chunks, optionally failing after some of them"""
+
+    def __init__(self, text, chunks, fail_after=None):
+        size = max(1, len(text) // chunks)
+        self.parts = [text[start:start + size] for start in range(0, len(text), size)]
+        self.fail_after = fail_after
+
+    def generate_content(self, prompt, stream=False):
+        def chunks():
+            for index, part in enumerate(self.parts):
+                if self.fail_after is not None and index == self.fail_after:
+                    raise RuntimeError("simulated API failure (quota exceeded for key AIza...)")
+                yield SimpleNamespace(parts=[part], text=part)
+        return chunks()
+
+
+def check(label, condition):
+    print(f"{'ok  ' if condition else 'FAIL'} {label}")
+    return condition
+
+
+def throttled_updates(chunks, seconds_per_chunk):
+    gl = FakeGitLab()
+    now = [0.0]
+    comment = ProgressiveComment(gl, 1, 1, min_interval=2, clock=lambda: now[0])
+    comment.start("*Thinking...*")
+
+    def on_partial(body):
+        now[0] += seconds_per_chunk
+        comment.update(body)
+
+    text = google_ai.consume_response_stream(FakeModel("word " * 400, chunks).generate_content("", stream=True),
+                                             'socratic', on_partial)
+    comment.finish(google_ai.format_mode_response('socratic', text))
+    expected_edits = int(chunks * seconds_per_chunk // 2)
+    return all([
+        check(f"{chunks} chunks over {chunks * seconds_per_chunk:.0f}s gave {comment.updates} edit(s) "
+              f"(about {expected_edits} intermediate + 1 final expected)", comment.updates <= expected_edits + 1),
+        check("final body has no streaming marker",
+              google_ai.STREAMING_MARKER not in gl.notes.bodies[comment.note.id])
+    ])
+
+
+def handler_stream(model, problem, fail_updates=False):
+    gl = FakeGitLab(fail_updates)
+    google_ai.configure_google_ai = lambda api_key=None: True
+    google_ai.get_model = lambda instruction, api_key=None: model
+    webhook_data = {'gitlab_url': 'https://gitlab.example', 'gitlab_token': 'token', 'project_id': 1,
+                    'issue_iid': 1, 'google_api_key': 'key'}
+    result = stream_ai_response(gl, webhook_data, ConversationStore(), problem, "", "", mode='socratic')
+    return result, gl.notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--seconds-per-chunk", type=float, default=0.25)
+    args = parser.parse_args()
+
+    passed = throttled_updates(args.chunks, args.seconds_per_chunk)
+
+    result, notes = handler_stream(FakeModel("What does the loop do when the list is empty? " * 5, 8),
+                                   "Issue Title: Streaming success")
+    passed &= check(f"successful stream returns success ({result['status']})", result['status'] == 'success')
+    passed &= check("one comment left on the issue", len(notes.bodies) == 1)
+    passed &= check("comment carries the bot signature",
+                    all(body.startswith(BOT_SIGNATURE) for body in notes.bodies.values()))
+
+    result, notes = handler_stream(FakeModel("Partial answer that never completes. " * 5, 8, fail_after=3),
+                                   "Issue Title: Streaming failure")
+    passed &= check(f"failed stream returns error ({result['status']})", result['status'] == 'error')
+    passed &= check(f"placeholder deleted, nothing left on the issue (calls: {', '.join(notes.calls)})",
+                    not notes.bodies)
+
+    result, notes = handler_stream(FakeModel("An answer GitLab never receives. " * 5, 8),
+                                   "Issue Title: Final edit failure", fail_updates=True)
+    passed &= check(f"failed final edit returns a retryable error ({result['status']}, "
+                    f"retryable={result.get('retryable', True)})",
+                    result['status'] == 'error' and result.get('retryable', True))
+    passed &= check(f"placeholder deleted before the retry (calls: {', '.join(notes.calls)})", not notes.bodies)
+
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
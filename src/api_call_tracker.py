@@ -0,0 +1,73 @@
+"""
+Per-event counting of outbound GitLab API calls.
+
+A counter is attached to the current thread with track_api_calls(); the shared
+GitLab HTTP session reports every response to it. Worker threads started on
+behalf of an event (e.g. parallel file downloads) join the same counter with
+use_counter().
+"""
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class ApiCallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def record(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    @property
+    def total(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def summary(self):
+        """Return a short "total (GET=n, POST=m)" description"""
+        with self._lock:
+            details = ", ".join(f"{method}={count}" for method, count in sorted(self.calls.items()))
+            return f"{sum(self.calls.values())} ({details or 'none'})"
+
+
+def current_counter():
+    """Return the counter attached to this thread, if any"""
+    return getattr(_local, 'counter', None)
+
+
+@contextmanager
+def use_counter(counter):
+    """
+    Attach an existing counter to the current thread for the duration of the block
+
+    Args:
+        counter: ApiCallCounter or None
+    """
+    previous = current_counter()
+    _local.counter = counter
+    try:
+        yield counter
+    finally:
+        _local.counter = previous
+
+
+@contextmanager
+def track_api_calls():
+    """Count API calls made by this thread (and threads that join it) within the block"""
+    with use_counter(ApiCallCounter()) as counter:
+        yield counter
+
+
+def record_api_call(method):
+    """
+    Record one API call against the active counter
+
+    Args:
+        method: HTTP method
+    """
+    counter = current_counter()
+    if counter is not None:
+        counter.record(method)
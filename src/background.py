@@ -0,0 +1,81 @@
+"""
+Shared executor for fire-and-forget work (e.g. Firestore writes) that should
+not delay the event pipeline.
+
+Tasks submitted with the same key run in submission order, so successive
+writes to one document cannot overtake each other.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', '4'))
+
+
+class BackgroundExecutor:
+    def __init__(self, max_workers=BACKGROUND_WORKERS):
+        """
+        Initialize the executor
+
+        Args:
+            max_workers: Number of worker threads
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="background")
+        self._tails = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) in the background. Exceptions are logged.
+
+        Args:
+            fn: Callable to run
+            key: Optional ordering key; tasks with the same key run one after another
+
+        Returns:
+            concurrent.futures.Future
+        """
+        with self._lock:
+            previous = self._tails.get(key) if key is not None else None
+            # The previous task was queued first, so it is already running or done when this one starts
+            future = self._executor.submit(self._run, previous, fn, args, kwargs)
+            if key is not None:
+                self._tails[key] = future
+        if key is not None:
+            # Outside the lock: the callback runs immediately if the task already finished
+            future.add_done_callback(lambda done: self._release(key, done))
+        return future
+
+    def _run(self, previous, fn, args, kwargs):
+        if previous is not None:
+            previous.exception()  # wait; its failure was already logged
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Background task {getattr(fn, '__name__', fn)} failed: {e}")
+            raise
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._tails.get(key) is future:
+                del self._tails[key]
+
+    def shutdown(self, wait=True):
+        """Stop accepting tasks and optionally wait for queued ones"""
+        self._executor.shutdown(wait=wait)
+
+
+_background_executor = None
+_background_executor_lock = threading.Lock()
+
+
+def get_background_executor():
+    """Return the process-wide background executor"""
+    global _background_executor
+    with _background_executor_lock:
+        if _background_executor is None:
+            _background_executor = BackgroundExecutor()
+        return _background_executor
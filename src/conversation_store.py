@@ -0,0 +1,110 @@
+"""
+Per-issue conversation cache: the already-normalized comments of an issue
+(newest first, as returned by get_issue_details) and the highest note id seen,
+so later events only need to fetch newer notes.
+"""
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from src.background import get_background_executor
+
+logger = logging.getLogger(__name__)
+
+# Number of issues kept in the local (in-process) cache
+CONVERSATION_CACHE_MAX_ISSUES = int(os.getenv('CONVERSATION_CACHE_MAX_ISSUES', '1000'))
+# Conversations larger than this are only cached locally (Firestore documents are limited to 1 MiB)
+CONVERSATION_STATE_MAX_BYTES = 900 * 1024
+
+
+class ConversationStore:
+    def __init__(self, firestore_mgr=None, max_issues=CONVERSATION_CACHE_MAX_ISSUES):
+        """
+        Initialize the conversation store
+
+        Args:
+            firestore_mgr: FirestoreManager used for persistence (optional; when
+                           missing or failing, only the local cache is used)
+            max_issues: Maximum number of issues kept in the local cache
+        """
+        self.firestore_mgr = firestore_mgr
+        self.max_issues = max_issues
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, project_id, issue_iid):
+        return (str(project_id), str(issue_iid))
+
+    def is_cached(self, project_id, issue_iid):
+        """Return True when the conversation of an issue is held in the local cache"""
+        with self._lock:
+            return self._key(project_id, issue_iid) in self._local
+
+    def load(self, project_id, issue_iid, prefetched=None):
+        """
+        Load the cached conversation of an issue
+
+        Args:
+            project_id: GitLab project ID
+            issue_iid: Issue internal ID
+            prefetched: Documents already read for this event (see
+                        FirestoreManager.get_event_documents); when given, its
+                        "conversation" entry is used instead of a Firestore read
+
+        Returns:
+            Dictionary with "comments" and "last_note_id", or None when nothing is cached
+        """
+        key = self._key(project_id, issue_iid)
+        with self._lock:
+            state = self._local.get(key)
+            if state is not None:
+                self._local.move_to_end(key)
+                return state
+
+        if prefetched is not None:
+            state = prefetched.get('conversation')
+        elif self.firestore_mgr is None:
+            return None
+        else:
+            state = self.firestore_mgr.get_conversation_state(project_id, issue_iid)
+        if state is not None:
+            self._remember(key, state)
+        return state
+
+    def save(self, project_id, issue_iid, state, issue_data=None, background=False):
+        """
+        Save the conversation of an issue locally and, when possible, in Firestore
+
+        Args:
+            project_id: GitLab project ID
+            issue_iid: Issue internal ID
+            state: Dictionary with "comments" and "last_note_id"
+            issue_data: Issue details to store as issue metadata in the same
+                        Firestore batch (optional)
+            background: Write to Firestore on the background executor instead of
+                        waiting for it; writes for one issue keep their order
+        """
+        self._remember(self._key(project_id, issue_iid), state)
+        if self.firestore_mgr is None:
+            return
+        size = len(json.dumps(state, default=str))
+        if size > CONVERSATION_STATE_MAX_BYTES:
+            logger.warning(f"Conversation of issue {issue_iid} in project {project_id} is {size} bytes; caching it locally only")
+            state = None
+            if issue_data is None:
+                return
+        if background:
+            get_background_executor().submit(
+                self.firestore_mgr.store_issue_event, project_id, issue_iid, issue_data, state,
+                key=self._key(project_id, issue_iid)
+            )
+        else:
+            self.firestore_mgr.store_issue_event(project_id, issue_iid, issue_data, state)
+
+    def _remember(self, key, state):
+        with self._lock:
+            self._local[key] = state
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_issues:
+                self._local.popitem(last=False)
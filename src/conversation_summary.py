@@ -0,0 +1,87 @@
+"""
+Rolling summary of older conversation turns.
+
+The newest comments of an issue are sent to the model verbatim; comments that
+fall out of that window are folded, once, into a stored extractive summary
+(one line per comment, oldest lines dropped beyond a size cap). The summary is
+kept in the issue's conversation state, so each event only summarizes the
+comments that just left the window and the prompt stays roughly constant in
+size however long the session runs.
+"""
+import os
+from src.gitlab_integration import BOT_SIGNATURE
+from src.prompt_budget import summarize_turn
+
+# Comments kept verbatim in the conversation history
+CONVERSATION_SUMMARY_RECENT_COMMENTS = int(os.getenv('CONVERSATION_SUMMARY_RECENT_COMMENTS', '10'))
+# Maximum size of the stored summary; the oldest lines are dropped first
+CONVERSATION_SUMMARY_MAX_CHARS = int(os.getenv('CONVERSATION_SUMMARY_MAX_CHARS', '4000'))
+
+
+def update_summary(comments, summary, is_bot_comment, keep_recent=None, max_chars=None):
+    """
+    Fold comments that left the verbatim window into the summary
+
+    Args:
+        comments: Conversation comments, newest first
+        summary: Previously stored summary (or None)
+        is_bot_comment: Callable telling whether a comment body was posted by the bot
+        keep_recent: Comments kept verbatim (default: CONVERSATION_SUMMARY_RECENT_COMMENTS)
+        max_chars: Summary size cap (default: CONVERSATION_SUMMARY_MAX_CHARS)
+
+    Returns:
+        Summary dictionary with "lines", "through_note_id" (newest comment
+        folded in) and "omitted" (lines dropped by the size cap), or None when
+        nothing needs summarizing yet. Comments already folded in are not
+        revisited, so later edits to them are not reflected.
+    """
+    keep_recent = CONVERSATION_SUMMARY_RECENT_COMMENTS if keep_recent is None else keep_recent
+    max_chars = CONVERSATION_SUMMARY_MAX_CHARS if max_chars is None else max_chars
+
+    summary = summary or {'lines': [], 'through_note_id': 0, 'omitted': 0}
+    through_note_id = summary.get('through_note_id', 0)
+    aged = [
+        comment for comment in comments[keep_recent:]
+        if comment['id'] > through_note_id and not comment.get('system')
+    ]
+    if not aged:
+        return summary if summary['lines'] or summary.get('omitted') else None
+
+    lines = list(summary['lines'])
+    for comment in reversed(aged):  # oldest first
+        body = comment['body']
+        if is_bot_comment(body):
+            line = f"AI: {body.replace(BOT_SIGNATURE, '')}"
+        else:
+            line = f"User ({comment['author']}): {body}"
+        lines.append(summarize_turn(line))
+
+    omitted = summary.get('omitted', 0)
+    total = sum(len(line) + 1 for line in lines)
+    while lines and total > max_chars:
+        total -= len(lines.pop(0)) + 1
+        omitted += 1
+
+    return {
+        'lines': lines,
+        'through_note_id': max(through_note_id, max(comment['id'] for comment in aged)),
+        'omitted': omitted
+    }
+
+
+def format_summary(summary):
+    """
+    Render a stored summary as a conversation history turn
+
+    Args:
+        summary: Summary dictionary from update_summary
+
+    Returns:
+        Text block, or an empty string when there is nothing to show
+    """
+    if not summary or not (summary.get('lines') or summary.get('omitted')):
+        return ""
+    header = "Summary of earlier conversation (oldest first):"
+    if summary.get('omitted'):
+        header += f"\n- ({summary['omitted']} older comment(s) omitted)"
+    return header + ("\n" + "\n".join(summary['lines']) if summary.get('lines') else "")
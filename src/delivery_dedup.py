@@ -0,0 +1,132 @@
+"""
+Deduplication of GitLab webhook deliveries.
+
+GitLab re-sends a webhook when the endpoint times out or fails. Each delivery is
+identified by its Idempotency-Key / X-Gitlab-Event-UUID headers and, for note
+events, by the note id and its last update time, so a retried delivery is
+rejected before it is queued while an edited note still gets through.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_DEDUP_MAX_ENTRIES = int(os.getenv('WEBHOOK_DEDUP_MAX_ENTRIES', '10000'))
+WEBHOOK_DEDUP_TTL = int(os.getenv('WEBHOOK_DEDUP_TTL', '86400'))
+WEBHOOK_DEDUP_DB_PATH = os.getenv('WEBHOOK_DEDUP_DB_PATH')  # Set to remember deliveries across restarts
+
+
+def delivery_keys(headers, payload):
+    """
+    Build the identifiers of a webhook delivery
+
+    Args:
+        headers: Request headers (mapping)
+        payload: Parsed webhook payload
+
+    Returns:
+        List of key strings (empty when the delivery cannot be identified)
+    """
+    keys = []
+    idempotency_key = headers.get('Idempotency-Key')
+    if idempotency_key:
+        keys.append(f"idempotency:{idempotency_key}")
+    event_uuid = headers.get('X-Gitlab-Event-UUID')
+    if event_uuid:
+        keys.append(f"event:{event_uuid}")
+    if payload.get('object_kind') == 'note':
+        note = payload.get('object_attributes') or {}
+        project_id = (payload.get('project') or {}).get('id')
+        if note.get('id'):
+            keys.append(f"note:{project_id}:{note['id']}:{note.get('updated_at') or note.get('created_at')}")
+    return keys
+
+
+class DeliveryDeduplicator:
+    def __init__(self, max_entries=WEBHOOK_DEDUP_MAX_ENTRIES, ttl=WEBHOOK_DEDUP_TTL, db_path=WEBHOOK_DEDUP_DB_PATH):
+        """
+        Initialize the deduplicator
+
+        Args:
+            max_entries: Maximum number of keys kept in memory
+            ttl: Seconds a delivery is remembered
+            db_path: Optional SQLite file so keys survive restarts and are
+                     shared by workers on the same host
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.duplicates = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            with self._lock:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS deliveries (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM deliveries WHERE seen_at < ?", (time.time() - self.ttl,))
+                self._db.commit()
+
+    def check_and_mark(self, keys):
+        """
+        Record a delivery unless one of its keys was already seen
+
+        Args:
+            keys: Keys from delivery_keys
+
+        Returns:
+            True when the delivery is a duplicate, False when it is new (and now recorded)
+        """
+        if not keys:
+            return False
+        now = time.time()
+        with self._lock:
+            if any(self._is_known(key, now) for key in keys):
+                self.duplicates += 1
+                return True
+            for key in keys:
+                self._seen[key] = now
+                self._seen.move_to_end(key)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            if self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO deliveries (key, seen_at) VALUES (?, ?)",
+                    [(key, now) for key in keys]
+                )
+                self._db.commit()
+        return False
+
+    def forget(self, keys):
+        """
+        Drop keys so a redelivery is accepted again (e.g. when queueing failed)
+
+        Args:
+            keys: Keys from delivery_keys
+        """
+        with self._lock:
+            for key in keys:
+                self._seen.pop(key, None)
+            if self._db:
+                self._db.executemany("DELETE FROM deliveries WHERE key = ?", [(key,) for key in keys])
+                self._db.commit()
+
+    def _is_known(self, key, now):
+        # Caller holds self._lock
+        seen_at = self._seen.get(key)
+        if seen_at is not None:
+            if now - seen_at <= self.ttl:
+                self._seen.move_to_end(key)
+                return True
+            del self._seen[key]
+        if self._db:
+            row = self._db.execute(
+                "SELECT seen_at FROM deliveries WHERE key = ? AND seen_at >= ?", (key, now - self.ttl)
+            ).fetchone()
+            return row is not None
+        return False
@@ -0,0 +1,125 @@
+"""
+Bounded, rate-limited parallel fetch engine used for downloading repository files.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+from src.api_call_tracker import current_counter, use_counter
+
+logger = logging.getLogger(__name__)
+
+# Default parallelism and per-host request rate (requests/second, 0 = unlimited)
+FETCH_MAX_WORKERS = int(os.getenv('GITLAB_FETCH_MAX_WORKERS', '8'))
+FETCH_RATE_LIMIT = float(os.getenv('GITLAB_FETCH_RATE_LIMIT', '0'))
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """
+        Token bucket rate limiter
+
+        Args:
+            rate: Allowed requests per second (0 or less disables limiting)
+            burst: Bucket capacity (default: max(1, rate))
+        """
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request slot is available"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+
+
+def get_host_rate_limiter(url: str, rate: float) -> RateLimiter:
+    """
+    Return the shared rate limiter for the host of the given URL, so all
+    engines talking to the same GitLab instance share one budget.
+
+    Args:
+        url: Any URL on the target host
+        rate: Requests per second for this host
+    """
+    host = urlparse(url).netloc or url
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None or limiter.rate != rate:
+            limiter = RateLimiter(rate)
+            _host_limiters[host] = limiter
+        return limiter
+
+
+class FileFetchEngine:
+    def __init__(self, max_workers: int = None, rate_limiter: Optional[RateLimiter] = None):
+        """
+        Initialize the fetch engine
+
+        Args:
+            max_workers: Maximum number of concurrent fetches
+            rate_limiter: Optional RateLimiter applied before every fetch
+        """
+        self.max_workers = max(1, max_workers or FETCH_MAX_WORKERS)
+        self.rate_limiter = rate_limiter
+
+    def fetch_all(self, paths: Iterable[str], fetch_fn: Callable[[str], object]) -> Tuple[Dict, Dict]:
+        """
+        Fetch every path concurrently
+
+        Args:
+            paths: Paths to fetch (duplicates are fetched once)
+            fetch_fn: Callable taking a path and returning its content
+
+        Returns:
+            Tuple of (results, errors) dictionaries keyed by path. Results keep
+            the order of the input paths.
+        """
+        unique_paths = list(dict.fromkeys(paths))
+        if not unique_paths:
+            return {}, {}
+
+        # Worker threads report API calls to the caller's counter
+        counter = current_counter()
+
+        def run(path):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            with use_counter(counter):
+                return fetch_fn(path)
+
+        outcomes = {}
+        started = time.time()
+        workers = min(self.max_workers, len(unique_paths))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="file-fetch") as executor:
+            futures = {path: executor.submit(run, path) for path in unique_paths}
+            for path, future in futures.items():
+                try:
+                    outcomes[path] = (True, future.result())
+                except Exception as e:
+                    outcomes[path] = (False, e)
+
+        results = {path: value for path, (ok, value) in outcomes.items() if ok}
+        errors = {path: str(value) for path, (ok, value) in outcomes.items() if not ok}
+        logger.info(f"Fetched {len(results)}/{len(unique_paths)} paths with {workers} worker(s) "
+                    f"in {time.time() - started:.2f}s ({len(errors)} error(s))")
+        return results, errors
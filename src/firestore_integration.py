@@ -6,20 +6,51 @@ from google.cloud import firestore
 from google.oauth2 import service_account
 import os
 import json
+import hashlib
+import threading
+import time
+import uuid
 from datetime import datetime
+from src.retrieval_index import BM25Index
+from src.repository_cache import RepositoryCache, estimate_size, repository_version
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Repository content is stored as a manifest document plus one document per
+# important file and a few file-structure shards, keeping every document well
+# below Firestore's 1 MiB limit.
+REPOSITORY_LAYOUT = 'sharded'
+STRUCTURE_SHARD_SIZE = 1000
+MAX_BATCH_OPERATIONS = 400
+# Estimated payload per batch, below the 10 MiB limit of a commit request
+MAX_BATCH_BYTES = 9 * 1024 * 1024
+# Serialized retrieval index is split into documents of at most this many bytes
+INDEX_SHARD_BYTES = 900 * 1024
+# Longest file excerpt placed in the LLM context
+MAX_CONTEXT_CHUNK_CHARS = 1000
+
 class FirestoreManager:
-    def __init__(self, service_account_path=None):
+    def __init__(self, service_account_path=None, client=None, repository_cache=None):
         """
         Initialize Firestore client
         
         Args:
             service_account_path: Path to service account JSON file
+            client: Pre-built Firestore client (e.g. emulator or in-memory fake), optional
+            repository_cache: RepositoryCache for repository content and rendered context (optional)
         """
+        # Deserialized retrieval indexes keyed by project, tagged with their version
+        self._index_cache = {}
+        self._index_cache_lock = threading.Lock()
+        self.repository_cache = repository_cache if repository_cache is not None else RepositoryCache()
+        
+        if client is not None:
+            self.db = client
+            logger.info("Firestore client provided by caller")
+            return
+        
         try:
             # Default service account path
             if not service_account_path:
@@ -77,13 +108,9 @@ class FirestoreManager:
             
             # Store repository content if provided
             if repo_content:
-                repo_doc_ref = self.db.collection('projects').document(str(project_id)).collection('repository').document('content')
-                repo_doc_ref.set({
-                    'content': repo_content,
-                    'updated_at': datetime.utcnow(),
-                    'project_id': project_id
-                }, merge=True)
+                self._store_repository_content(project_id, repo_content)
                 logger.info(f"Stored repository content for project {project_id}")
+            self.repository_cache.invalidate(project_id)
             
             logger.info(f"Stored metadata for project {project_id}")
             return True
@@ -159,23 +186,8 @@ class FirestoreManager:
             issue_data: Dictionary containing issue information
         """
         try:
-            doc_ref = self.db.collection('projects').document(str(project_id)).collection('issues').document(str(issue_iid))
-            
-            metadata = {
-                'issue_iid': issue_iid,
-                'project_id': project_id,
-                'title': issue_data.get('title', ''),
-                'description': issue_data.get('description', ''),
-                'state': issue_data.get('state', ''),
-                'created_at': issue_data.get('created_at', ''),
-                'updated_at': issue_data.get('updated_at', ''),
-                'author': issue_data.get('author', {}),
-                'labels': issue_data.get('labels', []),
-                'is_rubber_duck_session': True,
-                'last_ai_response': datetime.utcnow()
-            }
-            
-            doc_ref.set(metadata, merge=True)
+            doc_ref = self._issue_doc_ref(project_id, issue_iid)
+            doc_ref.set(self._issue_metadata(project_id, issue_iid, issue_data), merge=True)
             logger.info(f"Stored issue metadata for project {project_id}, issue {issue_iid}")
             return True
             
@@ -183,26 +195,526 @@ class FirestoreManager:
             logger.error(f"Failed to store issue metadata for {project_id}/{issue_iid}: {e}")
             return False
 
-    def get_repository_content(self, project_id):
+    def _issue_doc_ref(self, project_id, issue_iid):
+        return self.db.collection('projects').document(str(project_id)).collection('issues').document(str(issue_iid))
+
+    def _issue_metadata(self, project_id, issue_iid, issue_data):
+        return {
+            'issue_iid': issue_iid,
+            'project_id': project_id,
+            'title': issue_data.get('title', ''),
+            'description': issue_data.get('description', ''),
+            'state': issue_data.get('state', ''),
+            'created_at': issue_data.get('created_at', ''),
+            'updated_at': issue_data.get('updated_at', ''),
+            'author': issue_data.get('author', {}),
+            'labels': issue_data.get('labels', []),
+            'is_rubber_duck_session': True,
+            'last_ai_response': datetime.utcnow()
+        }
+
+    def _conversation_doc_ref(self, project_id, issue_iid):
+        return self._issue_doc_ref(project_id, issue_iid).collection('conversation').document('state')
+
+    def get_event_documents(self, project_id, issue_iid=None):
         """
-        Retrieve repository content from Firestore
+        Read every document an issue event needs in a single round-trip: the
+        project metadata, the repository manifest and (for issue events) the
+        cached conversation state
         
         Args:
             project_id: GitLab project ID
+            issue_iid: Issue internal ID (optional)
             
         Returns:
-            Dictionary with repository content or None if not found
+            Dictionary with "project", "manifest" and, when issue_iid is given,
+            "conversation" (each None if the document does not exist), or None
+            if the read failed. Project and manifest come from the repository
+            cache while it holds them, so no read is made when issue_iid is None.
         """
         try:
-            repo_doc_ref = self.db.collection('projects').document(str(project_id)).collection('repository').document('content')
-            doc = repo_doc_ref.get()
+            refs = {}
+            documents = {}
+            cached = self.repository_cache.get_documents(project_id)
+            if cached:
+                documents['project'], documents['manifest'] = cached
+            else:
+                refs['project'] = self.db.collection('projects').document(str(project_id))
+                refs['manifest'] = self._repository_doc_ref(project_id)
+            if issue_iid is not None:
+                refs['conversation'] = self._conversation_doc_ref(project_id, issue_iid)
+            if not refs:
+                return documents
+            names = {ref.path: name for name, ref in refs.items()}
+            
+            documents.update(dict.fromkeys(refs))
+            for doc in self.db.get_all(list(refs.values())):
+                if doc.exists:
+                    documents[names[doc.reference.path]] = doc.to_dict()
+            if not cached:
+                if documents['manifest'] is not None:
+                    documents['manifest'] = self._manifest_from_doc(documents['manifest'])
+                self.repository_cache.set_documents(project_id, documents['project'], documents['manifest'])
+            logger.info(f"Read event documents for project {project_id}, issue {issue_iid} in one round-trip "
+                        f"(found: {', '.join(name for name, data in documents.items() if data is not None) or 'none'})")
+            return documents
+        except Exception as e:
+            logger.error(f"Failed to read event documents for {project_id}/{issue_iid}: {e}")
+            return None
+
+    def store_issue_event(self, project_id, issue_iid, issue_data=None, conversation_state=None):
+        """
+        Write the issue metadata and the conversation state of an issue in one batch
+        
+        Args:
+            project_id: GitLab project ID
+            issue_iid: Issue internal ID
+            issue_data: Issue information for the issue metadata document (optional)
+            conversation_state: Conversation state dictionary (optional)
+        """
+        try:
+            batch = self.db.batch()
+            if issue_data is not None:
+                batch.set(self._issue_doc_ref(project_id, issue_iid),
+                          self._issue_metadata(project_id, issue_iid, issue_data), merge=True)
+            if conversation_state is not None:
+                batch.set(self._conversation_doc_ref(project_id, issue_iid),
+                          dict(conversation_state, updated_at=datetime.utcnow()))
+            batch.commit()
+            logger.info(f"Stored issue event documents for project {project_id}, issue {issue_iid}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to store issue event documents for {project_id}/{issue_iid}: {e}")
+            return False
+
+    def get_conversation_state(self, project_id, issue_iid):
+        """
+        Retrieve the cached conversation (normalized comments and highest note id) of an issue
+        
+        Args:
+            project_id: GitLab project ID
+            issue_iid: Issue internal ID
             
+        Returns:
+            Dictionary with conversation state or None if not found
+        """
+        try:
+            doc = self._conversation_doc_ref(project_id, issue_iid).get()
             if doc.exists:
-                logger.info(f"Retrieved repository content for project {project_id}")
-                return doc.to_dict().get('content', {})
+                logger.info(f"Retrieved conversation state for project {project_id}, issue {issue_iid}")
+                return doc.to_dict()
+            return None
+        except Exception as e:
+            logger.error(f"Failed to retrieve conversation state for {project_id}/{issue_iid}: {e}")
+            return None
+
+    def store_conversation_state(self, project_id, issue_iid, state):
+        """
+        Store the cached conversation of an issue
+        
+        Args:
+            project_id: GitLab project ID
+            issue_iid: Issue internal ID
+            state: Conversation state dictionary
+        """
+        try:
+            self._conversation_doc_ref(project_id, issue_iid).set(dict(state, updated_at=datetime.utcnow()))
+            logger.info(f"Stored conversation state for project {project_id}, issue {issue_iid}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to store conversation state for {project_id}/{issue_iid}: {e}")
+            return False
+
+    def acquire_lease(self, project_id, name, owner, ttl):
+        """
+        Take a named per-project lease in a transaction, unless another owner
+        holds one that has not expired
+        
+        Args:
+            project_id: GitLab project ID
+            name: Lease name (e.g. "repository")
+            owner: Unique id of the caller
+            ttl: Seconds until the lease expires if it is not released
+            
+        Returns:
+            True if the lease was taken, False if another owner holds it, or
+            None if Firestore could not be reached
+        """
+        try:
+            lease_ref = self.db.collection('projects').document(str(project_id)).collection('leases').document(name)
+            
+            @firestore.transactional
+            def claim(transaction):
+                snapshot = lease_ref.get(transaction=transaction)
+                lease = snapshot.to_dict() if snapshot.exists else None
+                now = time.time()
+                if lease and lease.get('owner') != owner and lease.get('expires_at', 0) > now:
+                    return False
+                transaction.set(lease_ref, {'owner': owner, 'acquired_at': now, 'expires_at': now + ttl})
+                return True
+            
+            acquired = claim(self.db.transaction())
+            if acquired:
+                logger.info(f"Acquired {name} lease for project {project_id}")
+            return acquired
+        except Exception as e:
+            logger.error(f"Failed to acquire {name} lease for {project_id}: {e}")
+            return None
+
+    def release_lease(self, project_id, name, owner):
+        """
+        Release a lease taken with acquire_lease, if the caller still owns it
+        
+        Args:
+            project_id: GitLab project ID
+            name: Lease name
+            owner: Owner id passed to acquire_lease
+        """
+        try:
+            lease_ref = self.db.collection('projects').document(str(project_id)).collection('leases').document(name)
+            
+            @firestore.transactional
+            def drop(transaction):
+                snapshot = lease_ref.get(transaction=transaction)
+                if snapshot.exists and snapshot.to_dict().get('owner') == owner:
+                    transaction.delete(lease_ref)
+            
+            drop(self.db.transaction())
+            logger.info(f"Released {name} lease for project {project_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to release {name} lease for {project_id}: {e}")
+            return False
+
+    def _repository_doc_ref(self, project_id):
+        return self.db.collection('projects').document(str(project_id)).collection('repository').document('content')
+
+    def _file_doc_id(self, file_path):
+        # File paths contain "/" which is not allowed in document IDs
+        return hashlib.sha1(file_path.encode('utf-8')).hexdigest()
+
+    def _commit_in_batches(self, operations):
+        """
+        Commit write operations in batches below Firestore's per-batch operation
+        count and request size limits
+        
+        Args:
+            operations: List of ('set', ref, data) or ('delete', ref, None) tuples
+        """
+        batch, count, size = None, 0, 0
+        for action, ref, data in operations:
+            op_size = estimate_size(data) if action == 'set' else 0
+            if batch is not None and (count >= MAX_BATCH_OPERATIONS or size + op_size > MAX_BATCH_BYTES):
+                batch.commit()
+                batch = None
+            if batch is None:
+                batch, count, size = self.db.batch(), 0, 0
+            if action == 'set':
+                batch.set(ref, data)
             else:
+                batch.delete(ref)
+            count += 1
+            size += op_size
+        if batch is not None:
+            batch.commit()
+
+    def _structure_operations(self, repo_doc_ref, file_structure, previous_shards=0):
+        """
+        Build write operations that store the file list and directories in shards
+        
+        Returns:
+            Tuple of (operations, shard count, structure summary for the manifest)
+        """
+        files = file_structure.get('files', [])
+        directories = file_structure.get('directories', [])
+        shard_count = max(
+            (len(files) + STRUCTURE_SHARD_SIZE - 1) // STRUCTURE_SHARD_SIZE,
+            (len(directories) + STRUCTURE_SHARD_SIZE - 1) // STRUCTURE_SHARD_SIZE
+        )
+        operations = []
+        for shard in range(shard_count):
+            window = slice(shard * STRUCTURE_SHARD_SIZE, (shard + 1) * STRUCTURE_SHARD_SIZE)
+            operations.append(('set', repo_doc_ref.collection('structure').document(str(shard)), {
+                'files': files[window],
+                'directories': directories[window]
+            }))
+        for shard in range(shard_count, previous_shards):
+            operations.append(('delete', repo_doc_ref.collection('structure').document(str(shard)), None))
+        
+        summary = {
+            'file_count': len(files),
+            'directory_count': len(directories),
+            'file_types': file_structure.get('file_types', {}),
+            'max_depth': file_structure.get('max_depth', 0)
+        }
+        return operations, shard_count, summary
+
+    def _index_operations(self, repo_doc_ref, index, previous_shards=0):
+        """
+        Build write operations that persist a retrieval index in byte shards
+        
+        Returns:
+            Tuple of (operations, shard count)
+        """
+        raw = index.to_bytes()
+        shard_count = max(1, (len(raw) + INDEX_SHARD_BYTES - 1) // INDEX_SHARD_BYTES)
+        operations = []
+        for shard in range(shard_count):
+            operations.append(('set', repo_doc_ref.collection('index').document(str(shard)), {
+                'data': raw[shard * INDEX_SHARD_BYTES:(shard + 1) * INDEX_SHARD_BYTES]
+            }))
+        for shard in range(shard_count, previous_shards):
+            operations.append(('delete', repo_doc_ref.collection('index').document(str(shard)), None))
+        return operations, shard_count
+
+    def get_retrieval_index(self, project_id, manifest=None):
+        """
+        Load the retrieval index for a project, reusing the deserialized index
+        while its stored version is unchanged
+        
+        Args:
+            project_id: GitLab project ID
+            manifest: Previously loaded manifest (optional, avoids a read)
+            
+        Returns:
+            BM25Index or None if the project has no index
+        """
+        try:
+            manifest = manifest or self.get_repository_manifest(project_id)
+            if not manifest or not manifest.get('index_shards'):
+                return None
+            
+            version = manifest.get('index_version')
+            with self._index_cache_lock:
+                cached = self._index_cache.get(str(project_id))
+            if cached and cached[0] == version:
+                return cached[1]
+            
+            repo_doc_ref = self._repository_doc_ref(project_id)
+            refs = [repo_doc_ref.collection('index').document(str(shard)) for shard in range(manifest['index_shards'])]
+            shards = {doc.id: doc.to_dict().get('data', b'') for doc in self.db.get_all(refs) if doc.exists}
+            if len(shards) != manifest['index_shards']:
+                logger.warning(f"Retrieval index for project {project_id} is incomplete; ignoring it")
+                return None
+            index = BM25Index.from_bytes(b''.join(shards[str(shard)] for shard in range(manifest['index_shards'])))
+            
+            with self._index_cache_lock:
+                self._index_cache[str(project_id)] = (version, index)
+            logger.info(f"Loaded retrieval index for project {project_id} ({len(index or [])} chunks)")
+            return index
+            
+        except Exception as e:
+            logger.error(f"Failed to load retrieval index for {project_id}: {e}")
+            return None
+
+    def _store_repository_content(self, project_id, repo_content):
+        """
+        Write repository content in the sharded layout, replacing any previous content
+        
+        Args:
+            project_id: GitLab project ID
+            repo_content: Repository content dictionary
+        """
+        repo_doc_ref = self._repository_doc_ref(project_id)
+        previous = repo_doc_ref.get()
+        previous_data = previous.to_dict() if previous.exists else {}
+        if previous_data.get('layout') != REPOSITORY_LAYOUT:
+            previous_data = {}
+        
+        operations = []
+        file_index = {}
+        for file_path, file_info in repo_content.get('important_files', {}).items():
+            doc_id = self._file_doc_id(file_path)
+            file_index[file_path] = {
+                'doc_id': doc_id,
+                'size': file_info.get('size', 0),
+                'type': file_info.get('type', '')
+            }
+            operations.append(('set', repo_doc_ref.collection('files').document(doc_id), dict(file_info, path=file_path)))
+        
+        # Remove file documents that are no longer part of the content
+        for file_path, entry in previous_data.get('file_index', {}).items():
+            if file_path not in file_index:
+                operations.append(('delete', repo_doc_ref.collection('files').document(entry['doc_id']), None))
+        
+        structure_ops, shard_count, summary = self._structure_operations(
+            repo_doc_ref, repo_content.get('file_structure', {}), previous_data.get('structure_shards', 0)
+        )
+        operations.extend(structure_ops)
+        
+        index = BM25Index.build(repo_content.get('important_files', {}))
+        index_ops, index_shards = self._index_operations(repo_doc_ref, index, previous_data.get('index_shards', 0))
+        operations.extend(index_ops)
+        
+        manifest_content = {
+            key: value for key, value in repo_content.items()
+            if key not in ('important_files', 'file_structure')
+        }
+        manifest_content['file_structure'] = summary
+        
+        # File and structure documents first, so readers never see a manifest
+        # that points to documents which do not exist yet
+        self._commit_in_batches(operations)
+        repo_doc_ref.set({
+            'layout': REPOSITORY_LAYOUT,
+            'content': manifest_content,
+            'file_index': file_index,
+            'structure_shards': shard_count,
+            'index_shards': index_shards,
+            'index_version': uuid.uuid4().hex,
+            'updated_at': datetime.utcnow(),
+            'project_id': project_id
+        })
+        logger.info(f"Stored repository content for project {project_id} as {len(file_index)} file document(s) and {shard_count} structure shard(s)")
+
+    def get_repository_manifest(self, project_id):
+        """
+        Retrieve the repository manifest (everything except file bodies and the
+        full file list) from Firestore
+        
+        Args:
+            project_id: GitLab project ID
+            
+        Returns:
+            Dictionary with "content" (summary repository content) and
+            "file_index" (path -> file document info), or None if not found
+        """
+        try:
+            doc = self._repository_doc_ref(project_id).get()
+            
+            if not doc.exists:
                 logger.info(f"No repository content found for project {project_id}")
                 return None
+            
+            logger.info(f"Retrieved repository manifest for project {project_id}")
+            return self._manifest_from_doc(doc.to_dict())
+                
+        except Exception as e:
+            logger.error(f"Failed to retrieve repository manifest for {project_id}: {e}")
+            return None
+
+    def _manifest_from_doc(self, data):
+        """Normalize a repository document into the manifest format"""
+        if data.get('layout') != REPOSITORY_LAYOUT:
+            # Legacy single-document layout: the whole content is inline
+            content = data.get('content', {})
+            return {
+                'layout': 'legacy',
+                'content': content,
+                'file_index': {path: {'size': info.get('size', 0), 'type': info.get('type', '')}
+                               for path, info in content.get('important_files', {}).items()},
+                'structure_shards': 0
+            }
+        return data
+
+    def get_repository_files(self, project_id, file_paths, manifest=None):
+        """
+        Retrieve the stored content of specific important files in one round-trip
+        
+        Args:
+            project_id: GitLab project ID
+            file_paths: Paths of the files to load
+            manifest: Previously loaded manifest (optional, avoids a read)
+            
+        Returns:
+            Dictionary mapping file path to file info (including "content")
+        """
+        try:
+            manifest = manifest or self.get_repository_manifest(project_id)
+            if not manifest:
+                return {}
+            
+            if manifest.get('layout') != REPOSITORY_LAYOUT:
+                important_files = manifest['content'].get('important_files', {})
+                return {path: important_files[path] for path in file_paths if path in important_files}
+            
+            # Files of this repository version already in memory are not read again
+            version = repository_version(manifest)
+            files = {}
+            for path in file_paths:
+                cached = self.repository_cache.get(project_id, version, f"file:{path}")
+                if cached is not None:
+                    files[path] = cached
+            
+            repo_doc_ref = self._repository_doc_ref(project_id)
+            file_index = manifest.get('file_index', {})
+            refs = [
+                repo_doc_ref.collection('files').document(file_index[path]['doc_id'])
+                for path in file_paths if path in file_index and path not in files
+            ]
+            if refs:
+                for doc in self.db.get_all(refs):
+                    if doc.exists:
+                        data = doc.to_dict()
+                        path = data.pop('path')
+                        files[path] = data
+                        self.repository_cache.set(project_id, version, f"file:{path}", data)
+            # Preserve the requested order
+            return {path: files[path] for path in file_paths if path in files}
+            
+        except Exception as e:
+            logger.error(f"Failed to retrieve repository files for {project_id}: {e}")
+            return {}
+
+    def get_repository_content(self, project_id, include_file_contents=True):
+        """
+        Retrieve repository content from Firestore
+        
+        Args:
+            project_id: GitLab project ID
+            include_file_contents: Load the body of every important file. When
+                False, important_files entries only carry size and type.
+            
+        Returns:
+            Dictionary with repository content or None if not found
+        """
+        try:
+            manifest = self.get_repository_manifest(project_id)
+            if not manifest:
+                return None
+            
+            if manifest.get('layout') != REPOSITORY_LAYOUT:
+                return manifest['content']
+            
+            version = repository_version(manifest)
+            cache_name = f"content:{'full' if include_file_contents else 'index'}"
+            cached = self.repository_cache.get(project_id, version, cache_name)
+            if cached is not None:
+                logger.info(f"Serving repository content for project {project_id} from memory")
+                return cached
+            
+            repo_content = dict(manifest.get('content', {}))
+            
+            # Reassemble the full file structure from its shards
+            repo_doc_ref = self._repository_doc_ref(project_id)
+            summary = repo_content.get('file_structure', {})
+            file_structure = {
+                'directories': [],
+                'files': [],
+                'file_types': summary.get('file_types', {}),
+                'max_depth': summary.get('max_depth', 0)
+            }
+            shard_refs = [repo_doc_ref.collection('structure').document(str(shard))
+                          for shard in range(manifest.get('structure_shards', 0))]
+            shards = {doc.id: doc.to_dict() for doc in self.db.get_all(shard_refs) if doc.exists} if shard_refs else {}
+            for shard in range(manifest.get('structure_shards', 0)):
+                data = shards.get(str(shard), {})
+                file_structure['files'].extend(data.get('files', []))
+                file_structure['directories'].extend(data.get('directories', []))
+            repo_content['file_structure'] = file_structure
+            
+            file_index = manifest.get('file_index', {})
+            if include_file_contents:
+                repo_content['important_files'] = self.get_repository_files(project_id, list(file_index), manifest)
+            else:
+                repo_content['important_files'] = {
+                    path: {'size': entry.get('size', 0), 'type': entry.get('type', '')}
+                    for path, entry in file_index.items()
+                }
+            
+            self.repository_cache.set(project_id, version, cache_name, repo_content)
+            logger.info(f"Retrieved repository content for project {project_id}")
+            return repo_content
                 
         except Exception as e:
             logger.error(f"Failed to retrieve repository content for {project_id}: {e}")
@@ -217,18 +729,14 @@ class FirestoreManager:
             repo_content: Updated repository content
         """
         try:
-            repo_doc_ref = self.db.collection('projects').document(str(project_id)).collection('repository').document('content')
-            repo_doc_ref.set({
-                'content': repo_content,
-                'updated_at': datetime.utcnow(),
-                'project_id': project_id
-            }, merge=True)
+            self._store_repository_content(project_id, repo_content)
             
             # Update project metadata timestamp
             project_doc_ref = self.db.collection('projects').document(str(project_id))
             project_doc_ref.update({
                 'last_repo_update': datetime.utcnow()
             })
+            self.repository_cache.invalidate(project_id)
             
             logger.info(f"Updated repository content for project {project_id}")
             return True
@@ -237,28 +745,129 @@ class FirestoreManager:
             logger.error(f"Failed to update repository content for {project_id}: {e}")
             return False
 
-    def get_project_context(self, project_id, issue_content, max_files=10):
+    def patch_repository_content(self, project_id, update):
+        """
+        Apply an incremental update to stored repository content, writing only
+        the changed file documents and manifest fields
+        
+        Args:
+            project_id: GitLab project ID
+            update: Dictionary with "important_files" (path -> file info to
+                    upsert), "removed_files" (paths to delete) and "fields"
+                    (top-level content keys to replace)
+            
+        Returns:
+            Boolean indicating success. Content stored in the legacy
+            single-document layout cannot be patched and returns False, so the
+            caller falls back to a full refresh (which migrates the layout).
+        """
+        try:
+            repo_doc_ref = self._repository_doc_ref(project_id)
+            doc = repo_doc_ref.get()
+            if not doc.exists or doc.to_dict().get('layout') != REPOSITORY_LAYOUT:
+                logger.info(f"Repository content for project {project_id} is not in the sharded layout; cannot patch")
+                return False
+            manifest = doc.to_dict()
+            
+            operations = []
+            changes = {'updated_at': datetime.utcnow()}
+            for file_path, file_info in update.get('important_files', {}).items():
+                doc_id = self._file_doc_id(file_path)
+                operations.append(('set', repo_doc_ref.collection('files').document(doc_id), dict(file_info, path=file_path)))
+                field = firestore.FieldPath('file_index', file_path).to_api_repr()
+                changes[field] = {'doc_id': doc_id, 'size': file_info.get('size', 0), 'type': file_info.get('type', '')}
+            for file_path in update.get('removed_files', []):
+                operations.append(('delete', repo_doc_ref.collection('files').document(self._file_doc_id(file_path)), None))
+                changes[firestore.FieldPath('file_index', file_path).to_api_repr()] = firestore.DELETE_FIELD
+            
+            # Re-index only the changed files, on a private copy: the cached index may be
+            # searched concurrently and must keep matching Firestore if the write fails
+            cached_index = self.get_retrieval_index(project_id, manifest)
+            index = (BM25Index.from_bytes(cached_index.to_bytes()) if cached_index else None) or BM25Index()
+            for file_path in update.get('removed_files', []):
+                index.remove_document(file_path)
+            for file_path, file_info in update.get('important_files', {}).items():
+                index.add_document(file_path, file_info.get('content', ''))
+            index_ops, index_shards = self._index_operations(repo_doc_ref, index, manifest.get('index_shards', 0))
+            operations.extend(index_ops)
+            changes['index_shards'] = index_shards
+            changes['index_version'] = uuid.uuid4().hex
+            
+            for key, value in update.get('fields', {}).items():
+                if key == 'file_structure':
+                    structure_ops, shard_count, value = self._structure_operations(
+                        repo_doc_ref, value, manifest.get('structure_shards', 0)
+                    )
+                    operations.extend(structure_ops)
+                    changes['structure_shards'] = shard_count
+                changes[firestore.FieldPath('content', key).to_api_repr()] = value
+            
+            self._commit_in_batches(operations)
+            repo_doc_ref.update(changes)
+            with self._index_cache_lock:
+                self._index_cache[str(project_id)] = (changes['index_version'], index)
+            
+            # Update project metadata timestamp
+            project_doc_ref = self.db.collection('projects').document(str(project_id))
+            project_doc_ref.update({
+                'last_repo_update': datetime.utcnow()
+            })
+            self.repository_cache.invalidate(project_id)
+            
+            logger.info(f"Patched repository content for project {project_id}: "
+                        f"{len(update.get('important_files', {}))} file(s) updated, "
+                        f"{len(update.get('removed_files', []))} removed")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to patch repository content for {project_id}: {e}")
+            return False
+
+    def get_project_context(self, project_id, issue_content, max_files=10, max_chunks=12,
+                            project_metadata=None, manifest=None):
         """
         Get relevant project context for an issue from stored repository content
         
         Args:
             project_id: GitLab project ID
-            issue_content: Issue title and description
+            issue_content: Issue title, description and comments, used as the retrieval query
             max_files: Maximum number of files to include in context
+            max_chunks: Maximum number of retrieved chunks to include
+            project_metadata: Project document already read for this event (optional, avoids a read)
+            manifest: Repository manifest already read for this event (optional, avoids a read)
             
         Returns:
-            Formatted context string for the LLM
+            Formatted context string for the LLM. Contexts are cached per
+            repository version and selected chunks, so any query that retrieves
+            the same chunks is served from memory.
         """
         try:
+            if project_metadata is None or manifest is None:
+                cached_documents = self.repository_cache.get_documents(project_id)
+                if cached_documents:
+                    project_metadata = project_metadata or cached_documents[0]
+                    manifest = manifest or cached_documents[1]
+            
             # Get project metadata
-            project_metadata = self.get_project_metadata(project_id)
+            project_metadata = project_metadata or self.get_project_metadata(project_id)
             if not project_metadata:
                 return "No project metadata found."
             
-            # Get repository content
-            repo_content = self.get_repository_content(project_id)
-            if not repo_content:
+            # Get the repository manifest; file bodies are loaded on demand below
+            manifest = manifest or self.get_repository_manifest(project_id)
+            if not manifest:
                 return "No repository content found."
+            repo_content = manifest.get('content', {})
+            
+            # Retrieval runs on the in-memory index; the rendered context depends only on what it selects
+            chunks = self._select_relevant_chunks(project_id, manifest, issue_content, max_files, max_chunks)
+            version = repository_version(manifest)
+            selection = json.dumps([[chunk['path'], chunk['start'], chunk['end']] for chunk in chunks])
+            cache_name = f"context:{hashlib.sha256(selection.encode('utf-8')).hexdigest()}"
+            cached_context = self.repository_cache.get(project_id, version, cache_name)
+            if cached_context is not None:
+                logger.info(f"Serving project context for {project_id} from memory. Cache stats: {self.repository_cache.stats()}")
+                return cached_context
             
             # Build context string
             context_parts = []
@@ -276,34 +885,72 @@ class FirestoreManager:
                 context_parts.append("\n=== README ===")
                 context_parts.append(readme_content[:1000] + ("..." if len(readme_content) > 1000 else ""))
             
-            # Add important files
-            important_files = repo_content.get('important_files', {})
-            if important_files:
-                context_parts.append("\n=== IMPORTANT FILES ===")
-                file_count = 0
-                for file_path, file_info in list(important_files.items())[:max_files]:
-                    if file_count >= max_files:
-                        break
-                    context_parts.append(f"\n--- {file_path} ---")
-                    file_content = file_info.get('content', '')
+            # Add the file chunks most relevant to the issue
+            if chunks:
+                selected_paths = list(dict.fromkeys(chunk['path'] for chunk in chunks))
+                important_files = self.get_repository_files(project_id, selected_paths, manifest)
+                context_parts.append("\n=== RELEVANT FILES ===")
+                for chunk in chunks:
+                    file_content = important_files.get(chunk['path'], {}).get('content', '')
+                    if not file_content:
+                        continue
+                    chunk_text = file_content[chunk['start']:chunk['end']]
                     # Limit content length
-                    if len(file_content) > 800:
-                        file_content = file_content[:800] + "... (truncated)"
-                    context_parts.append(file_content)
-                    file_count += 1
+                    if len(chunk_text) > MAX_CONTEXT_CHUNK_CHARS:
+                        chunk_text = chunk_text[:MAX_CONTEXT_CHUNK_CHARS] + "... (truncated)"
+                    first_line = file_content.count("\n", 0, chunk['start']) + 1
+                    last_line = first_line + chunk_text.rstrip("\n").count("\n")
+                    context_parts.append(f"\n--- {chunk['path']} (lines {first_line}-{last_line}) ---")
+                    context_parts.append(chunk_text)
             
             # Add file structure overview
             file_structure = repo_content.get('file_structure', {})
             if file_structure:
                 context_parts.append("\n=== PROJECT STRUCTURE ===")
-                context_parts.append(f"Total files: {len(file_structure.get('files', []))}")
-                context_parts.append(f"Directories: {len(file_structure.get('directories', []))}")
+                context_parts.append(f"Total files: {file_structure.get('file_count', len(file_structure.get('files', [])))}")
+                context_parts.append(f"Directories: {file_structure.get('directory_count', len(file_structure.get('directories', [])))}")
                 file_types = file_structure.get('file_types', {})
                 if file_types:
                     context_parts.append("File types: " + ", ".join([f"{ext}: {count}" for ext, count in list(file_types.items())[:5]]))
             
-            return "\n".join(context_parts)
+            context = "\n".join(context_parts)
+            self.repository_cache.set(project_id, version, cache_name, context)
+            logger.info(f"Built project context for {project_id}. Cache stats: {self.repository_cache.stats()}")
+            return context
             
         except Exception as e:
             logger.error(f"Failed to get project context for {project_id}: {e}")
             return "Error retrieving project context."
+
+    def _select_relevant_chunks(self, project_id, manifest, query, max_files, max_chunks):
+        """
+        Pick the chunks to show the LLM, ranked by BM25 relevance to the query
+        
+        Returns:
+            List of chunk dictionaries (path, start, end) in display order.
+            Without an index or any match, the first max_files files are used
+            (first chunk of each).
+        """
+        index = self.get_retrieval_index(project_id, manifest)
+        results = index.search(query or "", top_k=max_chunks * 3) if index else []
+        
+        selected = []
+        files = set()
+        for result in results:
+            if result['path'] not in files and len(files) >= max_files:
+                continue
+            files.add(result['path'])
+            selected.append(result)
+            if len(selected) >= max_chunks:
+                break
+        
+        if not selected:
+            selected = [
+                {'path': path, 'start': 0, 'end': None}
+                for path in list(manifest.get('file_index', {}))[:max_files]
+            ]
+        
+        # Show chunks grouped by file, in file order
+        order = {path: position for position, path in enumerate(dict.fromkeys(chunk['path'] for chunk in selected))}
+        return sorted(selected, key=lambda chunk: (order[chunk['path']], chunk['start']))
+
@@ -1,8 +1,14 @@
 # This module will handle interactions with the GitLab API.
 
 import gitlab
+import hashlib
 import os
 import logging # Import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from src.api_call_tracker import record_api_call
 
 # Configure basic logging for the module
 # This will inherit the root logger's configuration if set by the main script,
@@ -13,8 +19,121 @@ logger = logging.getLogger(__name__)
 # Making it more explicit for AI processing in conversation history and for UI visibility.
 BOT_SIGNATURE = "**Sended By AI Rubber Duck:**\n"
 
+# Cached clients are re-verified with gl.auth() after this many seconds
+GITLAB_CLIENT_REVALIDATE_SECONDS = int(os.getenv('GITLAB_CLIENT_REVALIDATE_SECONDS', '900'))
+# Keep-alive connections kept per host by the shared HTTP session
+GITLAB_HTTP_POOL_SIZE = int(os.getenv('GITLAB_HTTP_POOL_SIZE', '16'))
+# Fetched project objects are reused for this many seconds
+GITLAB_METADATA_CACHE_TTL = float(os.getenv('GITLAB_METADATA_CACHE_TTL', '30'))
+# Page size used when fetching only the newest notes of an issue
+NOTES_PAGE_SIZE = 20
+# Minimum seconds between edits of a progressively updated comment
+COMMENT_UPDATE_INTERVAL = float(os.getenv('AI_STREAMING_UPDATE_INTERVAL', '2'))
+
+def _count_response(response, *args, **kwargs):
+    """requests response hook feeding the per-event API call counter"""
+    record_api_call(response.request.method)
+
+class GitLabClientPool:
+    """
+    Thread-safe pool of authenticated GitLab clients keyed by (gitlab_url, token hash).
+    All clients share one requests.Session, so TLS connections are kept alive
+    and reused across webhook events. Authentication headers are per client,
+    which makes sharing the session between tokens safe.
+    """
+
+    def __init__(self, revalidate_interval=GITLAB_CLIENT_REVALIDATE_SECONDS, pool_size=GITLAB_HTTP_POOL_SIZE):
+        self.revalidate_interval = revalidate_interval
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.hooks['response'].append(_count_response)
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key(self, gitlab_url, private_token):
+        return (gitlab_url.rstrip("/"), hashlib.sha256(private_token.encode("utf-8")).hexdigest())
+
+    def get(self, gitlab_url, private_token):
+        """
+        Return an authenticated client, creating or revalidating it when needed
+
+        Args:
+            gitlab_url: GitLab instance URL
+            private_token: API token
+
+        Returns:
+            gitlab.Gitlab instance
+        """
+        key = self._key(gitlab_url, private_token)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One thread builds or revalidates a given client; others wait and reuse it
+        with key_lock:
+            entry = self._clients.get(key)
+            if entry and time.monotonic() - entry['validated_at'] < self.revalidate_interval:
+                return entry['gl']
+
+            gl = entry['gl'] if entry else gitlab.Gitlab(
+                gitlab_url, private_token=private_token, timeout=10, session=self.session
+            )
+            try:
+                _authenticate(gl, gitlab_url)
+            except Exception:
+                self._clients.pop(key, None)
+                raise
+            self._clients[key] = {'gl': gl, 'validated_at': time.monotonic()}
+            return gl
+
+    def invalidate(self, gitlab_url, private_token):
+        """
+        Drop a cached client, e.g. after a 401 from GitLab, so the next call re-authenticates
+
+        Args:
+            gitlab_url: GitLab instance URL
+            private_token: API token
+        """
+        key = self._key(gitlab_url, private_token)
+        with self._lock:
+            self._clients.pop(key, None)
+        logger.info(f"Invalidated cached GitLab client for {gitlab_url}")
+
+_client_pool = GitLabClientPool()
+
+def invalidate_gitlab_instance(gitlab_url, private_token):
+    """Forget the pooled client for this URL and token so it is re-authenticated on next use."""
+    if gitlab_url and private_token:
+        _client_pool.invalidate(gitlab_url, private_token)
+
+_project_cache = {}
+_project_cache_lock = threading.Lock()
+
+def get_project(gl, project_id):
+    """
+    Returns a fully fetched project object, reusing one fetched by the same
+    client within the last GITLAB_METADATA_CACHE_TTL seconds.
+    Use gl.projects.get(project_id, lazy=True) instead when only sub-resources are needed.
+    """
+    key = (id(gl), str(project_id))
+    now = time.monotonic()
+    with _project_cache_lock:
+        entry = _project_cache.get(key)
+        if entry and now - entry[0] < GITLAB_METADATA_CACHE_TTL:
+            return entry[1]
+    
+    project = gl.projects.get(project_id)
+    with _project_cache_lock:
+        _project_cache[key] = (now, project)
+        # Drop expired entries so the cache stays small
+        for stale_key in [k for k, (stored_at, _) in _project_cache.items() if now - stored_at >= GITLAB_METADATA_CACHE_TTL]:
+            del _project_cache[stale_key]
+    return project
+
 def get_gitlab_instance(gitlab_url, private_token):
-    """Creates and returns a GitLab API instance based on provided URL and token."""
+    """Returns a pooled, authenticated GitLab API instance for the provided URL and token."""
     if not private_token:
         logger.error("GitLab private token not provided to get_gitlab_instance.")
         raise ValueError("GitLab private token is required.")
@@ -22,10 +141,14 @@ def get_gitlab_instance(gitlab_url, private_token):
         logger.error("GitLab URL not provided to get_gitlab_instance.")
         raise ValueError("GitLab URL is required.")
     
-    logger.debug(f"Attempting to connect to GitLab instance at {gitlab_url}")
-    # Use the provided gitlab_url and private_token
-    gl = gitlab.Gitlab(gitlab_url, private_token=private_token, timeout=10)
+    started = time.perf_counter()
+    gl = _client_pool.get(gitlab_url, private_token)
+    logger.info(f"GitLab client for {gitlab_url} ready in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return gl
 
+def _authenticate(gl, gitlab_url):
+    """Verifies the token of a GitLab instance with gl.auth()."""
+    logger.debug(f"Attempting to connect to GitLab instance at {gitlab_url}")
     try:
         gl.auth()  # Verify authentication
         logger.info(f"Successfully authenticated to GitLab instance at {gitlab_url} as {gl.user.username}")
@@ -40,30 +163,84 @@ def get_gitlab_instance(gitlab_url, private_token):
         logger.error(f"An unexpected error occurred during GitLab authentication: {e}")
         raise
 
-def get_issue_details(gl, project_id, issue_iid):
-    """Fetches an issue and its comments using a pre-initialized GitLab instance."""
+def normalize_note(note):
+    """Converts a python-gitlab note object into the comment dict used throughout the app."""
+    return {
+        'id': note.id,
+        'body': note.body,
+        'author': note.author['username'],
+        'created_at': note.created_at,
+        'system': note.system
+    }
+
+def _fetch_new_comments(issue, cached_conversation):
+    """
+    Fetches notes newer than the cached conversation, newest first, stopping at the
+    last cached note. If that note is missing (a gap: deleted notes or a stale cache)
+    every note is fetched and the cache is replaced.
+    Returns (comments, resynced).
+    """
+    last_note_id = cached_conversation.get('last_note_id') or 0
+    fresh = []
+    resync = False
+    anchor_found = False
+    for note in issue.notes.list(sort='desc', order_by='created_at', per_page=NOTES_PAGE_SIZE, iterator=True):
+        if not resync and note.id == last_note_id:
+            anchor_found = True
+            break
+        if not resync and note.id < last_note_id:
+            logger.info(f"Cached note {last_note_id} not found; resyncing all notes for issue {issue.iid}")
+            resync = True
+        fresh.append(normalize_note(note))
+    
+    if last_note_id and not anchor_found:
+        resync = True
+    if resync:
+        return fresh, True
+    return fresh + cached_conversation.get('comments', []), False
+
+def merge_webhook_notes(comments, webhook_notes):
+    """
+    Upserts notes taken from webhook payloads (new notes or edits) into the comment list, newest first.
+    Labels derived from a note's body ('intent') are dropped when an edit changes the body.
+    """
+    by_id = {comment['id']: comment for comment in comments}
+    for note in webhook_notes or []:
+        existing = by_id.get(note['id'], {})
+        merged = dict(existing, **note)
+        if existing.get('body') != note.get('body'):
+            merged.pop('intent', None)
+        by_id[note['id']] = merged
+    return sorted(by_id.values(), key=lambda comment: comment['id'], reverse=True)
+
+def get_issue_details(gl, project_id, issue_iid, cached_conversation=None, webhook_notes=None):
+    """
+    Fetches an issue and its comments using a pre-initialized GitLab instance.
+    With cached_conversation (as returned by a previous call), only notes newer than
+    the cached ones are fetched. webhook_notes are normalized notes from webhook
+    payloads merged into the result. Comments are returned newest first, and
+    'last_note_id' holds the highest note id for the next incremental fetch.
+    """
     if not gl:
         logger.error("GitLab instance (gl) not provided to get_issue_details.")
         raise ValueError("GitLab instance (gl) is required.")
 
     logger.info(f"Fetching details for issue IID {issue_iid} in project ID {project_id}")
     try:
-        # gl is already initialized and passed as an argument
-        project = gl.projects.get(project_id)
-        logger.debug(f"Successfully fetched project: {project.name_with_namespace}")
+        # The project is only a path prefix here, so it is not fetched
+        project = gl.projects.get(project_id, lazy=True)
         issue = project.issues.get(issue_iid)
         logger.debug(f"Successfully fetched issue: {issue.title}")
         
-        comments = []
-        # Iterate using iterator=True for potentially large number of notes to handle pagination
-        for note in issue.notes.list(all=True, iterator=True):
-            comments.append({
-                'id': note.id,
-                'body': note.body,
-                'author': note.author['username'],
-                'created_at': note.created_at,
-                'system': note.system
-            })
+        if cached_conversation:
+            comments, resynced = _fetch_new_comments(issue, cached_conversation)
+            logger.info(f"Fetched comments for issue {issue_iid} incrementally ({'full resync' if resynced else 'cache hit'}).")
+        else:
+            comments = []
+            # Iterate using iterator=True for potentially large number of notes to handle pagination
+            for note in issue.notes.list(all=True, iterator=True):
+                comments.append(normalize_note(note))
+        comments = merge_webhook_notes(comments, webhook_notes)
         logger.info(f"Fetched {len(comments)} comments for issue {issue_iid}.")
             
         return {
@@ -71,7 +248,8 @@ def get_issue_details(gl, project_id, issue_iid):
             'description': issue.description,
             'author': issue.author['username'],
             'created_at': issue.created_at,
-            'comments': comments
+            'comments': comments,
+            'last_note_id': max((comment['id'] for comment in comments), default=0)
         }
     except gitlab.exceptions.GitlabGetError as e:
         logger.error(f"Failed to get GitLab resource (project/issue/notes): {e.status_code} - {e.error_message}")
@@ -95,9 +273,9 @@ def post_comment_to_issue(gl, project_id, issue_iid, comment_body):
 
     logger.info(f"Attempting to post comment to issue IID {issue_iid} in project ID {project_id}")
     try:
-        # gl is already initialized and passed as an argument
-        project = gl.projects.get(project_id)
-        issue = project.issues.get(issue_iid)
+        # Creating a note only needs the IDs, so neither project nor issue is fetched
+        project = gl.projects.get(project_id, lazy=True)
+        issue = project.issues.get(issue_iid, lazy=True)
         
         # Prepend signature to the comment body
         full_comment = f"{BOT_SIGNATURE}\n{comment_body}"
@@ -120,6 +298,75 @@ def post_comment_to_issue(gl, project_id, issue_iid, comment_body):
         logger.error(f"An unexpected error occurred while posting comment: {e}")
         raise
 
+def update_issue_comment(gl, project_id, issue_iid, note_id, comment_body):
+    """Replaces the body of a bot comment (the signature is prepended) with a single PUT."""
+    project = gl.projects.get(project_id, lazy=True)
+    issue = project.issues.get(issue_iid, lazy=True)
+    return issue.notes.update(note_id, {'body': f"{BOT_SIGNATURE}\n{comment_body}"})
+
+def delete_issue_comment(gl, project_id, issue_iid, note_id):
+    """Deletes a comment from a GitLab issue."""
+    project = gl.projects.get(project_id, lazy=True)
+    issue = project.issues.get(issue_iid, lazy=True)
+    issue.notes.delete(note_id)
+
+class ProgressiveComment:
+    """
+    A bot comment that is posted as a placeholder and then edited in place while
+    the response is generated. Intermediate edits are throttled; the final edit
+    is always sent.
+    """
+
+    def __init__(self, gl, project_id, issue_iid, min_interval=COMMENT_UPDATE_INTERVAL, clock=time.monotonic):
+        self.gl = gl
+        self.project_id = project_id
+        self.issue_iid = issue_iid
+        self.min_interval = min_interval
+        self.clock = clock
+        self.note = None
+        self.updates = 0
+        self._last_update = None
+        self._last_body = None
+
+    def start(self, placeholder):
+        """Posts the placeholder comment and returns the created note."""
+        self.note = post_comment_to_issue(self.gl, self.project_id, self.issue_iid, placeholder)
+        self._last_update = self.clock()
+        self._last_body = placeholder
+        return self.note
+
+    def update(self, comment_body):
+        """Edits the comment unless the previous edit was less than min_interval ago. Errors are logged, not raised."""
+        if self.note is None or comment_body == self._last_body:
+            return False
+        if self.clock() - self._last_update < self.min_interval:
+            return False
+        try:
+            self._edit(comment_body)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to update streaming comment {self.note.id} on issue {self.issue_iid}: {e}")
+            return False
+
+    def finish(self, comment_body):
+        """Writes the final body and returns the note (with its body updated)."""
+        if comment_body != self._last_body:
+            self._edit(comment_body)
+        self.note.body = f"{BOT_SIGNATURE}\n{comment_body}"
+        return self.note
+
+    def discard(self):
+        """Deletes the placeholder comment, e.g. when no response was generated."""
+        if self.note is not None:
+            delete_issue_comment(self.gl, self.project_id, self.issue_iid, self.note.id)
+            self.note = None
+
+    def _edit(self, comment_body):
+        update_issue_comment(self.gl, self.project_id, self.issue_iid, self.note.id, comment_body)
+        self._last_update = self.clock()
+        self._last_body = comment_body
+        self.updates += 1
+
 # Example Usage (for testing purposes - remove or comment out for production):
 if __name__ == '__main__':
     # Basic logging config for direct script execution
@@ -3,48 +3,121 @@ GitLab repository handler for fetching repository content and handling repositor
 """
 import logging
 import base64
+import io
 import os
-from typing import Dict, List, Optional
-import gitlab
+import tarfile
+from typing import Dict, Iterator, List, Optional, Tuple
+from src.fetch_engine import FileFetchEngine, FETCH_RATE_LIMIT, get_host_rate_limiter
+from src.gitlab_integration import get_project
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How repository content is ingested: "api" (tree + Files API per file) or
+# "archive" (a single streamed tar.gz snapshot of the branch)
+REPO_INGESTION_MODE = os.getenv('REPO_INGESTION_MODE', 'api')
+
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+# Incremental refresh falls back to a full crawl above this many changed paths
+INCREMENTAL_REFRESH_MAX_CHANGES = int(os.getenv('INCREMENTAL_REFRESH_MAX_CHANGES', '500'))
+
+# Define important file patterns
+IMPORTANT_PATTERNS = [
+    # Configuration files
+    "requirements.txt", "package.json", "Dockerfile", "docker-compose.yml",
+    "Makefile", "CMakeLists.txt", "pom.xml", "build.gradle",
+    # Source code files (limit to avoid too much content)
+    "main.py", "app.py", "index.js", "main.js", "App.js",
+    "main.java", "main.cpp", "main.c", "main.go",
+    # Documentation
+    "CONTRIBUTING.md", "CHANGELOG.md", "LICENSE",
+    # CI/CD
+    ".gitlab-ci.yml", ".github/workflows/", "Jenkinsfile"
+]
+
+SOURCE_EXTENSIONS = [".py", ".js", ".java", ".cpp", ".c", ".go", ".rs", ".php"]
+
+README_FILES = ["README.md", "README.rst", "README.txt", "README", "readme.md"]
+
+PACKAGE_FILE_NAMES = [
+    "requirements.txt", "package.json", "Pipfile", "poetry.lock",
+    "composer.json", "pom.xml", "build.gradle", "Cargo.toml"
+]
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks (e.g. a streamed HTTP body)"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
 class GitLabRepoHandler:
-    def __init__(self, gitlab_instance):
+    def __init__(self, gitlab_instance, max_workers: int = None, rate_limit: float = None):
         """
         Initialize GitLab repository handler
         
         Args:
             gitlab_instance: Initialized GitLab instance from python-gitlab
+            max_workers: Maximum number of parallel file downloads
+            rate_limit: Maximum requests per second to the GitLab host (0 = unlimited)
         """
         self.gl = gitlab_instance
+        rate_limit = FETCH_RATE_LIMIT if rate_limit is None else rate_limit
+        rate_limiter = None
+        if gitlab_instance is not None and rate_limit > 0:
+            rate_limiter = get_host_rate_limiter(getattr(gitlab_instance, 'url', ''), rate_limit)
+        self.fetch_engine = FileFetchEngine(max_workers=max_workers, rate_limiter=rate_limiter)
 
-    def get_repository_content(self, project_id: int, branch: str = None) -> Dict:
+    def get_repository_content(self, project_id: int, branch: str = None, mode: str = None) -> Dict:
         """
         Fetch repository content including files, structure, and metadata
         
         Args:
             project_id: GitLab project ID
             branch: Branch to fetch from (default: project's default branch)
+            mode: Ingestion mode, "api" or "archive" (default: REPO_INGESTION_MODE)
             
         Returns:
             Dictionary containing repository content and metadata
         """
         try:
-            project = self.gl.projects.get(project_id)
+            project = get_project(self.gl, project_id)
             
             if not branch:
                 branch = project.default_branch
+            mode = mode or REPO_INGESTION_MODE
+            
+            logger.info(f"Fetching repository content for project {project_id}, branch {branch} (mode: {mode})")
             
-            logger.info(f"Fetching repository content for project {project_id}, branch {branch}")
+            tree, prefetched = None, None
+            if mode == "archive":
+                try:
+                    tree, prefetched = self._read_archive_snapshot(project, branch)
+                except Exception as e:
+                    logger.warning(f"Archive ingestion failed for project {project_id}, falling back to API mode: {e}")
             
-            # Get repository tree
-            tree = project.repository_tree(recursive=True, ref=branch, all=True)
+            if tree is None:
+                tree, prefetched = self._read_api_snapshot(project, branch)
             
             # Get important files content
-            important_files = self._get_important_files_content(project, tree, branch)
+            important_files = self._get_important_files_content(project, tree, branch, prefetched)
             
             # Get project metadata
             project_metadata = self._extract_project_metadata(project)
@@ -54,8 +127,8 @@ class GitLabRepoHandler:
                 "project_metadata": project_metadata,
                 "file_structure": self._build_file_structure(tree),
                 "important_files": important_files,
-                "readme_content": self._get_readme_content(project, branch),
-                "package_files": self._get_package_files_content(project, branch),
+                "readme_content": self._get_readme_content(project, branch, prefetched),
+                "package_files": self._get_package_files_content(project, branch, prefetched),
                 "total_files": len(tree),
                 "branch": branch,
                 "last_commit": self._get_last_commit_info(project, branch)
@@ -68,6 +141,262 @@ class GitLabRepoHandler:
             logger.error(f"Failed to fetch repository content for project {project_id}: {e}")
             return {}
 
+    def get_repository_overview(self, project_id: int, branch: str = None, max_entries: int = 100) -> Dict:
+        """
+        Fetch a cheap overview of a repository (top-level entries and README)
+        for use before the full crawl has finished
+        
+        Args:
+            project_id: GitLab project ID
+            branch: Branch to read (default: project's default branch)
+            max_entries: Maximum number of top-level entries to list
+            
+        Returns:
+            Dictionary with "branch", "top_level" (tree items) and
+            "readme_content", or an empty dictionary on failure
+        """
+        try:
+            # With a known branch only sub-resources are read, so the project itself is not fetched
+            project = self.gl.projects.get(project_id, lazy=True) if branch else get_project(self.gl, project_id)
+            branch = branch or project.default_branch
+            
+            top_level = project.repository_tree(ref=branch, per_page=max_entries)
+            blob_names = {item["name"] for item in top_level if item["type"] == "blob"}
+            readme_names = [name for name in README_FILES if name in blob_names]
+            readme_content = self._get_readme_content(project, branch, self._fetch_files(project, readme_names[:1], branch))
+            
+            logger.info(f"Fetched repository overview for project {project_id} ({len(top_level)} top-level entries)")
+            return {
+                "branch": branch,
+                "top_level": top_level,
+                "readme_content": readme_content
+            }
+        except Exception as e:
+            logger.error(f"Failed to fetch repository overview for project {project_id}: {e}")
+            return {}
+
+    def get_incremental_update(self, project_id: int, previous_content: Dict, branch: str = None) -> Optional[Dict]:
+        """
+        Compute an incremental update of stored repository content from the
+        diff between the stored last commit and the current branch head
+        
+        Args:
+            project_id: GitLab project ID
+            previous_content: Repository content as previously stored
+            branch: Branch to compare against (default: stored branch)
+            
+        Returns:
+            Dictionary with "important_files" (added/modified entries),
+            "removed_files" (paths to drop) and "fields" (top-level values to
+            replace), or None if an incremental update is not possible and a
+            full crawl is needed
+        """
+        base_sha = (previous_content or {}).get("last_commit", {}).get("id")
+        if not base_sha:
+            logger.info(f"No stored last commit for project {project_id}; incremental refresh not possible")
+            return None
+        
+        try:
+            project = get_project(self.gl, project_id)
+            branch = branch or previous_content.get("branch") or project.default_branch
+            
+            last_commit = self._get_last_commit_info(project, branch)
+            if not last_commit.get("id"):
+                return None
+            if last_commit["id"] == base_sha:
+                logger.info(f"Repository content for project {project_id} is already at {base_sha[:8]}")
+                return {"important_files": {}, "removed_files": [], "fields": {}}
+            
+            # Straight diff from the stored commit: after a force-push it may not be an
+            # ancestor of the branch, and a merge-base diff would miss changes since it
+            comparison = project.repository_compare(base_sha, branch, straight=True)
+            diffs = comparison.get("diffs", [])
+            if comparison.get("compare_timeout") or len(diffs) > INCREMENTAL_REFRESH_MAX_CHANGES:
+                logger.info(f"Diff {base_sha[:8]}..{branch} for project {project_id} is too large ({len(diffs)} changes); doing a full crawl")
+                return None
+            
+            logger.info(f"Applying {len(diffs)} changed path(s) {base_sha[:8]}..{last_commit['id'][:8]} to project {project_id}")
+            return self._build_incremental_update(project, previous_content, diffs, branch, last_commit)
+            
+        except Exception as e:
+            logger.warning(f"Incremental refresh failed for project {project_id}: {e}")
+            return None
+
+    def _build_incremental_update(self, project, previous_content: Dict, diffs: List, branch: str, last_commit: Dict) -> Dict:
+        """
+        Turn a list of GitLab compare diffs into an incremental content update
+        
+        Args:
+            project: GitLab project object
+            previous_content: Repository content as previously stored
+            diffs: "diffs" list from the repository compare API
+            branch: Branch name
+            last_commit: Last commit info of the new head
+            
+        Returns:
+            Update dictionary (see get_incremental_update)
+        """
+        removed_paths = set()
+        changed_paths = []
+        for diff in diffs:
+            if diff.get("deleted_file") or diff.get("renamed_file"):
+                removed_paths.add(diff["old_path"])
+            if not diff.get("deleted_file"):
+                changed_paths.append(diff["new_path"])
+                removed_paths.discard(diff["new_path"])
+        
+        # Update the file list, then derive directories and counts from it
+        previous_structure = previous_content.get("file_structure", {})
+        files = {
+            entry["path"]: entry for entry in previous_structure.get("files", [])
+            if entry["path"] not in removed_paths
+        }
+        for path in changed_paths:
+            if path not in files:
+                files[path] = {"path": path, "name": path.rsplit("/", 1)[-1], "size": 0}
+        
+        # Re-fetch only the changed files that matter for context
+        important_changed = [
+            path for path in changed_paths
+            if self._is_important_file(path, path.rsplit("/", 1)[-1])
+        ]
+        extra_changed = [path for path in changed_paths if path in README_FILES + PACKAGE_FILE_NAMES]
+        fetched = self._fetch_files(project, important_changed + extra_changed, branch)
+        # Sizes of fetched files are taken from their new content
+        for path, content in fetched.items():
+            if path in files:
+                files[path] = dict(files[path], size=len(content.encode("utf-8")))
+        
+        directories = set()
+        for path in files:
+            parts = path.split("/")[:-1]
+            for depth in range(1, len(parts) + 1):
+                directories.add("/".join(parts[:depth]))
+        tree = [{"path": d, "name": d.rsplit("/", 1)[-1], "type": "tree"} for d in sorted(directories)]
+        tree += [dict(entry, type="blob") for entry in files.values()]
+        
+        previous_important = previous_content.get("important_files", {})
+        important_files = {}
+        for path in important_changed:
+            if path in fetched:
+                important_files[path] = {
+                    "content": fetched[path],
+                    "size": files[path]["size"],
+                    "type": os.path.splitext(path)[1].lower()
+                }
+        removed_files = [
+            path for path in set(removed_paths) | (set(important_changed) - set(important_files))
+            if path in previous_important
+        ]
+        
+        fields = {
+            "file_structure": self._build_file_structure(tree),
+            "total_files": len(tree),
+            "branch": branch,
+            "last_commit": last_commit
+        }
+        
+        if any(path in README_FILES for path in extra_changed + list(removed_paths)):
+            readme_available = {name: fetched[name] for name in README_FILES if name in fetched}
+            missing = [name for name in README_FILES if name in files and name not in readme_available]
+            readme_available.update(self._fetch_files(project, missing, branch))
+            fields["readme_content"] = self._get_readme_content(project, branch, readme_available)
+        
+        if any(path in PACKAGE_FILE_NAMES for path in extra_changed + list(removed_paths)):
+            package_files = {
+                name: content for name, content in previous_content.get("package_files", {}).items()
+                if name not in removed_paths
+            }
+            package_files.update({name: fetched[name] for name in PACKAGE_FILE_NAMES if name in fetched})
+            fields["package_files"] = package_files
+        
+        return {
+            "important_files": important_files,
+            "removed_files": sorted(removed_files),
+            "fields": fields
+        }
+
+    def _read_api_snapshot(self, project, branch: str) -> Tuple[List, Dict]:
+        """
+        Read the repository tree and wanted file contents through the REST API
+        
+        Args:
+            project: GitLab project object
+            branch: Branch name
+            
+        Returns:
+            Tuple of (tree items, file contents keyed by path)
+        """
+        # Get repository tree
+        tree = project.repository_tree(recursive=True, ref=branch, all=True)
+        
+        # Download important, README and package files in one parallel batch,
+        # only probing paths that actually exist in the tree
+        blob_paths = {item["path"] for item in tree if item["type"] == "blob"}
+        wanted_paths = [item["path"] for item in self._select_important_files(tree)]
+        wanted_paths += [name for name in README_FILES + PACKAGE_FILE_NAMES if name in blob_paths]
+        return tree, self._fetch_files(project, wanted_paths, branch)
+
+    def _read_archive_snapshot(self, project, branch: str) -> Tuple[List, Dict]:
+        """
+        Read the repository tree and wanted file contents from a single
+        streamed tar.gz archive, without extracting anything to disk
+        
+        Args:
+            project: GitLab project object
+            branch: Branch name
+            
+        Returns:
+            Tuple of (tree items in repository_tree format, file contents keyed by path)
+        """
+        chunks = project.repository_archive(
+            sha=branch, format="tar.gz", streamed=True, iterator=True, chunk_size=ARCHIVE_CHUNK_SIZE
+        )
+        return self._read_archive_stream(_ChunkStream(chunks))
+
+    def _read_archive_stream(self, fileobj) -> Tuple[List, Dict]:
+        """
+        Walk a tar.gz stream once, building the tree and collecting wanted files
+        
+        Args:
+            fileobj: Readable binary file object with the archive bytes
+            
+        Returns:
+            Tuple of (tree items, file contents keyed by path)
+        """
+        tree = []
+        contents = {}
+        extra_names = set(README_FILES + PACKAGE_FILE_NAMES)
+        
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as archive:
+            for member in archive:
+                # GitLab archives wrap everything in a "<project>-<ref>-<sha>/" directory
+                parts = member.name.strip("/").split("/", 1)
+                if len(parts) < 2 or not parts[1]:
+                    continue
+                path = parts[1]
+                name = path.rsplit("/", 1)[-1]
+                
+                if member.isdir():
+                    tree.append({"path": path, "name": name, "type": "tree"})
+                    continue
+                
+                tree.append({"path": path, "name": name, "type": "blob", "size": member.size})
+                if not member.isfile():
+                    continue
+                if path not in extra_names and not self._is_important_file(path, name):
+                    continue
+                
+                try:
+                    content = self._decode_file_content(archive.extractfile(member).read())
+                    if content:
+                        contents[path] = content
+                except Exception as e:
+                    logger.warning(f"Failed to read {path} from archive: {e}")
+        
+        logger.info(f"Read {len(tree)} tree entries and {len(contents)} files from repository archive")
+        return tree, contents
+
     def _extract_project_metadata(self, project) -> Dict:
         """
         Extract relevant project metadata
@@ -135,7 +464,64 @@ class GitLabRepoHandler:
         
         return structure
 
-    def _get_important_files_content(self, project, tree: List, branch: str) -> Dict:
+    def _is_important_file(self, file_path: str, file_name: str) -> bool:
+        """
+        Check whether a file should be included in the repository context
+        
+        Args:
+            file_path: Path of the file in the repository
+            file_name: Base name of the file
+            
+        Returns:
+            Boolean indicating if the file is important
+        """
+        # Check if it's an important file
+        if any(pattern in file_path.lower() or pattern == file_name.lower() for pattern in IMPORTANT_PATTERNS):
+            return True
+        
+        # Also include Python, JavaScript, Java files from main directories
+        if len(file_path.split("/")) <= 3:
+            file_ext = os.path.splitext(file_name)[1].lower()
+            if file_ext in SOURCE_EXTENSIONS:
+                return True
+        
+        return False
+
+    def _select_important_files(self, tree: List) -> List:
+        """
+        Select the tree entries of important files
+        
+        Args:
+            tree: Repository tree
+            
+        Returns:
+            List of tree items (blobs) that should be fetched
+        """
+        return [
+            item for item in tree
+            if item["type"] == "blob" and self._is_important_file(item["path"], item["name"])
+        ]
+
+    def _fetch_files(self, project, paths: List[str], branch: str) -> Dict:
+        """
+        Download several files concurrently
+        
+        Args:
+            project: GitLab project object
+            paths: File paths to download
+            branch: Branch name
+            
+        Returns:
+            Dictionary mapping each successfully fetched path to its content
+        """
+        results, errors = self.fetch_engine.fetch_all(
+            paths, lambda path: self._download_file(project, path, branch)
+        )
+        for file_path, error in errors.items():
+            logger.warning(f"Failed to get file content for {file_path}: {error}")
+        return {path: content for path, content in results.items() if content}
+
+    def _get_important_files_content(self, project, tree: List, branch: str, prefetched: Optional[Dict] = None) -> Dict:
         """
         Get content of important files (code files, configs, etc.)
         
@@ -143,60 +529,49 @@ class GitLabRepoHandler:
             project: GitLab project object
             tree: Repository tree
             branch: Branch name
+            prefetched: Already downloaded file contents keyed by path (optional)
             
         Returns:
             Dictionary with important files content
         """
         important_files = {}
+        selected = self._select_important_files(tree)
         
-        # Define important file patterns
-        important_patterns = [
-            # Configuration files
-            "requirements.txt", "package.json", "Dockerfile", "docker-compose.yml",
-            "Makefile", "CMakeLists.txt", "pom.xml", "build.gradle",
-            # Source code files (limit to avoid too much content)
-            "main.py", "app.py", "index.js", "main.js", "App.js",
-            "main.java", "main.cpp", "main.c", "main.go",
-            # Documentation
-            "CONTRIBUTING.md", "CHANGELOG.md", "LICENSE",
-            # CI/CD
-            ".gitlab-ci.yml", ".github/workflows/", "Jenkinsfile"
-        ]
+        if prefetched is None:
+            prefetched = self._fetch_files(project, [item["path"] for item in selected], branch)
         
-        for item in tree:
-            if item["type"] == "blob":  # It's a file
-                file_path = item["path"]
-                file_name = item["name"]
-                
-                # Check if it's an important file
-                should_include = any(
-                    pattern in file_path.lower() or pattern == file_name.lower()
-                    for pattern in important_patterns
-                )
-                
-                # Also include Python, JavaScript, Java files from main directories
-                if not should_include and len(file_path.split("/")) <= 3:
-                    file_ext = os.path.splitext(file_name)[1].lower()
-                    if file_ext in [".py", ".js", ".java", ".cpp", ".c", ".go", ".rs", ".php"]:
-                        should_include = True
-                
-                if should_include:
-                    try:
-                        file_content = self._get_file_content(project, file_path, branch)
-                        if file_content:
-                            important_files[file_path] = {
-                                "content": file_content,
-                                "size": item.get("size", 0),
-                                "type": os.path.splitext(file_name)[1].lower()
-                            }
-                    except Exception as e:
-                        logger.warning(f"Failed to get content for {file_path}: {e}")
+        for item in selected:
+            file_content = prefetched.get(item["path"])
+            if file_content:
+                important_files[item["path"]] = {
+                    "content": file_content,
+                    "size": item.get("size", 0),
+                    "type": os.path.splitext(item["name"])[1].lower()
+                }
         
         return important_files
 
-    def _get_file_content(self, project, file_path: str, branch: str) -> Optional[str]:
+    def _decode_file_content(self, raw: bytes) -> str:
         """
-        Get content of a specific file
+        Decode raw file bytes and apply the context size limit
+        
+        Args:
+            raw: File content bytes
+            
+        Returns:
+            File content as string
+        """
+        content = raw.decode('utf-8')
+        
+        # Limit content size to avoid too large payloads
+        if len(content) > 10000:  # 10KB limit
+            content = content[:10000] + "\n... (content truncated)"
+        
+        return content
+
+    def _download_file(self, project, file_path: str, branch: str) -> str:
+        """
+        Download a single file, raising on failure
         
         Args:
             project: GitLab project object
@@ -204,66 +579,55 @@ class GitLabRepoHandler:
             branch: Branch name
             
         Returns:
-            File content as string or None if failed
+            File content as string
         """
-        try:
-            file_info = project.files.get(file_path=file_path, ref=branch)
-            content = base64.b64decode(file_info.content).decode('utf-8')
-            
-            # Limit content size to avoid too large payloads
-            if len(content) > 10000:  # 10KB limit
-                content = content[:10000] + "\n... (content truncated)"
-            
-            return content
-            
-        except Exception as e:
-            logger.warning(f"Failed to get file content for {file_path}: {e}")
-            return None
+        file_info = project.files.get(file_path=file_path, ref=branch)
+        return self._decode_file_content(base64.b64decode(file_info.content))
 
-    def _get_readme_content(self, project, branch: str) -> str:
+    def _get_readme_content(self, project, branch: str, prefetched: Optional[Dict] = None) -> str:
         """
         Get README file content
         
         Args:
             project: GitLab project object
             branch: Branch name
+            prefetched: Already downloaded file contents keyed by path (optional).
+                        When given, only those contents are considered.
             
         Returns:
             README content or empty string
         """
-        readme_files = ["README.md", "README.rst", "README.txt", "README", "readme.md"]
+        if prefetched is None:
+            prefetched = self._fetch_files(project, README_FILES, branch)
         
-        for readme_file in readme_files:
-            content = self._get_file_content(project, readme_file, branch)
+        for readme_file in README_FILES:
+            content = prefetched.get(readme_file)
             if content:
                 return content
         
         return ""
 
-    def _get_package_files_content(self, project, branch: str) -> Dict:
+    def _get_package_files_content(self, project, branch: str, prefetched: Optional[Dict] = None) -> Dict:
         """
         Get package/dependency files content
         
         Args:
             project: GitLab project object
             branch: Branch name
+            prefetched: Already downloaded file contents keyed by path (optional).
+                        When given, only those contents are considered.
             
         Returns:
             Dictionary with package files content
         """
-        package_files = {}
-        
-        package_file_names = [
-            "requirements.txt", "package.json", "Pipfile", "poetry.lock",
-            "composer.json", "pom.xml", "build.gradle", "Cargo.toml"
-        ]
+        if prefetched is None:
+            prefetched = self._fetch_files(project, PACKAGE_FILE_NAMES, branch)
         
-        for file_name in package_file_names:
-            content = self._get_file_content(project, file_name, branch)
-            if content:
-                package_files[file_name] = content
-        
-        return package_files
+        return {
+            file_name: prefetched[file_name]
+            for file_name in PACKAGE_FILE_NAMES
+            if prefetched.get(file_name)
+        }
 
     def _get_last_commit_info(self, project, branch: str) -> Dict:
         """
@@ -1,12 +1,18 @@
 # This module will handle interactions with the Google AI API (Gemini).
 
-import google.generativeai as genai
 import os
 import logging
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from src.prompt_budget import budget_prompt_sections
+from src.response_cache import get_response_cache, make_fingerprint
+from src.model_registry import get_model_registry
+from src.prompt_capture import capture_prompt
+from src.intent_analyzer import analyze_conversation
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s')
 
+MODEL_NAME = 'gemini-2.0-flash'
+
 # Safety settings for the generative model
 SAFETY_SETTINGS = {
     HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
@@ -100,10 +106,40 @@ CLOSING_INSTRUCTION = """You are an AI assistant in resolution/closing mode. The
 
 **Tone**: Positive, encouraging, supportive, and celebratory of their achievement."""
 
+# System instruction used for each response mode
+SYSTEM_INSTRUCTIONS = {
+    'socratic': SOCRATIC_INSTRUCTION,
+    'explanation': EXPLANATION_INSTRUCTION,
+    'analysis': ANALYSIS_INSTRUCTION,
+    'closing': CLOSING_INSTRUCTION,
+    'mixed': SOCRATIC_INSTRUCTION  # Default to Socratic for mixed mode
+}
+
+# Mode indicators added to responses for user awareness (no emojis for Windows compatibility)
+MODE_INDICATORS = {
+    'socratic': "**Rubber Duck Mode** - Let's think through this together:\n\n",
+    'explanation': "**Explanation Mode** - Here's what you need to know:\n\n",
+    'analysis': "**Analysis Mode** - Code Review Results:\n\n",
+    'mixed': "**Adaptive Mode** - Tailored response:\n\n",
+    'closing': "**Session Complete** - Great work on solving this!\n\n"
+}
+
+# Helpful footers with mode switching options (no emojis)
+MODE_FOOTERS = {
+    'socratic': "\n\n---\n*Need a direct explanation instead? Just ask 'Can you explain this?' in your next message.*",
+    'explanation': "\n\n---\n*Want to explore this further with questions? Ask me to 'help you think through this step by step.'*",
+    'analysis': "\n\n---\n*Ready to implement these suggestions? I can guide you through the process step by step.*",
+    'closing': "\n\n---\n*Feel free to create a new issue if you encounter other problems. Happy coding!*"
+}
+
+# Appended to partial responses while streaming
+STREAMING_MARKER = "\n\n*...*"
+
 def configure_google_ai(api_key=None):
     """Configures the Google AI SDK with the API key.
     If api_key is provided, it's used directly.
     Otherwise, it attempts to fetch from the GOOGLE_AI_API_KEY environment variable.
+    The SDK is only (re)configured when the key changes.
     """
     key_to_use = api_key if api_key else os.getenv('GOOGLE_AI_API_KEY')
     
@@ -111,69 +147,51 @@ def configure_google_ai(api_key=None):
         logging.error("Google AI API key not provided and GOOGLE_AI_API_KEY environment variable not set.")
         return False
     try:
-        genai.configure(api_key=key_to_use)
-        logging.info("Google AI SDK configured successfully.")
+        get_model_registry().configure(key_to_use)
         return True
     except Exception as e:
         logging.error(f"Error configuring Google AI SDK: {e}")
         return False # Return False on failure
 
+def get_model(system_instruction, api_key=None):
+    """Returns the shared model for the system instruction, built on first use."""
+    key_to_use = api_key if api_key else os.getenv('GOOGLE_AI_API_KEY')
+    return get_model_registry().get_model(key_to_use, MODEL_NAME, system_instruction, SAFETY_SETTINGS)
+
+def warm_up_models(api_key=None):
+    """Configures the SDK and builds the model for every response mode ahead of the first request."""
+    if not configure_google_ai(api_key=api_key):
+        return False
+    try:
+        for instruction in set(SYSTEM_INSTRUCTIONS.values()):
+            get_model(instruction, api_key)
+        return True
+    except Exception as e:
+        logging.error(f"Error building Google AI models: {e}")
+        return False
+
 def detect_user_intent(problem_description, conversation_history=""):
     """
     Analyze user input to determine the most appropriate response mode.
-    Returns: 'socratic', 'explanation', 'analysis', 'closing', or 'mixed'
+    Returns: 'socratic', 'explanation', 'analysis' or 'closing'
+    Closing/resolution indicators have the highest priority, then explicit
+    explanation, analysis and Socratic requests; the default is Socratic.
     """
-    intent_keywords = {
-        'closing': ['i got it', 'got it', 'issue is solved', 'problem is solved', 'thank you', 
-                   'thanks', 'i have fixed', 'i have fix', 'fixed it', 'solved it', 
-                   'that worked', 'it works now', 'working now', 'problem solved',
-                   'all good', 'perfect', 'exactly what i needed', 'that did it',
-                   'issue resolved', 'resolved', 'figured it out', 'found the solution',
-                   'no more help needed', 'all set'],
-        'explanation': ['explain', 'how does', 'what is', 'can you tell me', 'help me understand', 
-                       'show me', 'teach me', 'what does this mean', 'please explain',
-                       'give me the answer', 'just tell me', 'solve this for me',
-                       'provide the solution', 'show me the code', 'what should i do'],
-        'analysis': ['review my code', 'analyze', 'is this good', 'optimize', 'improve', 
-                    'best practice', 'code review', 'performance', 'refactor'],
-        'socratic': ['help me think', 'guide me', 'rubber duck', 'ask me questions',
-                    'help me debug', 'walk me through', 'help me figure out']
-    }
-    
-    text_to_analyze = (problem_description + " " + conversation_history).lower()
-    
-    # Check for closing/resolution indicators first (highest priority)
-    for keyword in intent_keywords['closing']:
-        if keyword in text_to_analyze:
-            return 'closing'
-    
-    # Check for explicit explanation requests
-    for keyword in intent_keywords['explanation']:
-        if keyword in text_to_analyze:
-            return 'explanation'
-    
-    # Check for code analysis requests
-    for keyword in intent_keywords['analysis']:
-        if keyword in text_to_analyze:
-            return 'analysis'
-    
-    # Check for explicit Socratic requests
-    for keyword in intent_keywords['socratic']:
-        if keyword in text_to_analyze:
-            return 'socratic'
-    
-    # Default behavior based on context - prefer Socratic method
-    if len(conversation_history) > 500:  # Ongoing conversation
-        return 'socratic'
-    elif 'code' in text_to_analyze and any(word in text_to_analyze for word in ['review', 'analyze', 'improve']):
-        return 'analysis'
-    else:
-        return 'socratic'  # Default to Socratic method to encourage self-discovery
-
-def format_advanced_prompt(problem_description, conversation_history="", repository_context="", mode="socratic"):
+    return analyze_conversation(problem_description, conversation_history).intent
+
+def format_advanced_prompt(problem_description, conversation_history="", repository_context="", mode="socratic", token_budget=None):
     """
     Create an advanced, well-structured prompt based on the mode and available context.
+    Sections are trimmed to fit the token budget (PROMPT_TOKEN_BUDGET by default).
     """
+    problem_description, conversation_history, repository_context, usage = budget_prompt_sections(
+        problem_description, conversation_history, repository_context, token_budget
+    )
+    logging.info("Prompt token usage: " + ", ".join(
+        f"{section}={stats['used']}/{stats['allocated']} (from {stats['original']})"
+        for section, stats in usage.items()
+    ))
+    
     prompt_parts = []
     
     # Add repository context if available
@@ -215,32 +233,47 @@ def format_advanced_prompt(problem_description, conversation_history="", reposit
     
     return "\n".join(prompt_parts)
 
-def generate_socratic_questions(problem_description, conversation_history="", api_key=None, repository_context=""):
-    """Enhanced Socratic questioning with advanced prompting and multiple modes."""
+def format_mode_response(mode, generated_text, include_footer=True):
+    """Add the mode header (and the mode switching footer) to a generated response."""
+    formatted_response = MODE_INDICATORS.get(mode, "") + generated_text
+    if include_footer and mode in MODE_FOOTERS:
+        formatted_response += MODE_FOOTERS[mode]
+    return formatted_response
+
+def consume_response_stream(response, mode, on_partial):
+    """
+    Read a streamed model response, passing the formatted text received so far
+    to on_partial after every chunk. Returns the complete generated text.
+    """
+    generated_text = ""
+    for chunk in response:
+        if not chunk.parts:
+            continue
+        generated_text += chunk.text
+        on_partial(format_mode_response(mode, generated_text, include_footer=False) + STREAMING_MARKER)
+    return generated_text
+
+def generate_socratic_questions(problem_description, conversation_history="", api_key=None, repository_context="", on_partial=None, prompt_tag=None, mode=None):
+    """
+    Enhanced Socratic questioning with advanced prompting and multiple modes.
+    mode is the response mode already detected for this conversation (detected
+    here when omitted).
+    When on_partial is given, the response is streamed and on_partial is called
+    with the formatted partial response as chunks arrive, and errors are raised
+    instead of being returned as text. prompt_tag
+    ({"project_id", "issue_iid"}) selects the prompt for debug capture.
+    """
     # Configure AI with the provided API key before proceeding
     if not configure_google_ai(api_key=api_key):
         return "Error: Google AI not configured. Please check API key."
 
-    # Detect user intent
-    mode = detect_user_intent(problem_description, conversation_history)
-      # Select appropriate system instruction
-    system_instructions = {
-        'socratic': SOCRATIC_INSTRUCTION,
-        'explanation': EXPLANATION_INSTRUCTION,
-        'analysis': ANALYSIS_INSTRUCTION,
-        'closing': CLOSING_INSTRUCTION,
-        'mixed': SOCRATIC_INSTRUCTION  # Default to Socratic for mixed mode
-    }
-    
-    selected_instruction = system_instructions.get(mode, SOCRATIC_INSTRUCTION)
+    # Detect user intent unless the caller already did
+    if mode is None:
+        mode = detect_user_intent(problem_description, conversation_history)
+    # Select appropriate system instruction
+    selected_instruction = SYSTEM_INSTRUCTIONS.get(mode, SOCRATIC_INSTRUCTION)
 
     try:
-        model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash',
-            safety_settings=SAFETY_SETTINGS,
-            system_instruction=selected_instruction
-        )
-
         # Create advanced prompt
         full_prompt = format_advanced_prompt(
             problem_description, 
@@ -249,39 +282,35 @@ def generate_socratic_questions(problem_description, conversation_history="", ap
             mode
         )
 
-        print("full prompt:", full_prompt)  # Debugging line to check prompt structure
+        # Written in the background, only for projects/issues selected for capture
+        capture_prompt(full_prompt, prompt_tag, mode, selected_instruction)
 
-        with open('debug_prompt.txt', 'w') as f:
-            f.write(full_prompt)
+        # Identical prompts (e.g. redelivered webhooks) are answered from the cache
+        response_cache = get_response_cache()
+        cache_key = make_fingerprint(MODEL_NAME, mode, selected_instruction, full_prompt)
+        if response_cache:
+            cached_response = response_cache.get(cache_key)
+            if cached_response is not None:
+                logging.info(f"Serving {mode} response from cache. Cache stats: {response_cache.stats()}")
+                return cached_response
+
+        # Models are built once per system instruction and shared across requests
+        model = get_model(selected_instruction, api_key)
 
         logging.info(f"Using {mode} mode for response generation. Prompt length: {len(full_prompt)} chars.")
 
-        response = model.generate_content(full_prompt)
+        if on_partial:
+            response = model.generate_content(full_prompt, stream=True)
+            generated_text = consume_response_stream(response, mode, on_partial)
+        else:
+            response = model.generate_content(full_prompt)
+            generated_text = response.text if response.parts else ""
 
-        if response.parts:
-            generated_text = response.text
-              # Add mode indicator to response for user awareness (no emojis for Windows compatibility)
-            mode_indicators = {
-                'socratic': "**Rubber Duck Mode** - Let's think through this together:\n\n",
-                'explanation': "**Explanation Mode** - Here's what you need to know:\n\n",
-                'analysis': "**Analysis Mode** - Code Review Results:\n\n",
-                'mixed': "**Adaptive Mode** - Tailored response:\n\n",
-                'closing': "**Session Complete** - Great work on solving this!\n\n"
-            }
-            
-            formatted_response = mode_indicators.get(mode, "") + generated_text
-            
-            # Add helpful footer with mode switching options (no emojis)
-            if mode == 'socratic':
-                formatted_response += "\n\n---\n*Need a direct explanation instead? Just ask 'Can you explain this?' in your next message.*"
-            elif mode == 'explanation':
-                formatted_response += "\n\n---\n*Want to explore this further with questions? Ask me to 'help you think through this step by step.'*"
-            elif mode == 'analysis':
-                formatted_response += "\n\n---\n*Ready to implement these suggestions? I can guide you through the process step by step.*"
-            elif mode == 'closing':
-                formatted_response += "\n\n---\n*Feel free to create a new issue if you encounter other problems. Happy coding!*"
-            
+        if generated_text:
+            formatted_response = format_mode_response(mode, generated_text)
             logging.info(f"Successfully generated {mode} response. Length: {len(formatted_response)} chars.")
+            if response_cache:
+                response_cache.set(cache_key, formatted_response)
             return formatted_response
         elif response.prompt_feedback and response.prompt_feedback.block_reason:
             logging.warning(f"Prompt was blocked by Google AI. Reason: {response.prompt_feedback.block_reason}")
@@ -292,10 +321,13 @@ def generate_socratic_questions(problem_description, conversation_history="", ap
 
     except Exception as e:
         logging.error(f"An error occurred while interacting with Google AI: {e}")
+        if on_partial:
+            # The streaming caller owns a placeholder comment and decides what to do with it
+            raise
         return f"**Error**: An unexpected error occurred with Google AI: {str(e)}"
 
 def generate_contextual_response(problem_description, conversation_history="", api_key=None, 
-                               repository_context="", response_mode="auto"):
+                               repository_context="", response_mode="auto", prompt_tag=None):
     """
     Generate a contextual response with explicit mode control.
     
@@ -305,31 +337,22 @@ def generate_contextual_response(problem_description, conversation_history="", a
         api_key: Google AI API key
         repository_context: Relevant code/repository information
         response_mode: 'auto', 'socratic', 'explanation', 'analysis', or 'mixed'
+        prompt_tag: {"project_id", "issue_iid"} used to select the prompt for debug capture
     """
     if response_mode == "auto":
-        return generate_socratic_questions(problem_description, conversation_history, api_key, repository_context)
+        return generate_socratic_questions(problem_description, conversation_history, api_key, repository_context,
+                                           prompt_tag=prompt_tag)
     
     # Configure AI
     if not configure_google_ai(api_key=api_key):
         return "Error: Google AI not configured. Please check API key."
     
-    # Select system instruction based on explicit mode
-    system_instructions = {
-        'socratic': SOCRATIC_INSTRUCTION,
-        'explanation': EXPLANATION_INSTRUCTION,
-        'analysis': ANALYSIS_INSTRUCTION,
-        'mixed': SOCRATIC_INSTRUCTION
-    }
-    
-    selected_instruction = system_instructions.get(response_mode, SOCRATIC_INSTRUCTION)
+    # Select system instruction based on explicit mode (closing is only chosen automatically)
+    selected_instruction = SYSTEM_INSTRUCTIONS.get(response_mode, SOCRATIC_INSTRUCTION)
+    if response_mode == 'closing':
+        selected_instruction = SOCRATIC_INSTRUCTION
 
     try:
-        model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash',
-            safety_settings=SAFETY_SETTINGS,
-            system_instruction=selected_instruction
-        )
-
         # Create prompt for explicit mode
         full_prompt = format_advanced_prompt(
             problem_description, 
@@ -338,10 +361,18 @@ def generate_contextual_response(problem_description, conversation_history="", a
             response_mode
         )
 
-        print("full prompt:", full_prompt)  # Debugging line to check prompt structure
+        capture_prompt(full_prompt, prompt_tag, response_mode, selected_instruction)
 
-        with open('debug_prompt.txt', 'w') as f:
-            f.write(full_prompt)
+        response_cache = get_response_cache()
+        cache_key = make_fingerprint(MODEL_NAME, response_mode, selected_instruction, full_prompt)
+        if response_cache:
+            cached_response = response_cache.get(cache_key)
+            if cached_response is not None:
+                logging.info(f"Serving {response_mode} response from cache. Cache stats: {response_cache.stats()}")
+                return cached_response
+
+        # Models are built once per system instruction and shared across requests
+        model = get_model(selected_instruction, api_key)
 
         logging.info(f"Generating {response_mode} mode response. Prompt length: {len(full_prompt)} chars.")
 
@@ -350,6 +381,8 @@ def generate_contextual_response(problem_description, conversation_history="", a
         if response.parts:
             generated_text = response.text
             logging.info(f"Successfully generated {response_mode} response. Length: {len(generated_text)} chars.")
+            if response_cache:
+                response_cache.set(cache_key, generated_text)
             return generated_text
         else:
             return f"⚠️ **Error**: No response generated for {response_mode} mode."
@@ -378,41 +411,28 @@ def extract_code_blocks(text):
 
 def analyze_conversation_sentiment(conversation_history):
     """Analyze the sentiment and progress of the conversation."""
-    frustration_indicators = [
-        'stuck', 'confused', 'frustrated', 'not working', 'help me', 'please',
-        'urgent', 'deadline', 'critical', 'broken', 'error', 'issue'
-    ]
-    
-    progress_indicators = [
-        'understand', 'makes sense', 'got it', 'working', 'solved',
-        'thanks', 'helpful', 'progress', 'better', 'clear'
-    ]
-    
-    text = conversation_history.lower()
-    frustration_score = sum(1 for indicator in frustration_indicators if indicator in text)
-    progress_score = sum(1 for indicator in progress_indicators if indicator in text)
-    
+    signals = analyze_conversation("", conversation_history)
     return {
-        'frustration_level': min(frustration_score, 5),  # Cap at 5
-        'progress_level': min(progress_score, 5),        # Cap at 5
-        'needs_encouragement': frustration_score > progress_score
+        'frustration_level': signals.frustration_level,  # Capped at 5
+        'progress_level': signals.progress_level,        # Capped at 5
+        'needs_encouragement': signals.needs_encouragement
     }
 
 def suggest_response_mode(problem_description, conversation_history=""):
     """Suggest the best response mode based on context analysis."""
-    sentiment = analyze_conversation_sentiment(conversation_history)
-    code_info = extract_code_blocks(problem_description + " " + conversation_history)
+    # One scan gives both the sentiment and the code block count
+    signals = analyze_conversation(problem_description, conversation_history)
     
     # High frustration - offer explanation mode
-    if sentiment['frustration_level'] > 3:
+    if signals.frustration_level > 3:
         return "explanation", "User seems frustrated - offering direct help"
     
     # Lots of code present - suggest analysis
-    if len(code_info['code_blocks']) > 2:
+    if signals.code_block_count > 2:
         return "analysis", "Multiple code blocks detected - code review mode"
     
     # Good progress with Socratic method - continue
-    if sentiment['progress_level'] > 2:
+    if signals.progress_level > 2:
         return "socratic", "User showing progress - continue Socratic approach"
     
     # Default to auto-detection
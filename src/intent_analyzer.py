@@ -0,0 +1,176 @@
+"""
+Intent and sentiment analysis of an issue conversation, done once per event.
+
+The problem statement and history are lowercased once and every signal used by
+the callers (response mode, frustration/progress levels, code blocks) is
+computed together. Results are memoized on the conversation text, so the
+handler and the generation code share one analysis per event.
+
+Keyword matching keeps substring semantics and uses CPython's str search
+(a compiled trie regex and a Python-level Aho-Corasick automaton were both
+several times slower on long threads; see scripts/benchmark_intent_analyzer.py).
+"""
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+INTENT_KEYWORDS = {
+    'closing': ['i got it', 'got it', 'issue is solved', 'problem is solved', 'thank you',
+                'thanks', 'i have fixed', 'i have fix', 'fixed it', 'solved it',
+                'that worked', 'it works now', 'working now', 'problem solved',
+                'all good', 'perfect', 'exactly what i needed', 'that did it',
+                'issue resolved', 'resolved', 'figured it out', 'found the solution',
+                'no more help needed', 'all set'],
+    'explanation': ['explain', 'how does', 'what is', 'can you tell me', 'help me understand',
+                    'show me', 'teach me', 'what does this mean', 'please explain',
+                    'give me the answer', 'just tell me', 'solve this for me',
+                    'provide the solution', 'show me the code', 'what should i do'],
+    'analysis': ['review my code', 'analyze', 'is this good', 'optimize', 'improve',
+                 'best practice', 'code review', 'performance', 'refactor'],
+    'socratic': ['help me think', 'guide me', 'rubber duck', 'ask me questions',
+                 'help me debug', 'walk me through', 'help me figure out']
+}
+
+# Checked in this order; the first intent with a matching keyword wins
+INTENT_PRIORITY = ['closing', 'explanation', 'analysis', 'socratic']
+
+FRUSTRATION_INDICATORS = [
+    'stuck', 'confused', 'frustrated', 'not working', 'help me', 'please',
+    'urgent', 'deadline', 'critical', 'broken', 'error', 'issue'
+]
+
+PROGRESS_INDICATORS = [
+    'understand', 'makes sense', 'got it', 'working', 'solved',
+    'thanks', 'helpful', 'progress', 'better', 'clear'
+]
+
+# Words of the fallback analysis rule ("code" plus one of the review words)
+CODE_WORD = 'code'
+REVIEW_WORDS = ['review', 'analyze', 'improve']
+
+# An ongoing conversation longer than this defaults to Socratic mode
+LONG_CONVERSATION_CHARS = 500
+
+# Number of latest user turns whose labels decide the response mode
+INTENT_WINDOW_TURNS = int(os.getenv('INTENT_WINDOW_TURNS', '3'))
+
+CODE_BLOCK_PATTERN = re.compile(r'```(?:[\w+]*\n)?(.*?)```', re.DOTALL)
+
+ConversationSignals = namedtuple('ConversationSignals', [
+    'intent',               # 'socratic', 'explanation', 'analysis' or 'closing'
+    'keyword',              # Keyword that selected the intent (None for the defaults)
+    'frustration_level',    # 0-5, from the history only
+    'progress_level',       # 0-5, from the history only
+    'needs_encouragement',
+    'code_block_count'      # Fenced code blocks in problem + history
+])
+
+
+class IntentAnalyzer:
+    def __init__(self, intent_keywords=None):
+        """
+        Initialize the analyzer
+
+        Args:
+            intent_keywords: {intent: [keywords]} (default: INTENT_KEYWORDS)
+        """
+        intent_keywords = intent_keywords or INTENT_KEYWORDS
+        # Flattened in priority order so the first hit decides the intent
+        self._intent_table = tuple(
+            (keyword, intent) for intent in INTENT_PRIORITY for keyword in intent_keywords.get(intent, [])
+        )
+
+    def detect_intent(self, text, history_length):
+        """
+        Return (intent, keyword) for lowercased problem + history text
+
+        Args:
+            text: Lowercased problem statement and history
+            history_length: Length of the history, for the long-conversation default
+        """
+        for keyword, intent in self._intent_table:
+            if keyword in text:
+                return intent, keyword
+        if history_length > LONG_CONVERSATION_CHARS:
+            return 'socratic', None
+        if CODE_WORD in text and any(word in text for word in REVIEW_WORDS):
+            return 'analysis', None
+        return 'socratic', None
+
+    def analyze(self, problem_description, conversation_history=""):
+        """
+        Compute all conversation signals
+
+        Args:
+            problem_description: Current problem statement
+            conversation_history: Previous conversation
+
+        Returns:
+            ConversationSignals
+        """
+        history_text = conversation_history.lower()
+        text = problem_description.lower() + " " + history_text
+
+        intent, keyword = self.detect_intent(text, len(conversation_history))
+        frustration = sum(1 for indicator in FRUSTRATION_INDICATORS if indicator in history_text)
+        progress = sum(1 for indicator in PROGRESS_INDICATORS if indicator in history_text)
+        return ConversationSignals(
+            intent=intent,
+            keyword=keyword,
+            frustration_level=min(frustration, 5),
+            progress_level=min(progress, 5),
+            needs_encouragement=frustration > progress,
+            code_block_count=len(CODE_BLOCK_PATTERN.findall(problem_description + " " + conversation_history))
+        )
+
+
+_analyzer = IntentAnalyzer()
+
+
+@lru_cache(maxsize=128)
+def analyze_conversation(problem_description, conversation_history=""):
+    """
+    Analyze a conversation with the shared analyzer. Results are memoized, so
+    the several callers handling the same event share one scan.
+
+    Returns:
+        ConversationSignals
+    """
+    return _analyzer.analyze(problem_description, conversation_history)
+
+
+def classify_turn(text):
+    """
+    Label a single conversation turn
+
+    Args:
+        text: Turn text (a user comment or the issue title and description)
+
+    Returns:
+        The turn's explicit intent ('closing', 'explanation', 'analysis' or
+        'socratic'), 'analysis' for the code review fallback, or None when the
+        turn carries no intent signal
+    """
+    intent, keyword = _analyzer.detect_intent(text.lower(), 0)
+    if keyword is None and intent == 'socratic':
+        return None
+    return intent
+
+
+def decide_response_mode(labels):
+    """
+    Choose the response mode from the labels of the latest turns
+
+    Args:
+        labels: Turn labels from classify_turn, newest first (at most
+                INTENT_WINDOW_TURNS are considered)
+
+    Returns:
+        'closing' only when the latest turn is closing; otherwise the newest
+        other label in the window, defaulting to 'socratic'
+    """
+    window = list(labels)[:INTENT_WINDOW_TURNS]
+    if window and window[0] == 'closing':
+        return 'closing'
+    return next((label for label in window if label and label != 'closing'), 'socratic')
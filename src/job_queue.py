@@ -0,0 +1,327 @@
+"""
+In-process job queue with a worker pool and optional SQLite persistence.
+
+The webhook endpoint enqueues events and returns immediately; worker threads
+pick them up and run the (slow) processing pipeline in the background.
+
+Jobs may carry a coalescing key (e.g. one per issue). A job enqueued while
+another job with the same key is still pending is merged into it and its start
+is pushed back by the debounce delay (up to a maximum wait counted from the
+first enqueue), and jobs sharing a key never run concurrently. Merge functions
+can be registered per key prefix so that jobs recovered from the database, which
+only hold their payload, are still merged rather than overwritten.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    def __init__(self, handler, concurrency=4, db_path=None, max_attempts=3, retry_delay=5, merges=None):
+        """
+        Initialize the job queue
+
+        Args:
+            handler: Callable invoked with the job payload (a JSON-serializable dict)
+            concurrency: Number of worker threads
+            db_path: Path to a SQLite file for persisting accepted jobs (optional).
+                     When set, jobs that were accepted but not finished are
+                     re-queued on the next start.
+            max_attempts: Maximum number of attempts for a job that raises
+            retry_delay: Seconds before the first retry; doubled for each further attempt
+            merges: Dictionary of key prefix -> merge callable (see enqueue), used
+                    for keyed jobs enqueued without one and for recovered jobs
+        """
+        self.handler = handler
+        self.concurrency = max(1, int(concurrency))
+        self.db_path = db_path
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_delay = max(0, retry_delay)
+        self.merges = dict(merges or {})
+
+        self._pending = deque()
+        self._pending_by_key = {}
+        self._running_keys = set()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._active = 0
+        self._coalesced = 0
+        self._stopping = False
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._init_db()
+
+    def _init_db(self):
+        """Create the SQLite connection and jobs table"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._db_lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+                "coalesce_key TEXT)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+            if 'coalesce_key' not in columns:
+                # Databases created before coalescing keys existed
+                self._db.execute("ALTER TABLE jobs ADD COLUMN coalesce_key TEXT")
+            self._db.commit()
+        logger.info(f"Job queue persistence enabled at {self.db_path}")
+
+    def _persist(self, job):
+        if not self._db:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (id, payload, attempts, created_at, coalesce_key) VALUES (?, ?, ?, ?, ?)",
+                (job['id'], json.dumps(job['payload']), job['attempts'], job['created_at'], job.get('key'))
+            )
+            self._db.commit()
+
+    def _forget(self, job_id):
+        if not self._db:
+            return
+        with self._db_lock:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._db.commit()
+
+    def _load_persisted_jobs(self):
+        """Re-queue jobs accepted before the last shutdown"""
+        if not self._db:
+            return 0
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, payload, attempts, created_at, coalesce_key FROM jobs ORDER BY created_at"
+            ).fetchall()
+        with self._condition:
+            for job_id, payload, attempts, created_at, key in rows:
+                job = {
+                    'id': job_id,
+                    'payload': json.loads(payload),
+                    'attempts': attempts,
+                    'created_at': created_at,
+                    'key': key,
+                    'run_after': 0,
+                    'merge': self._merge_for_key(key)
+                }
+                if key is not None and key in self._pending_by_key:
+                    # Only one job per key can be pending; fold this (newer) row into it
+                    self._fold_payload(self._pending_by_key[key], job['payload'], newer=True)
+                    self._persist(self._pending_by_key[key])
+                    self._forget(job_id)
+                    continue
+                self._add_pending(job)
+            self._condition.notify_all()
+        if rows:
+            logger.info(f"Recovered {len(rows)} persisted job(s) from {self.db_path}")
+        return len(rows)
+
+    def start(self):
+        """Start the worker threads and recover persisted jobs"""
+        if self._workers:
+            return
+        self._stopping = False
+        self._load_persisted_jobs()
+        for index in range(self.concurrency):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Job queue started with {self.concurrency} worker(s)")
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker threads. Pending jobs stay persisted (if enabled).
+
+        Args:
+            timeout: Seconds to wait for each worker to finish its current job
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def enqueue(self, payload, key=None, delay=0, merge=None, max_delay=None):
+        """
+        Accept a job for background processing
+
+        Args:
+            payload: JSON-serializable dictionary passed to the handler
+            key: Optional coalescing key. A pending job with the same key absorbs
+                 this one, and jobs with the same key never run concurrently.
+            delay: Seconds to wait before the job may start; for a coalesced
+                   job the wait restarts from this enqueue (debounce)
+            merge: Callable (pending_payload, new_payload) -> payload used when
+                   coalescing (default: the merge registered for the key's
+                   prefix, else keep the new payload)
+            max_delay: Maximum seconds a coalesced job waits after its first
+                       enqueue (created_at, or the time it was re-queued for a
+                       retry), however often the debounce restarts (default:
+                       unbounded). A retry's backoff is never shortened.
+
+        Returns:
+            Job ID string (the ID of the pending job when coalesced)
+        """
+        now = time.time()
+        merge = merge or self._merge_for_key(key)
+        with self._condition:
+            pending = self._pending_by_key.get(key) if key is not None else None
+            if pending is not None:
+                pending['payload'] = merge(pending['payload'], payload) if merge else payload
+                run_after = now + delay
+                if max_delay is not None:
+                    # A steady stream of events must not postpone the job forever; a job
+                    # re-queued for retry counts its wait from the retry instead
+                    run_after = min(run_after, pending.get('requeued_at', pending['created_at']) + max_delay)
+                # Never start a retry before its backoff has passed
+                pending['run_after'] = max(run_after, pending.get('retry_after', 0))
+                pending['merge'] = merge
+                self._coalesced += 1
+                job = pending
+            else:
+                job = {
+                    'id': uuid.uuid4().hex,
+                    'payload': payload,
+                    'attempts': 0,
+                    'created_at': now,
+                    'key': key,
+                    'run_after': now + delay,
+                    'merge': merge
+                }
+                self._add_pending(job)
+            self._persist(job)
+            self._condition.notify()
+            depth = len(self._pending)
+        if pending is not None:
+            logger.info(f"Coalesced event into pending job {job['id']} (key: {key})")
+        else:
+            logger.info(f"Enqueued job {job['id']} (pending: {depth})")
+        return job['id']
+
+    def stats(self):
+        """Return current queue depth and number of running jobs"""
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'active': self._active,
+                'workers': len(self._workers),
+                'coalesced': self._coalesced
+            }
+
+    def _merge_for_key(self, key):
+        """Return the merge callable registered for the longest matching key prefix, or None"""
+        if key is None:
+            return None
+        prefixes = [prefix for prefix in self.merges if key.startswith(prefix)]
+        return self.merges[max(prefixes, key=len)] if prefixes else None
+
+    def _fold_payload(self, pending, payload, newer):
+        """
+        Merge another payload of the same key into a pending job. Caller holds
+        self._condition (or is recovering jobs before the workers start).
+
+        Args:
+            pending: Pending job dictionary
+            payload: Payload to fold in
+            newer: True when payload was enqueued after the pending job's payload
+        """
+        merge = pending.get('merge') or self._merge_for_key(pending.get('key'))
+        if merge:
+            pending['payload'] = merge(pending['payload'], payload) if newer else merge(payload, pending['payload'])
+            return
+        if newer:
+            pending['payload'] = payload
+        logger.warning(f"No merge function for key {pending.get('key')}; "
+                       f"kept the {'newer' if newer else 'pending'} payload of job {pending['id']} and dropped the other")
+
+    def _add_pending(self, job):
+        # Caller holds self._condition
+        self._pending.append(job)
+        if job.get('key') is not None:
+            self._pending_by_key[job['key']] = job
+
+    def _take_ready_job(self, now):
+        """
+        Remove and return the first job that may start now, or return the
+        number of seconds until one may become ready (None when waiting on
+        running keys or an empty queue). Caller holds self._condition.
+        """
+        wait = None
+        for job in self._pending:
+            if job.get('key') is not None and job['key'] in self._running_keys:
+                continue
+            remaining = job.get('run_after', 0) - now
+            if remaining <= 0:
+                self._pending.remove(job)
+                if job.get('key') is not None:
+                    del self._pending_by_key[job['key']]
+                    self._running_keys.add(job['key'])
+                return job
+            wait = remaining if wait is None else min(wait, remaining)
+        return wait
+
+    def _next_job(self):
+        with self._condition:
+            while not self._stopping:
+                ready = self._take_ready_job(time.time())
+                if isinstance(ready, dict):
+                    self._active += 1
+                    return ready
+                self._condition.wait(ready)
+            return None
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._run_job(job)
+            finally:
+                with self._condition:
+                    self._active -= 1
+                    self._running_keys.discard(job.get('key'))
+                    # Jobs held back by this key may be ready now
+                    self._condition.notify_all()
+
+    def _run_job(self, job):
+        job['attempts'] += 1
+        started = time.time()
+        try:
+            self.handler(job['payload'])
+            logger.info(f"Job {job['id']} finished in {time.time() - started:.2f}s")
+            self._forget(job['id'])
+        except Exception as e:
+            if job['attempts'] < self.max_attempts:
+                delay = self.retry_delay * 2 ** (job['attempts'] - 1)
+                logger.warning(f"Job {job['id']} failed (attempt {job['attempts']}/{self.max_attempts}), "
+                               f"retrying in {delay:g}s: {e}")
+                with self._condition:
+                    if job.get('key') is not None and job['key'] in self._pending_by_key:
+                        # Fold the failed payload into the newer pending job for the same key
+                        pending = self._pending_by_key[job['key']]
+                        self._fold_payload(pending, job['payload'], newer=False)
+                        self._persist(pending)
+                        self._forget(job['id'])
+                        return
+                    job['requeued_at'] = time.time()
+                    job['run_after'] = job['retry_after'] = job['requeued_at'] + delay
+                    self._persist(job)
+                    self._add_pending(job)
+                    self._condition.notify()
+            else:
+                logger.error(f"Job {job['id']} failed after {job['attempts']} attempt(s), dropping: {e}")
+                self._forget(job['id'])
@@ -0,0 +1,104 @@
+"""
+Process-wide registry of configured Gemini model objects.
+
+genai.configure() replaces the SDK's global client configuration, so calling it
+on every request races with generations running on other threads. The registry
+configures the SDK once per API key under a lock and builds one GenerativeModel
+per (API key, model name, system instruction), which is then shared by all
+threads (generate_content on a model holds no per-request state).
+"""
+import hashlib
+import logging
+import threading
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(value):
+    return hashlib.sha256((value or "").encode("utf-8")).hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, model_factory=None, configure=None):
+        """
+        Initialize the registry
+
+        Args:
+            model_factory: Callable building a model from GenerativeModel keyword
+                           arguments (default: genai.GenerativeModel)
+            configure: Callable configuring the SDK with api_key (default: genai.configure)
+        """
+        self.model_factory = model_factory or genai.GenerativeModel
+        self.configure_sdk = configure or genai.configure
+        self._models = {}
+        self._lock = threading.Lock()
+        self._configured_key = None
+
+    def configure(self, api_key):
+        """
+        Configure the SDK for api_key unless it already is
+
+        Args:
+            api_key: Google AI API key
+        """
+        key_digest = _digest(api_key)
+        with self._lock:
+            self._configure_locked(api_key, key_digest)
+
+    def _configure_locked(self, api_key, key_digest):
+        # Caller holds self._lock
+        if self._configured_key == key_digest:
+            return
+        if self._configured_key is not None:
+            # The SDK keeps one global client; models built for the previous key
+            # would silently start using the new one, so drop them
+            logger.warning("Reconfiguring Google AI SDK with a different API key; cached models are rebuilt")
+            self._models.clear()
+        self.configure_sdk(api_key=api_key)
+        self._configured_key = key_digest
+        logger.info("Google AI SDK configured successfully.")
+
+    def get_model(self, api_key, model_name, system_instruction, safety_settings=None):
+        """
+        Return the shared model for this key, model name and system instruction,
+        building it on first use
+
+        Args:
+            api_key: Google AI API key
+            model_name: Gemini model name
+            system_instruction: System instruction text
+            safety_settings: Safety settings passed to the model
+
+        Returns:
+            GenerativeModel instance
+        """
+        key_digest = _digest(api_key)
+        cache_key = (key_digest, model_name, _digest(system_instruction))
+        with self._lock:
+            self._configure_locked(api_key, key_digest)
+            model = self._models.get(cache_key)
+            if model is None:
+                model = self.model_factory(
+                    model_name=model_name,
+                    safety_settings=safety_settings,
+                    system_instruction=system_instruction
+                )
+                self._models[cache_key] = model
+                logger.info(f"Built {model_name} model ({len(self._models)} cached)")
+            return model
+
+    def clear(self):
+        """Drop all cached models and the configured key"""
+        with self._lock:
+            self._models.clear()
+            self._configured_key = None
+
+
+_model_registry = ModelRegistry()
+
+
+def get_model_registry():
+    """Return the process-wide model registry"""
+    return _model_registry
@@ -0,0 +1,93 @@
+"""
+Timed stages of the event pipeline.
+
+Independent stages are started on a shared executor and joined where their
+result is needed, so their I/O overlaps; dependent stages run inline. Every
+stage records its duration, and the summary compares the wall-clock time of
+the event with the sum of its stages to show how much work overlapped.
+
+Stages started on the executor join the API call counter of the thread that
+started them, so per-event GitLab call counts stay complete.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.api_call_tracker import current_counter, use_counter
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_STAGE_WORKERS = int(os.getenv('PIPELINE_STAGE_WORKERS', '8'))
+
+_stage_executor = None
+_stage_executor_lock = threading.Lock()
+
+
+def get_stage_executor():
+    """Return the process-wide executor for pipeline stages"""
+    global _stage_executor
+    with _stage_executor_lock:
+        if _stage_executor is None:
+            _stage_executor = ThreadPoolExecutor(max_workers=max(1, PIPELINE_STAGE_WORKERS), thread_name_prefix="stage")
+        return _stage_executor
+
+
+class StageRunner:
+    def __init__(self, executor=None, clock=time.perf_counter):
+        """
+        Initialize a runner for one event
+
+        Args:
+            executor: Executor for started stages (default: the shared stage executor)
+            clock: Time source (for tests)
+        """
+        self._executor = executor
+        self._clock = clock
+        self._started_at = clock()
+        self._futures = {}
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def run(self, name, fn, *args, **kwargs):
+        """Run a stage in the calling thread and return its result"""
+        return self._timed(name, fn, args, kwargs)
+
+    def start(self, name, fn, *args, **kwargs):
+        """
+        Start a stage on the executor; its result is collected with result(name).
+        Only start stages whose inputs are already available, so workers never
+        wait on each other.
+        """
+        executor = self._executor or get_stage_executor()
+        counter = current_counter()
+
+        def stage():
+            with use_counter(counter):
+                return self._timed(name, fn, args, kwargs)
+
+        self._futures[name] = executor.submit(stage)
+
+    def result(self, name):
+        """Wait for a started stage and return its result (or raise its exception)"""
+        return self._futures[name].result()
+
+    def _timed(self, name, fn, args, kwargs):
+        started = self._clock()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._durations[name] = self._clock() - started
+
+    def timings(self):
+        """Return {stage name: seconds} for the stages that finished"""
+        with self._lock:
+            return dict(self._durations)
+
+    def summary(self):
+        """Return a short description of stage durations, wall-clock time and stage time sum"""
+        timings = self.timings()
+        stages = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings.items())
+        wall = self._clock() - self._started_at
+        return f"{stages or 'none'} (wall {wall * 1000:.0f}ms, stage sum {sum(timings.values()) * 1000:.0f}ms)"
@@ -0,0 +1,206 @@
+"""
+Token budgeting for prompt assembly: a fast local token estimator, per-section
+allocations and deterministic trimming policies.
+"""
+import os
+
+# Total prompt budget (system instruction excluded) and per-section shares
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '16000'))
+SECTION_SHARES = {
+    'repository': float(os.getenv('PROMPT_SHARE_REPOSITORY', '0.45')),
+    'history': float(os.getenv('PROMPT_SHARE_HISTORY', '0.30')),
+    'problem': float(os.getenv('PROMPT_SHARE_PROBLEM', '0.25')),
+}
+
+# Order in which unused budget is handed out to sections that need more
+SECTION_PRIORITY = ['problem', 'history', 'repository']
+
+CHARS_PER_TOKEN = 4
+HISTORY_TURN_SEPARATOR = "\n---\n"
+SUMMARY_LINE_CHARS = 160
+
+
+def estimate_tokens(text):
+    """
+    Estimate the token count of a text without calling a tokenizer
+    (roughly 4 characters per token for English text and code).
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        Estimated number of tokens
+    """
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def allocate_budget(needs, budget):
+    """
+    Split a token budget between sections. Each section first gets up to its
+    share; budget a section does not need is then given to the others in
+    SECTION_PRIORITY order.
+
+    Args:
+        needs: Mapping of section name to estimated tokens required
+        budget: Total token budget
+
+    Returns:
+        Mapping of section name to allocated tokens
+    """
+    allocation = {}
+    for section in SECTION_PRIORITY:
+        allocation[section] = min(needs.get(section, 0), int(budget * SECTION_SHARES[section]))
+    spare = budget - sum(allocation.values())
+    for section in SECTION_PRIORITY:
+        extra = min(spare, needs.get(section, 0) - allocation[section])
+        if extra > 0:
+            allocation[section] += extra
+            spare -= extra
+    return allocation
+
+
+def truncate_to_tokens(text, max_tokens, marker="\n... (truncated)"):
+    """
+    Keep the beginning of a text within max_tokens, cutting on a line boundary when possible
+
+    Args:
+        text: Text to trim
+        max_tokens: Token limit
+        marker: Appended when text was cut
+
+    Returns:
+        Trimmed text
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, max_tokens * CHARS_PER_TOKEN - len(marker))
+    cut = text.rfind("\n", 0, limit)
+    if cut < limit // 2:
+        cut = limit
+    return text[:cut] + marker
+
+
+def trim_problem(text, max_tokens):
+    """
+    Trim the current problem statement, keeping its head (issue title,
+    description and the first comments listed) and its tail (the last
+    comments listed). Comments are listed newest first (as produced by
+    format_conversation_for_ai), so the omitted middle holds comments between
+    the newest and the oldest ones.
+
+    Args:
+        text: Problem statement
+        max_tokens: Token limit
+
+    Returns:
+        Trimmed text
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    marker = "\n... (earlier details omitted) ...\n"
+    available = max(0, max_tokens * CHARS_PER_TOKEN - len(marker))
+    head = available // 2
+    tail = available - head
+    return text[:head] + marker + (text[-tail:] if tail else "")
+
+
+def summarize_turn(turn):
+    """
+    Compress one conversation turn into a single line
+
+    Args:
+        turn: Turn text
+
+    Returns:
+        One-line summary
+    """
+    line = " ".join(turn.split())
+    if len(line) > SUMMARY_LINE_CHARS:
+        line = line[:SUMMARY_LINE_CHARS - 3] + "..."
+    return f"- {line}"
+
+
+def trim_history(history, max_tokens):
+    """
+    Fit conversation history into max_tokens. Turns are newest first (as
+    produced by format_conversation_for_ai): the most recent turns are kept
+    verbatim, older turns are reduced to one-line summaries, and the oldest
+    summaries are dropped if even those do not fit.
+
+    Args:
+        history: Turns separated by HISTORY_TURN_SEPARATOR
+        max_tokens: Token limit
+
+    Returns:
+        Trimmed history text
+    """
+    if estimate_tokens(history) <= max_tokens:
+        return history
+
+    turns = history.split(HISTORY_TURN_SEPARATOR)
+    header = "Earlier conversation (summarized):"
+    separator_tokens = estimate_tokens(HISTORY_TURN_SEPARATOR)
+
+    kept = []
+    used = estimate_tokens(header) + separator_tokens
+    index = 0
+    while index < len(turns):
+        cost = estimate_tokens(turns[index]) + separator_tokens
+        if used + cost > max_tokens:
+            break
+        kept.append(turns[index])
+        used += cost
+        index += 1
+
+    summaries = []
+    for turn in turns[index:]:
+        line = summarize_turn(turn)
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        summaries.append(line)
+        used += cost
+
+    if not kept and not summaries:
+        return truncate_to_tokens(turns[0], max_tokens)
+    if summaries:
+        kept.append(header + "\n" + "\n".join(summaries))
+    return HISTORY_TURN_SEPARATOR.join(kept)
+
+
+def budget_prompt_sections(problem_description, conversation_history, repository_context, token_budget=None):
+    """
+    Trim prompt sections so together they fit the token budget
+
+    Args:
+        problem_description: Current problem statement
+        conversation_history: Previous conversation turns
+        repository_context: Repository context text
+        token_budget: Total budget (default: PROMPT_TOKEN_BUDGET)
+
+    Returns:
+        Tuple of (problem, history, repository, usage) where usage maps each
+        section to a dict with "original", "allocated" and "used" token counts
+    """
+    budget = token_budget or PROMPT_TOKEN_BUDGET
+    sections = {
+        'problem': problem_description or "",
+        'history': conversation_history or "",
+        'repository': repository_context or "",
+    }
+    needs = {name: estimate_tokens(text) for name, text in sections.items()}
+    allocation = allocate_budget(needs, budget)
+
+    trimmed = {
+        'problem': trim_problem(sections['problem'], allocation['problem']),
+        'history': trim_history(sections['history'], allocation['history']),
+        'repository': truncate_to_tokens(sections['repository'], allocation['repository'],
+                                         marker="\n... (repository context truncated)"),
+    }
+    usage = {
+        name: {'original': needs[name], 'allocated': allocation[name], 'used': estimate_tokens(trimmed[name])}
+        for name in sections
+    }
+    return trimmed['problem'], trimmed['history'], trimmed['repository'], usage
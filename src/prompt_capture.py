@@ -0,0 +1,163 @@
+"""
+Opt-in capture of generated prompts for debugging.
+
+Capture is enabled per project or issue (PROMPT_CAPTURE_TARGETS) and sampled
+(PROMPT_CAPTURE_SAMPLE_RATE). Captured prompts are truncated, queued in memory
+and written as JSON lines by a background listener thread to a size-rotated
+spool, so the generation path never blocks on disk I/O; the spool file is
+opened when capture is set up, not on the first capture. When the in-memory
+queue is full, captures are dropped rather than waited on.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated targets: "*" (everything), "<project_id>" or "<project_id>#<issue_iid>"
+PROMPT_CAPTURE_TARGETS = os.getenv('PROMPT_CAPTURE_TARGETS', '')
+# Fraction of matching prompts that are captured
+PROMPT_CAPTURE_SAMPLE_RATE = float(os.getenv('PROMPT_CAPTURE_SAMPLE_RATE', '1.0'))
+# Prompt and instruction text beyond this many characters is cut off
+PROMPT_CAPTURE_MAX_CHARS = int(os.getenv('PROMPT_CAPTURE_MAX_CHARS', '20000'))
+PROMPT_CAPTURE_PATH = os.getenv('PROMPT_CAPTURE_PATH', 'prompt_captures/prompts.jsonl')
+PROMPT_CAPTURE_MAX_BYTES = int(os.getenv('PROMPT_CAPTURE_MAX_BYTES', str(5 * 1024 * 1024)))
+PROMPT_CAPTURE_BACKUPS = int(os.getenv('PROMPT_CAPTURE_BACKUPS', '3'))
+# Captures waiting to be written; more are dropped
+PROMPT_CAPTURE_QUEUE_SIZE = 256
+
+
+def parse_targets(spec):
+    """
+    Parse a PROMPT_CAPTURE_TARGETS value
+
+    Args:
+        spec: Comma-separated target list
+
+    Returns:
+        Set of "*", "<project_id>" and "<project_id>#<issue_iid>" strings
+    """
+    return {target.strip() for target in (spec or "").split(",") if target.strip()}
+
+
+class PromptCapture:
+    def __init__(self, targets=None, sample_rate=PROMPT_CAPTURE_SAMPLE_RATE, max_chars=PROMPT_CAPTURE_MAX_CHARS,
+                 path=PROMPT_CAPTURE_PATH, max_bytes=PROMPT_CAPTURE_MAX_BYTES, backups=PROMPT_CAPTURE_BACKUPS,
+                 handler=None):
+        """
+        Initialize the prompt capture
+
+        Args:
+            targets: Set of capture targets (see parse_targets); empty disables capture
+            sample_rate: Fraction of matching prompts captured
+            max_chars: Maximum characters kept per captured text
+            path: Spool file (rotated by size)
+            max_bytes: Spool file size before rotation
+            backups: Number of rotated files kept
+            handler: logging.Handler writing the records (default: a RotatingFileHandler on path)
+
+        The writer is started here when there are targets (see start).
+        """
+        self.targets = set(targets or ())
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.captured = 0
+        self.dropped = 0
+        self._handler = handler
+        self._listener = None
+        self._queue = queue.Queue(maxsize=PROMPT_CAPTURE_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        if self.targets:
+            self.start()
+
+    def should_capture(self, project_id=None, issue_iid=None):
+        """Return True when a prompt for this project/issue is selected for capture"""
+        if not self.targets:
+            return False
+        if not ({"*", str(project_id), f"{project_id}#{issue_iid}"} & self.targets):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def capture(self, prompt, prompt_tag=None, mode=None, system_instruction=None):
+        """
+        Queue a prompt for writing if its project/issue is selected
+
+        Args:
+            prompt: Full prompt text
+            prompt_tag: Dictionary with "project_id" and "issue_iid" (optional)
+            mode: Response mode
+            system_instruction: System instruction text
+
+        Returns:
+            True when the prompt was queued
+        """
+        prompt_tag = prompt_tag or {}
+        if self._listener is None:
+            return False
+        if not self.should_capture(prompt_tag.get('project_id'), prompt_tag.get('issue_iid')):
+            return False
+        record = {
+            'timestamp': time.time(),
+            'project_id': prompt_tag.get('project_id'),
+            'issue_iid': prompt_tag.get('issue_iid'),
+            'mode': mode,
+            'prompt_chars': len(prompt),
+            'prompt': prompt[:self.max_chars],
+            'system_instruction': (system_instruction or "")[:self.max_chars]
+        }
+        try:
+            self._queue.put_nowait(logging.makeLogRecord({'msg': json.dumps(record), 'levelno': logging.INFO}))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.captured += 1
+        return True
+
+    def start(self):
+        """Open the spool and start the writer thread (no-op when already running)"""
+        with self._lock:
+            if self._listener is not None:
+                return
+            handler = self._handler
+            if handler is None:
+                directory = os.path.dirname(self.path)
+                try:
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    handler = logging.handlers.RotatingFileHandler(
+                        self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding='utf-8'
+                    )
+                except OSError as e:
+                    logger.error(f"Prompt capture disabled, cannot open {self.path}: {e}")
+                    return
+                handler.setFormatter(logging.Formatter('%(message)s'))
+            self._listener = logging.handlers.QueueListener(self._queue, handler)
+            self._listener.start()
+            logger.info(f"Prompt capture enabled for {sorted(self.targets)} (sample rate {self.sample_rate})")
+
+    def stop(self):
+        """Flush queued captures and stop the writer thread"""
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            # Let the writer drain a full queue so there is room for its stop sentinel
+            self._queue.join()
+            listener.stop()
+
+
+_prompt_capture = PromptCapture(parse_targets(PROMPT_CAPTURE_TARGETS))
+
+
+def capture_prompt(prompt, prompt_tag=None, mode=None, system_instruction=None):
+    """Capture a prompt with the process-wide PromptCapture (see PromptCapture.capture)"""
+    return _prompt_capture.capture(prompt, prompt_tag, mode, system_instruction)
@@ -0,0 +1,159 @@
+"""
+Process-local cache of repository content read from Firestore.
+
+Entries are keyed on the project and the repository version (the stored
+last_commit id), so content cached for one commit is never served for another.
+The cache is bounded by the estimated size of its values rather than by entry
+count, evicting least recently used entries first. Writers invalidate a
+project's entries when its stored content changes; the project and manifest
+documents, which tell which version is current, also expire after a TTL so
+updates made by other instances are picked up.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+REPOSITORY_CACHE_MAX_BYTES = int(os.getenv('REPOSITORY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Seconds the cached project and manifest documents are trusted without re-reading Firestore
+REPOSITORY_CACHE_DOCUMENT_TTL = int(os.getenv('REPOSITORY_CACHE_DOCUMENT_TTL', '300'))
+
+
+def repository_version(manifest):
+    """
+    Return the version of stored repository content: the id of the last
+    commit it was built from, or the index version for content without one
+    """
+    content = (manifest or {}).get('content', {})
+    return (content.get('last_commit') or {}).get('id') or (manifest or {}).get('index_version')
+
+
+def estimate_size(value):
+    """Approximate memory footprint of a cached value in bytes"""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bytes):
+        return len(value)
+    return len(json.dumps(value, default=str))
+
+
+class RepositoryCache:
+    def __init__(self, max_bytes=REPOSITORY_CACHE_MAX_BYTES, document_ttl=REPOSITORY_CACHE_DOCUMENT_TTL, clock=time.monotonic):
+        """
+        Initialize the cache
+
+        Args:
+            max_bytes: Maximum estimated size of all cached values; 0 disables the cache
+            document_ttl: Seconds project/manifest documents stay valid
+            clock: Time source (for tests)
+        """
+        self.max_bytes = max_bytes
+        self.document_ttl = document_ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # (project_id, version, name) -> (stored_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, project_id, version, name, max_age=None):
+        """
+        Look up a cached value
+
+        Args:
+            project_id: GitLab project ID
+            version: Repository version (see repository_version)
+            name: Entry name within the project version
+            max_age: Seconds after which the entry is considered stale (optional)
+
+        Returns:
+            Cached value or None
+        """
+        key = (str(project_id), version, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and max_age is not None and self._clock() - entry[0] > max_age:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, project_id, version, name, value, size=None):
+        """
+        Cache a value, evicting least recently used entries beyond max_bytes.
+        Values larger than the whole cache are not stored.
+
+        Args:
+            project_id: GitLab project ID
+            version: Repository version (see repository_version)
+            name: Entry name within the project version
+            value: Value to cache (treated as immutable by callers)
+            size: Size in bytes (default: estimate_size(value))
+        """
+        if value is None:
+            return
+        size = estimate_size(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        key = (str(project_id), version, name)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (self._clock(), size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_documents(self, project_id):
+        """Return the cached (project metadata, manifest) pair if still fresh, else None"""
+        return self.get(project_id, None, 'documents', max_age=self.document_ttl)
+
+    def set_documents(self, project_id, project_metadata, manifest):
+        """Cache the project metadata and repository manifest documents of a project"""
+        if project_metadata is None or manifest is None:
+            return
+        self.set(project_id, None, 'documents', (project_metadata, manifest), size=estimate_size([project_metadata, manifest]))
+
+    def invalidate(self, project_id):
+        """Drop every entry of a project (after its stored content changed)"""
+        project_id = str(project_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == project_id]:
+                self._drop(key)
+            self.invalidations += 1
+        logger.info(f"Invalidated cached repository content for project {project_id}")
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[1]
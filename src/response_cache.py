@@ -0,0 +1,209 @@
+"""
+Content-addressed cache for generated AI responses.
+
+Responses are keyed on a fingerprint of the model, response mode, system
+instruction and full prompt, so redelivered webhooks or edits that leave the
+effective prompt unchanged do not trigger another model call.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Backend: "memory" (LRU with TTL), "sqlite" (on-disk) or "off"
+AI_RESPONSE_CACHE = os.getenv('AI_RESPONSE_CACHE', 'memory').lower()
+AI_RESPONSE_CACHE_PATH = os.getenv('AI_RESPONSE_CACHE_PATH', 'ai_response_cache.sqlite3')
+AI_RESPONSE_CACHE_TTL = int(os.getenv('AI_RESPONSE_CACHE_TTL', '86400'))
+AI_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('AI_RESPONSE_CACHE_MAX_ENTRIES', '512'))
+
+
+def make_fingerprint(model_name, mode, system_instruction, prompt):
+    """
+    Build the cache key for a generation request
+
+    Args:
+        model_name: Model identifier
+        mode: Response mode (socratic, explanation, ...)
+        system_instruction: System instruction text
+        prompt: Full prompt text
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    for part in (model_name, mode, system_instruction, prompt):
+        encoded = (part or "").encode("utf-8")
+        # Length-prefix each part so different splits never collide
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class ResponseCache(ABC):
+    """Base class tracking hit and miss counters; backends implement storage"""
+
+    def __init__(self, ttl=AI_RESPONSE_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up a cached response
+
+        Args:
+            key: Fingerprint from make_fingerprint
+
+        Returns:
+            Cached response text or None
+        """
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Store a response
+
+        Args:
+            key: Fingerprint from make_fingerprint
+            value: Response text
+        """
+        self._set(key, value)
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries"""
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'entries': self._size()
+        }
+
+    @abstractmethod
+    def _get(self, key):
+        """Return the stored response for key, or None if missing or expired"""
+
+    @abstractmethod
+    def _set(self, key, value):
+        """Store a response under key"""
+
+    @abstractmethod
+    def _size(self):
+        """Return the number of stored entries"""
+
+
+class InMemoryResponseCache(ResponseCache):
+    def __init__(self, max_entries=AI_RESPONSE_CACHE_MAX_ENTRIES, ttl=AI_RESPONSE_CACHE_TTL):
+        """
+        Bounded LRU cache with a time-to-live
+
+        Args:
+            max_entries: Maximum number of cached responses
+            ttl: Seconds a response stays valid
+        """
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _size(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteResponseCache(ResponseCache):
+    def __init__(self, path=AI_RESPONSE_CACHE_PATH, ttl=AI_RESPONSE_CACHE_TTL):
+        """
+        On-disk cache shared across restarts
+
+        Args:
+            path: SQLite database file
+            ttl: Seconds a response stays valid
+        """
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl,))
+            self._db.commit()
+
+    def _get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM responses WHERE key = ? AND stored_at >= ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, value, time.time())
+            )
+            self._db.commit()
+
+    def _size(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide response cache configured by AI_RESPONSE_CACHE,
+    or None when caching is disabled
+    """
+    global _response_cache
+    if AI_RESPONSE_CACHE == 'off':
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            if AI_RESPONSE_CACHE == 'sqlite':
+                _response_cache = SQLiteResponseCache()
+            else:
+                _response_cache = InMemoryResponseCache()
+            logger.info(f"AI response cache enabled ({AI_RESPONSE_CACHE})")
+        return _response_cache
@@ -0,0 +1,222 @@
+"""
+Lexical (BM25) retrieval index over chunked repository file contents.
+
+The index only stores chunk locations (path and character offsets) and term
+statistics; chunk text is read back from the stored file contents.
+"""
+import json
+import logging
+import math
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Target chunk size in characters (chunks are cut on line boundaries)
+CHUNK_TARGET_CHARS = 800
+
+INDEX_FORMAT_VERSION = 1
+
+_WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+_CAMEL_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in into is it its me my no not of on or
+so that the their then there these this to was we were what when where which while who will
+with you your can do does did how why just get got use using
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase search terms. Identifiers are indexed both whole
+    and split into their camelCase / snake_case parts.
+
+    Args:
+        text: Text to tokenize
+
+    Returns:
+        List of terms (with repetitions)
+    """
+    terms = []
+    for word in _WORD_PATTERN.findall(text):
+        lowered = word.lower()
+        if len(lowered) > 1 and lowered not in STOPWORDS:
+            terms.append(lowered)
+        parts = [part for piece in word.split("_") for part in _CAMEL_PATTERN.findall(piece)]
+        if len(parts) > 1:
+            for part in parts:
+                part = part.lower()
+                if len(part) > 1 and part not in STOPWORDS:
+                    terms.append(part)
+    return terms
+
+
+def chunk_content(content: str, target_chars: int = CHUNK_TARGET_CHARS) -> List[Tuple[int, int]]:
+    """
+    Split content into chunks of roughly target_chars, cutting on line boundaries
+
+    Args:
+        content: File content
+        target_chars: Approximate chunk size
+
+    Returns:
+        List of (start, end) character offsets
+    """
+    chunks = []
+    start = 0
+    position = 0
+    for line in content.splitlines(keepends=True):
+        position += len(line)
+        if position - start >= target_chars:
+            chunks.append((start, position))
+            start = position
+    if position > start:
+        chunks.append((start, position))
+    return chunks
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize an empty index
+
+        Args:
+            k1: BM25 term frequency saturation
+            b: BM25 length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self.chunks = {}      # chunk id -> [path, start, end, length]
+        self.postings = {}    # term -> {chunk id: term frequency}
+        self.paths = {}       # path -> [chunk ids]
+        self.total_length = 0
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def add_document(self, path: str, content: str):
+        """
+        Index a file, replacing any previous version of it
+
+        Args:
+            path: File path
+            content: File content
+        """
+        self.remove_document(path)
+        path_terms = tokenize(path.replace("/", " ").replace(".", " "))
+        chunk_ids = []
+        for start, end in chunk_content(content):
+            terms = tokenize(content[start:end]) + path_terms
+            if not terms:
+                continue
+            chunk_id = str(self.next_id)
+            self.next_id += 1
+            self.chunks[chunk_id] = [path, start, end, len(terms)]
+            self.total_length += len(terms)
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, {})[chunk_id] = frequency
+            chunk_ids.append(chunk_id)
+        self.paths[path] = chunk_ids
+
+    def remove_document(self, path: str):
+        """
+        Remove a file from the index
+
+        Args:
+            path: File path
+        """
+        chunk_ids = self.paths.pop(path, None)
+        if not chunk_ids:
+            return
+        removed = set(chunk_ids)
+        for chunk_id in chunk_ids:
+            self.total_length -= self.chunks.pop(chunk_id)[3]
+        for term in list(self.postings):
+            entries = self.postings[term]
+            for chunk_id in removed.intersection(entries):
+                del entries[chunk_id]
+            if not entries:
+                del self.postings[term]
+
+    def search(self, query: str, top_k: int = 10) -> List[Dict]:
+        """
+        Rank chunks against a query
+
+        Args:
+            query: Free-text query (issue title, description, comments)
+            top_k: Maximum number of results
+
+        Returns:
+            List of dictionaries with path, start, end and score, best first
+        """
+        if not self.chunks:
+            return []
+        chunk_count = len(self.chunks)
+        average_length = self.total_length / chunk_count
+        scores = {}
+        for term in set(tokenize(query)):
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            idf = math.log(1 + (chunk_count - len(entries) + 0.5) / (len(entries) + 0.5))
+            for chunk_id, frequency in entries.items():
+                length = self.chunks[chunk_id][3]
+                norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], int(item[0])))[:top_k]
+        return [
+            {"path": self.chunks[chunk_id][0], "start": self.chunks[chunk_id][1],
+             "end": self.chunks[chunk_id][2], "score": score}
+            for chunk_id, score in ranked
+        ]
+
+    def to_bytes(self) -> bytes:
+        """Serialize the index to compressed bytes"""
+        data = {
+            "version": INDEX_FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "chunks": self.chunks,
+            "postings": self.postings,
+            "paths": self.paths,
+            "total_length": self.total_length,
+            "next_id": self.next_id,
+        }
+        return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> Optional["BM25Index"]:
+        """
+        Deserialize an index produced by to_bytes
+
+        Returns:
+            BM25Index, or None if the data uses an unknown format
+        """
+        data = json.loads(zlib.decompress(raw).decode("utf-8"))
+        if data.get("version") != INDEX_FORMAT_VERSION:
+            logger.warning(f"Ignoring retrieval index with unsupported version {data.get('version')}")
+            return None
+        index = cls(k1=data["k1"], b=data["b"])
+        index.chunks = data["chunks"]
+        index.postings = data["postings"]
+        index.paths = data["paths"]
+        index.total_length = data["total_length"]
+        index.next_id = data["next_id"]
+        return index
+
+    @classmethod
+    def build(cls, files: Dict[str, Dict]) -> "BM25Index":
+        """
+        Build an index from an important_files dictionary
+
+        Args:
+            files: Mapping of path to file info with a "content" key
+        """
+        index = cls()
+        for path, file_info in files.items():
+            index.add_document(path, file_info.get("content", ""))
+        return index
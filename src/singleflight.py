@@ -0,0 +1,182 @@
+"""
+Duplicate suppression for expensive per-key work (e.g. crawling a repository).
+
+SingleFlight lets concurrent callers with the same key share one execution.
+KeyedLock serializes work per key inside the process, and held_lease extends
+that across instances with an external lease (see FirestoreManager.acquire_lease).
+"""
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseTimeout(Exception):
+    """Raised when a lease held by another owner was not released in time"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = 0
+
+
+class _KeyState:
+    def __init__(self):
+        self.running = None
+        self.pending = None
+
+
+class SingleFlight:
+    """Use either do or do_after for a given key, not both"""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs), or wait for the call already running for key
+        and share its result (or exception)
+
+        Returns:
+            Tuple of (result, shared) where shared tells whether the result
+            came from another caller's execution
+        """
+        with self._lock:
+            state = self._states.setdefault(key, _KeyState())
+            if state.running is not None:
+                call = state.running
+                call.shared += 1
+                leader = False
+            else:
+                call = state.running = _Call()
+                leader = True
+        if not leader:
+            return self._wait(call), True
+        return self._execute(key, state, call, fn, args, kwargs), False
+
+    def do_after(self, key, fn, *args, **kwargs):
+        """
+        Like do, but never share an execution that has already started: the
+        caller waits for it and then runs fn once more. Callers arriving while
+        that follow-up run is still waiting share it, so a burst collapses into
+        at most one running and one queued execution per key. Use it when an
+        execution that started earlier may miss the caller's change.
+
+        Returns:
+            Tuple of (result, shared)
+        """
+        with self._lock:
+            state = self._states.setdefault(key, _KeyState())
+            if state.pending is not None:
+                call = state.pending
+                call.shared += 1
+                leader = False
+            elif state.running is not None:
+                call = state.pending = _Call()
+                previous = state.running
+                leader = True
+            else:
+                call = state.running = _Call()
+                previous = None
+                leader = True
+        if not leader:
+            return self._wait(call), True
+        if previous is not None:
+            previous.done.wait()
+            with self._lock:
+                state.running = call
+                state.pending = None
+        return self._execute(key, state, call, fn, args, kwargs), False
+
+    def in_flight(self, key):
+        """Return True while a call for key is running or queued"""
+        with self._lock:
+            return key in self._states
+
+    def _execute(self, key, state, call, fn, args, kwargs):
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if state.running is call:
+                    state.running = None
+                if state.running is None and state.pending is None:
+                    self._states.pop(key, None)
+            if call.shared:
+                logger.info(f"Shared result of {key} with {call.shared} concurrent caller(s)")
+            call.done.set()
+
+    def _wait(self, call):
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class KeyedLock:
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        """Hold the lock of key for the duration of the with block"""
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+@contextmanager
+def held_lease(acquire, release, ttl, wait_timeout, poll_interval=2.0, sleep=time.sleep, clock=time.monotonic):
+    """
+    Hold an external lease for the duration of the with block, polling until
+    the current holder releases it or it expires
+
+    Args:
+        acquire: Callable(owner, ttl) returning True when the lease was taken,
+                 False when another owner holds it, or None when the lease
+                 store is unavailable (the block then runs without a lease)
+        release: Callable(owner) releasing the lease
+        ttl: Seconds after which an unreleased lease expires
+        wait_timeout: Seconds to wait for another owner's lease
+        poll_interval: Seconds between acquisition attempts
+
+    Raises:
+        LeaseTimeout: if the lease could not be taken within wait_timeout
+    """
+    owner = uuid.uuid4().hex
+    deadline = clock() + wait_timeout
+    while True:
+        acquired = acquire(owner, ttl)
+        if acquired is None:
+            logger.warning("Lease store unavailable; continuing without a lease")
+            yield None
+            return
+        if acquired:
+            break
+        if clock() >= deadline:
+            raise LeaseTimeout(f"Lease still held by another owner after {wait_timeout}s")
+        sleep(poll_interval)
+    try:
+        yield owner
+    finally:
+        release(owner)